@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Micro benchmarks, run against the test models:
+
+    python benchmarks.py codegen --number=2000
+    python benchmarks.py json_mapping
+    python benchmarks.py nested --fanout=4
+    python benchmarks.py readonly --number=100000
+    python benchmarks.py storage
+    python benchmarks.py bytes_fields --size=4194304
+    python benchmarks.py compressed --items=2000
+"""
+
+from __future__ import absolute_import, print_function
+import logging
+import sys
+import timeit
+import types
+
+import fire
+from django.apps import apps
+from django.conf import settings
+
+
+settings.configure(
+    DATABASES={
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        }
+    },
+    INSTALLED_APPS=[
+        'pb_model',
+        'pb_model.tests',
+    ],
+    USE_TZ=True,
+)
+
+apps.populate(settings.INSTALLED_APPS)
+
+
+def _report(name, number, seconds):
+    print("{:<32} {:>10.2f} us/op".format(name, seconds / number * 1e6))
+
+
+def _table_size(model):
+    """Bytes used by the table of a model, None when the database can't tell (SQLite without dbstat)"""
+    from django.db import DatabaseError, connection
+
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT pg_total_relation_size(%s)'
+    elif connection.vendor == 'sqlite':
+        sql = 'SELECT SUM(pgsize) FROM dbstat WHERE name = %s'
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [model._meta.db_table])
+            return cursor.fetchone()[0]
+    except DatabaseError:
+        return None
+
+
+def _report_size(name, model, rows):
+    size = _table_size(model)
+    if size is None:
+        print("{:<32} {:>10} bytes/row (table size unavailable)".format(name, 'n/a'))
+    else:
+        print("{:<32} {:>10.1f} bytes/row".format(name, size / float(rows)))
+
+
+def codegen(number=2000):
+    """Generic vs generated to_pb/from_pb of a Main message without relations"""
+    from django.test.utils import override_settings
+    from pb_model import codegen as pb_codegen
+    from pb_model.tests import models
+
+    module_name = 'benchmark_generated_serializers'
+    module = types.ModuleType(module_name)
+    exec(compile(pb_codegen.generate_for_apps(['tests'])[0], module_name, 'exec'), module.__dict__)
+    sys.modules[module_name] = module
+
+    main = models.Main(
+        id=1, string_field='Hello world', integer_field=2017, float_field=3.5, bool_field=True,
+        fk_field=models.Relation(id=1, num=10)
+    )
+    pb_obj = main.to_pb(expand_level=0)
+
+    for label, module_setting in (('generic', None), ('generated', module_name)):
+        with override_settings(PB_MODEL_CODEGEN_MODULE=module_setting):
+            _report('{} to_pb'.format(label), number,
+                    timeit.timeit(lambda: main.to_pb(expand_level=0), number=number))
+            _report('{} from_pb'.format(label), number,
+                    timeit.timeit(lambda: models.Main().from_pb(pb_obj), number=number))
+
+
+def json_mapping(number=2000):
+    """MessageToDict(to_pb()) vs to_pb_dict() of a Main message without relations"""
+    from google.protobuf import json_format
+    from pb_model.tests import models
+
+    main = models.Main(
+        id=1, string_field='Hello world', integer_field=2017, float_field=3.5, bool_field=True,
+        fk_field=models.Relation(id=1, num=10)
+    )
+    _report('MessageToDict(to_pb())', number,
+            timeit.timeit(lambda: json_format.MessageToDict(main.to_pb(expand_level=0)), number=number))
+    _report('to_pb_dict()', number,
+            timeit.timeit(lambda: main.to_pb_dict(expand_level=0), number=number))
+
+    pb_dict = main.to_pb_dict(expand_level=0)
+    _report('from_pb(ParseDict())', number,
+            timeit.timeit(lambda: models.Main().from_pb(json_format.ParseDict(pb_dict, models.Main.pb_model())),
+                          number=number))
+    _report('from_pb_dict()', number, timeit.timeit(lambda: models.Main().from_pb_dict(pb_dict), number=number))
+
+
+def _nested_models(depth):
+    """Messages and models Level0 -> ... -> Level<depth>, each with a ForeignKey and an m2m to the next level"""
+    from django.db import connection, models
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+    from pb_model.models import ProtoBufMixin
+
+    file_proto = descriptor_pb2.FileDescriptorProto(name='benchmark_nested.proto', package='benchmark', syntax='proto3')
+    for level in range(depth + 1):
+        message = file_proto.message_type.add(name='Level{}'.format(level))
+        message.field.add(name='id', number=1, type=descriptor_pb2.FieldDescriptorProto.TYPE_INT32)
+        message.field.add(name='name', number=2, type=descriptor_pb2.FieldDescriptorProto.TYPE_STRING)
+        if level < depth:
+            child_type = '.benchmark.Level{}'.format(level + 1)
+            message.field.add(name='child', number=3, type=descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE,
+                              type_name=child_type)
+            message.field.add(name='children', number=4, type=descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE,
+                              type_name=child_type, label=descriptor_pb2.FieldDescriptorProto.LABEL_REPEATED)
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    factory = message_factory.MessageFactory(pool)
+
+    dj_models = {}
+    for level in reversed(range(depth + 1)):
+        attrs = {
+            '__module__': __name__,
+            'Meta': type('Meta', (), {'app_label': 'tests'}),
+            'pb_model': factory.GetPrototype(pool.FindMessageTypeByName('benchmark.Level{}'.format(level))),
+            'name': models.CharField(max_length=32),
+        }
+        if level < depth:
+            attrs['child'] = models.ForeignKey(dj_models[level + 1], on_delete=models.CASCADE, related_name='+')
+            attrs['children'] = models.ManyToManyField(dj_models[level + 1], related_name='+')
+        dj_models[level] = type(str('BenchmarkLevel{}'.format(level)), (ProtoBufMixin, models.Model), attrs)
+
+    with connection.schema_editor() as schema_editor:
+        for model in dj_models.values():
+            schema_editor.create_model(model)
+    return dj_models
+
+
+def nested(fanout=4, depth=3, number=20, repeat=5):
+    """to_pb() of a depth 3 expansion, nested messages filled in place vs built apart and copied into the parent"""
+    from pb_model.models import ProtoBufMixin
+
+    dj_models = _nested_models(depth)
+
+    def create(level):
+        obj = dj_models[level](name='level{}'.format(level))
+        if level < depth:
+            obj.child = create(level + 1)
+            obj.save()
+            obj.children.set([create(level + 1) for _ in range(fanout)])
+        else:
+            obj.save()
+        return obj
+
+    create(0)
+    lookups = ['__'.join(['children'] * level) for level in range(1, depth + 1)]
+    root = dj_models[0].objects.prefetch_related(*lookups).get()
+    pb_obj = root.to_pb()
+    print("{} messages, {} bytes".format(
+        sum(fanout ** level + (fanout ** level - 1) for level in range(depth + 1)), pb_obj.ByteSize()
+    ))
+
+    to_pb = ProtoBufMixin.to_pb
+
+    def copying_to_pb(self, expand_level=None, into=None):
+        """to_pb() without ``into``: the message is built on its own, then copied into the parent"""
+        result = to_pb(self, expand_level=expand_level)
+        if into is None:
+            return result
+        into.CopyFrom(result)
+        return into
+
+    # interleaved runs, the best of each is reported
+    timings = {'in place': [], 'copied': []}
+    for _ in range(repeat):
+        for label, method in (('in place', to_pb), ('copied', copying_to_pb)):
+            ProtoBufMixin.to_pb = method
+            try:
+                assert root.to_pb() == pb_obj
+                timings[label].append(timeit.timeit(root.to_pb, number=number))
+            finally:
+                ProtoBufMixin.to_pb = to_pb
+    for label in ('in place', 'copied'):
+        _report('to_pb() depth {} {}'.format(depth, label), number, min(timings[label]))
+
+
+def readonly(number=100000):
+    """Model().from_pb() vs Model.pb_view() of Main messages, reading three attributes of each"""
+    import gc
+    import tracemalloc
+    from pb_model.tests import models
+
+    main = models.Main(
+        id=1, string_field='Hello world', integer_field=2017, float_field=3.5, bool_field=True,
+        fk_field=models.Relation(id=1, num=10)
+    )
+    pb_obj = main.to_pb(expand_level=0)
+    pb_obj.fk_field.id, pb_obj.fk_field.num = 1, 10
+    data = pb_obj.SerializeToString()
+    pb_objs = [models.Main.pb_model.FromString(data) for _ in range(number)]
+
+    for label, convert in (('from_pb', lambda pb_obj: models.Main().from_pb(pb_obj)),
+                           ('pb_view', models.Main.pb_view)):
+        gc.collect()
+        tracemalloc.start()
+        start = timeit.default_timer()
+        objs = [convert(pb_obj) for pb_obj in pb_objs]
+        for obj in objs:
+            obj.string_field, obj.datetime_field, obj.fk_field.num
+        seconds = timeit.default_timer() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del objs
+        _report(label, number, seconds)
+        print("{:<32} {:>10.0f} bytes/op".format('', size / number))
+
+
+def storage(number=10000):
+    """Table size and conversion time of the scalar Root fields, default column types vs the compact profile"""
+    from django.db import connection, models
+    from pb_model.models import ProtoBufMixin
+    from pb_model.tests import models_pb2
+
+    scalar_fields = [
+        'uint32_field', 'int32_field', 'uint64_field', 'int64_field', 'float_field', 'double_field',
+        'string_field', 'bytes_field', 'bool_field', 'enum_field',
+    ]
+    # the other Root fields aren't mapped, don't time their warnings
+    logging.getLogger('pb_model.models').setLevel(logging.ERROR)
+    pb_root = models_pb2.Root(uint32_field=7, int32_field=-7, int64_field=2 ** 40, double_field=0.5,
+                              string_field='str', bool_field=True, enum_field=models_pb2.Enum_ONE)
+
+    for profile in (None, 'compact'):
+        model = type(str('BenchmarkStorage{}'.format(profile or 'Default').title()), (ProtoBufMixin, models.Model), {
+            '__module__': __name__,
+            'Meta': type('Meta', (), {'app_label': 'tests'}),
+            'pb_model': models_pb2.Root,
+            'pb_storage_profile': profile,
+            'pb_2_dj_fields': scalar_fields,
+        })
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(model)
+        model.objects.bulk_create([model().from_pb(pb_root) for _ in range(number)])
+
+        obj = model.objects.first()
+        label = profile or 'default'
+        _report_size(label, model, number)
+        _report('{} to_pb'.format(label), number, timeit.timeit(obj.to_pb, number=number))
+        _report('{} from_pb'.format(label), number, timeit.timeit(lambda: model().from_pb(pb_root), number=number))
+
+
+def bytes_fields(size=4 * 1024 * 1024, number=10):
+    """Bytes allocated per to_pb/from_pb of a large bytes field, in multiples of the payload size"""
+    import tracemalloc
+    from pb_model.tests import models
+
+    logging.getLogger('pb_model.models').setLevel(logging.ERROR)
+    payload = b'x' * size
+    inputs = (
+        ('bytes', payload),
+        ('memoryview(bytes)', memoryview(payload)),
+        ('memoryview(bytearray)', memoryview(bytearray(payload))),
+    )
+
+    def copies(func):
+        tracemalloc.start()
+        start = timeit.default_timer()
+        for _ in range(number):
+            func()
+        seconds = timeit.default_timer() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return seconds, peak / float(size)
+
+    for label, value in inputs:
+        obj = models.CompactRoot(bytes_field=value)
+        seconds, copied = copies(obj.to_pb)
+        _report('to_pb {}'.format(label), number, seconds)
+        print("{:<32} {:>10.2f} x payload".format('', copied))
+
+    pb_obj = models.CompactRoot(bytes_field=payload).to_pb()
+    seconds, copied = copies(lambda: models.CompactRoot().from_pb(pb_obj))
+    _report('from_pb', number, seconds)
+    print("{:<32} {:>10.2f} x payload".format('', copied))
+
+
+def compressed(items=2000, number=200):
+    """Table size and save/load/to_pb round trip of large Root fields, plain vs compressed columns"""
+    import random
+    from django.db import connection, models
+    from pb_model import fields
+    from pb_model.models import ProtoBufMixin
+    from pb_model.tests import models_pb2
+
+    logging.getLogger('pb_model.models').setLevel(logging.ERROR)
+    rand = random.Random(0)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta'] + [str(n) for n in range(100)]
+
+    def text():
+        return ' '.join(rand.choice(words) for _ in range(8))
+
+    pb_roots = [models_pb2.Root(
+        string_field=' '.join(text() for _ in range(items // 8)),
+        bytes_field=models_pb2.Root(repeated_string_field=[text() for _ in range(items // 8)]).SerializeToString(),
+        repeated_string_field=[text() for _ in range(items)],
+        map_string_to_string_field={str(n): text() for n in range(items)},
+    ) for _ in range(10)]
+
+    for label, compressed_types in (('plain', {}), ('compressed', fields.COMPRESSED_FIELD_TYPES)):
+        mapping = dict(ProtoBufMixin.pb_auto_field_type_mapping)
+        mapping.update(compressed_types)
+        model = type(str('BenchmarkCompression{}'.format(label.title())), (ProtoBufMixin, models.Model), {
+            '__module__': __name__,
+            'Meta': type('Meta', (), {'app_label': 'tests'}),
+            'pb_model': models_pb2.Root,
+            'pb_auto_field_type_mapping': mapping,
+            'pb_2_dj_fields': ['string_field', 'bytes_field', 'repeated_string_field', 'map_string_to_string_field'],
+        })
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(model)
+
+        def round_trip(counter=iter(range(number))):
+            obj = model().from_pb(pb_roots[next(counter) % len(pb_roots)])
+            obj.save()
+            return model.objects.get(pk=obj.pk).to_pb()
+
+        seconds = timeit.timeit(round_trip, number=number)
+        _report_size(label, model, number)
+        _report('{} round trip'.format(label), number, seconds)
+
+
+if __name__ == '__main__':
+    fire.Fire()
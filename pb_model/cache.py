@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Process level cache of ForeignKey targets used while serializing.
+
+Models with ``pb_reference_cache`` set (``True`` or ``{'max_size': ..., 'ttl': ...}``)
+are "reference" models: ``to_pb()`` of objects pointing at them looks the target up
+by the foreign key value and merges its cached serialized message instead of
+fetching and serializing the row again. The field values of the fetched instance
+are kept too: every hit builds a new instance from them and sets it as the related
+object, so later attribute access doesn't query either and referrers never share
+a mutable instance.
+
+Entries are dropped after ``ttl`` seconds, the least recently used ones beyond
+``max_size``, and on ``post_save``/``post_delete`` of the target or any queryset
+``update()``/``delete()`` of the model. Changes of rows nested in a cached message
+are only picked up after ``ttl``.
+"""
+
+from __future__ import absolute_import
+import collections
+import copy
+import threading
+import time
+
+from django.db.models.signals import post_delete, post_save
+
+
+DEFAULT_MAX_SIZE = 1000
+DEFAULT_TTL = 300
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def _instance_state(instance):
+    """(model, db alias, attnames, values) of the loaded concrete fields of an instance"""
+    if instance is None:
+        return None
+    attnames = tuple(f.attname for f in instance._meta.concrete_fields if f.attname in instance.__dict__)
+    return type(instance), instance._state.db, attnames, tuple(getattr(instance, name) for name in attnames)
+
+
+def _build_instance(state):
+    """New instance holding copies of the cached field values"""
+    if state is None:
+        return None
+    model, db, attnames, values = state
+    return model.from_db(db, attnames, copy.deepcopy(values))
+
+
+class ReferenceCache(object):
+    """LRU cache of instances and their serialized messages with a TTL
+
+    Instances are stored as field values, ``get()`` returns a new instance on every hit.
+
+    :param max_size: number of cached objects
+    :param ttl: seconds an entry stays valid
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL, timer=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self._entries = collections.OrderedDict()  # pk -> [expires_at, instance state, {expand_level: bytes}]
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _entry(self, pk):
+        entry = self._entries.get(pk)
+        if entry is None:
+            return None
+        if entry[0] < self.timer():
+            del self._entries[pk]
+            return None
+        self._entries.pop(pk)
+        self._entries[pk] = entry
+        return entry
+
+    def get(self, pk, expand_level=None):
+        """(new instance, serialized message), None when missing or expired"""
+        with self._lock:
+            entry = self._entry(pk)
+            data = entry[2].get(expand_level) if entry is not None else None
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            state = entry[1]
+        return _build_instance(state), data
+
+    def set(self, pk, instance, data, expand_level=None):
+        state = _instance_state(instance)
+        with self._lock:
+            entry = self._entry(pk)
+            if entry is None or entry[1] != state:
+                entry = self._entries[pk] = [self.timer() + self.ttl, state, {}]
+            entry[2][expand_level] = data
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, pk):
+        with self._lock:
+            self._entries.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _invalidate(sender, instance, **_):
+    reference_cache = _CACHES.get(sender)
+    if reference_cache is not None:
+        reference_cache.invalidate(instance.pk)
+
+
+def get_reference_cache(model):
+    """Cache of a model with ``pb_reference_cache``, None for other models"""
+    try:
+        return _CACHES[model]
+    except KeyError:
+        pass
+
+    options = getattr(model, 'pb_reference_cache', None)
+    if not options:
+        return None
+    with _CACHES_LOCK:
+        if model not in _CACHES:
+            options = options if isinstance(options, dict) else {}
+            _CACHES[model] = ReferenceCache(**options)
+            post_save.connect(_invalidate, sender=model, weak=False, dispatch_uid=('pb_reference_cache', model))
+            post_delete.connect(_invalidate, sender=model, weak=False, dispatch_uid=('pb_reference_cache', model))
+    return _CACHES[model]
+
+
+def clear_model(model):
+    """Drop all cached objects of a model"""
+    reference_cache = _CACHES.get(model)
+    if reference_cache is not None:
+        reference_cache.clear()
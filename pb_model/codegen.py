@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Ahead-of-time generation of specialized ``to_pb``/``from_pb`` functions.
+
+``manage.py pb_codegen <path>`` writes a plain Python module with one pair of
+functions per ``ProtoBufMixin`` model. Scalar, wrapper, ``DateTimeField`` and
+``UUIDField`` conversions are inlined as straight-line code, every other field
+calls back into the generic per-field path.
+
+Point ``settings.PB_MODEL_CODEGEN_MODULE`` to the generated module to use it.
+A model only uses its generated functions while the schema fingerprint stored
+in the module matches the model, otherwise the generic path is used. A model
+whose generated function raised is switched to the generic path for good,
+see ``disable()``.
+"""
+
+from __future__ import absolute_import
+import functools
+import hashlib
+import importlib
+import logging
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from google.protobuf import descriptor_pb2
+
+from . import fields
+
+
+LOGGER = logging.getLogger(__name__)
+
+CODEGEN_VERSION = 1
+
+_COMPILED = {}
+_MODULES = {}  # module name in key, REGISTRY or None when the import failed in value
+_DJ_FIELD_MAPS = {}
+
+
+@receiver(setting_changed)
+def _reset_compiled(setting, **_):
+    if setting in ('PB_MODEL_CODEGEN_MODULE', 'USE_TZ'):
+        _COMPILED.clear()
+        _MODULES.clear()
+
+
+def _qualified_name(obj):
+    if isinstance(obj, functools.partial):
+        return '{}{}'.format(_qualified_name(obj.func), sorted(obj.keywords.items()))
+    return '{}.{}'.format(obj.__module__, getattr(obj, '__qualname__', obj.__name__))
+
+
+def _serializer_names(funcs):
+    return tuple(_qualified_name(func) for func in funcs if func is not None)
+
+
+def fingerprint(model):
+    """Hash of everything the generated functions of a model depend on
+
+    :param model: ProtoBufMixin model class
+    :returns: hex digest
+    """
+    descriptor_proto = descriptor_pb2.DescriptorProto()
+    model.pb_model.DESCRIPTOR.CopyToProto(descriptor_proto)
+
+    serializers = sorted(
+        (str(key), _serializer_names(funcs)) for key, funcs in model.pb_2_dj_field_serializers.items()
+    )
+    dj_fields = sorted(
+        (f.name, _qualified_name(type(f)), f.null) for f in model._meta.get_fields()
+    )
+    state = repr((
+        CODEGEN_VERSION,
+        model.pb_type_cast,
+        settings.USE_TZ,
+        sorted(model.pb_2_dj_field_map.items()),
+        serializers,
+        _serializer_names(model.default_serializers),
+        dj_fields,
+    )).encode('utf-8')
+    return hashlib.sha1(descriptor_proto.SerializeToString() + state).hexdigest()
+
+
+def _registry(module_name):
+    """REGISTRY of a generated module, None when it can't be imported"""
+    try:
+        return _MODULES[module_name]
+    except KeyError:
+        pass
+
+    try:
+        registry = importlib.import_module(module_name).REGISTRY
+    except (ImportError, AttributeError) as e:
+        LOGGER.error("Can't load generated serializers from %s, using the generic path: %s", module_name, e)
+        registry = None
+    _MODULES[module_name] = registry
+    return registry
+
+
+def get_compiled(model):
+    """Generated (to_pb, from_pb) pair of a model, None when missing, stale or disabled
+
+    :param model: ProtoBufMixin model class
+    """
+    try:
+        return _COMPILED[model]
+    except KeyError:
+        pass
+
+    compiled = None
+    module_name = getattr(settings, 'PB_MODEL_CODEGEN_MODULE', None)
+    registry = _registry(module_name) if module_name else None
+    if registry is not None:
+        entry = registry.get(model._meta.label)
+        if entry is None:
+            LOGGER.debug("No generated serializers for %s", model._meta.label)
+        elif entry[0] != fingerprint(model):
+            LOGGER.warning("Generated serializers for %s are stale, using the generic path", model._meta.label)
+        else:
+            compiled = entry[1:]
+    _COMPILED[model] = compiled
+    return compiled
+
+
+def disable(model):
+    """Use the generic path for a model from now on, e.g. after its generated function raised
+
+    :param model: ProtoBufMixin model class
+    """
+    _COMPILED[model] = None
+
+
+def _dj_field_map(obj):
+    model = type(obj)
+    try:
+        return _DJ_FIELD_MAPS[model]
+    except KeyError:
+        field_map = _DJ_FIELD_MAPS[model] = {f.name: f for f in obj._meta.get_fields()}
+        return field_map
+
+
+def generic_field_to_pb(obj, pb_obj, pb_field_name, expand_level):
+    """Generic conversion of a single field, used by generated code"""
+    obj._field_to_pb(obj.pb_model.DESCRIPTOR.fields_by_name[pb_field_name], pb_obj, _dj_field_map(obj), expand_level)
+
+
+def generic_field_from_pb(obj, pb_obj, pb_field_name):
+    """Generic conversion of a single field, used by generated code"""
+    obj._field_from_pb(
+        pb_obj.DESCRIPTOR.fields_by_name[pb_field_name], getattr(pb_obj, pb_field_name), _dj_field_map(obj)
+    )
+
+
+def _is_wrapper(pb_field):
+    return pb_field.message_type is not None and pb_field.message_type.name in fields.GFIELD_TYPE_CAST
+
+
+def _is_timestamp(pb_field):
+    return pb_field.message_type is not None and pb_field.message_type.full_name == 'google.protobuf.Timestamp'
+
+
+def _presence_check(pb_field):
+    if pb_field.label == pb_field.LABEL_REPEATED:
+        return 'len(pb_obj.{})'.format(pb_field.name)
+    if pb_field.message_type is not None or pb_field.containing_oneof is not None \
+            or pb_field.file.syntax == 'proto2':
+        return "pb_obj.HasField('{}')".format(pb_field.name)
+    return 'pb_obj.{}'.format(pb_field.name)
+
+
+class _ModelGenerator(object):
+    def __init__(self, model, module):
+        self.model = model
+        self.module = module
+        self.prefix = '{}_{}'.format(model._meta.app_label, model._meta.model_name)
+        self.dj_field_map = {f.name: f for f in model._meta.get_fields()}
+
+    def _field_kind(self, pb_field):
+        """Which inlined conversion applies to a field, None for the generic path"""
+        dj_field = self.dj_field_map.get(self.model.pb_2_dj_field_map.get(pb_field.name, pb_field.name))
+        if dj_field is None or pb_field.label == pb_field.LABEL_REPEATED:
+            return None, dj_field
+        if dj_field.is_relation or isinstance(dj_field, fields.ProtoBufFieldMixin):
+            return None, dj_field
+
+        serializers = self.model.pb_2_dj_field_serializers
+        funcs = serializers.get(type(dj_field)) or serializers.get(pb_field.name)
+        if funcs is None:
+            if tuple(self.model.default_serializers) != (fields._defaultfield_to_pb, fields._defaultfield_from_pb):
+                return None, dj_field
+            if pb_field.message_type is None:
+                return 'scalar', dj_field
+            if _is_wrapper(pb_field):
+                return 'wrapper', dj_field
+        elif funcs == (fields._datetimefield_to_pb, fields._datetimefield_from_pb) and _is_timestamp(pb_field):
+            return 'datetime', dj_field
+        elif funcs == (fields._uuid_to_pb, fields._uuid_from_pb) and pb_field.type == pb_field.TYPE_STRING:
+            return 'uuid', dj_field
+        return None, dj_field
+
+    def _cast_name(self, cast):
+        if cast.__module__ in ('builtins', '__builtin__'):
+            return cast.__name__
+        return self.module.add_import(cast)
+
+    def _to_python(self, pb_field, dj_field):
+        """Name of a module level ``to_python`` of the field type, None if it can't be built"""
+        try:
+            type(dj_field)()
+        except Exception:
+            return None
+        return self.module.add_global(
+            '_{}_{}_to_python'.format(self.prefix, pb_field.name),
+            '{}().to_python'.format(self.module.add_import(type(dj_field)))
+        )
+
+    def to_pb_lines(self):
+        lines = ['def {}_to_pb(obj, pb_obj, expand_level):'.format(self.prefix)]
+        for pb_field in self.model.pb_model.DESCRIPTOR.fields:
+            kind, dj_field = self._field_kind(pb_field)
+            if dj_field is None:
+                continue
+            if kind is None:
+                lines.append("    generic_field_to_pb(obj, pb_obj, '{}', expand_level)".format(pb_field.name))
+                continue
+
+            body = []
+            if kind == 'scalar':
+                cast = fields.FIELD_TYPE_CAST.get(pb_field.type) if self.model.pb_type_cast else None
+                if pb_field.type == pb_field.TYPE_BYTES:
+                    cast = fields.as_bytes
+                value = '{}(value)'.format(self._cast_name(cast)) if cast else 'value'
+                if cast and not dj_field.null:
+                    # keep assigning None, protobuf rejects it like the generic path does
+                    value = 'value if value is None else {}'.format(value)
+                body.append('pb_obj.{} = {}'.format(pb_field.name, value))
+            elif kind == 'wrapper':
+                cast = fields.GFIELD_TYPE_CAST[pb_field.message_type.name] if self.model.pb_type_cast else None
+                if pb_field.message_type.name == 'BytesValue':
+                    cast = fields.as_bytes
+                value = '{}(value)'.format(self._cast_name(cast)) if cast else 'value'
+                body.append('pb_obj.{}.value = {}'.format(pb_field.name, value))
+            elif kind == 'datetime':
+                if settings.USE_TZ:
+                    body.append('value = timezone.make_naive(value, timezone=timezone.utc)')
+                body.append('pb_obj.{}.FromDatetime(value)'.format(pb_field.name))
+            elif kind == 'uuid':
+                body.append('pb_obj.{} = str(value)'.format(pb_field.name))
+
+            lines.append('    value = obj.{}'.format(dj_field.attname))
+            if dj_field.null or kind == 'wrapper':
+                lines.append('    if value is not None:')
+                lines.extend('        ' + line for line in body)
+            else:
+                lines.extend('    ' + line for line in body)
+        lines.append('    return pb_obj')
+        return lines
+
+    def from_pb_lines(self):
+        lines = ['def {}_from_pb(obj, pb_obj):'.format(self.prefix)]
+        for pb_field in self.model.pb_model.DESCRIPTOR.fields:
+            kind, dj_field = self._field_kind(pb_field)
+            to_python = None
+            if kind in ('scalar', 'wrapper') and self.model.pb_type_cast:
+                if kind == 'wrapper' or pb_field.type in fields.FIELD_TYPE_CAST:
+                    to_python = self._to_python(pb_field, dj_field)
+                    if to_python is None:
+                        kind = None
+
+            lines.append('    if {}:'.format(_presence_check(pb_field)))
+            if kind is None:
+                lines.append("        generic_field_from_pb(obj, pb_obj, '{}')".format(pb_field.name))
+                continue
+
+            value = 'pb_obj.{}'.format(pb_field.name)
+            if kind == 'wrapper':
+                value += '.value'
+            elif kind == 'datetime':
+                value += '.ToDatetime()'
+                if settings.USE_TZ:
+                    value = 'timezone.localtime(timezone.make_aware({}, timezone.utc))'.format(value)
+            elif kind == 'uuid':
+                value = 'uuid.UUID({})'.format(value)
+            if to_python is not None:
+                value = '{}({})'.format(to_python, value)
+            lines.append('        obj.{} = {}'.format(dj_field.attname, value))
+        lines.append('    return obj')
+        return lines
+
+
+class _Module(object):
+    def __init__(self):
+        self.imports = {}
+        self.globals = []
+
+    def add_import(self, obj):
+        statement = 'from {} import {} as {{}}'.format(obj.__module__, obj.__name__)
+        alias, index = '_{}'.format(obj.__name__), 1
+        while self.imports.get(alias, statement) != statement:
+            alias, index = '_{}_{}'.format(obj.__name__, index), index + 1
+        self.imports[alias] = statement
+        return alias
+
+    def add_global(self, name, expression):
+        self.globals.append('{} = {}'.format(name, expression))
+        return name
+
+
+def generate_module(pb_models):
+    """Source of a module with generated serializers for the given models
+
+    :param pb_models: iterable of ProtoBufMixin model classes
+    :returns: str
+    """
+    module = _Module()
+    functions, registry = [], []
+    for model in sorted(pb_models, key=lambda m: m._meta.label):
+        generator = _ModelGenerator(model, module)
+        functions.append('\n'.join(generator.to_pb_lines()))
+        functions.append('\n'.join(generator.from_pb_lines()))
+        registry.append("    '{}': ('{}', {}_to_pb, {}_from_pb),".format(
+            model._meta.label, fingerprint(model), generator.prefix, generator.prefix
+        ))
+
+    header = [
+        '# -*- coding: utf-8 -*-',
+        '# Generated by pb_codegen, do not edit: re-run `manage.py pb_codegen` after model changes.',
+        '',
+        'from __future__ import absolute_import',
+        'import uuid',
+        '',
+        'from django.utils import timezone',
+        '',
+        'from pb_model.codegen import generic_field_from_pb, generic_field_to_pb',
+    ] + sorted(statement.format(alias) for alias, statement in module.imports.items())
+    sections = ['\n'.join(header), '\n'.join(module.globals)] + functions + [
+        '\n'.join(['REGISTRY = {'] + registry + ['}'])
+    ]
+    return '\n\n\n'.join(section for section in sections if section) + '\n'
+
+
+def generate_for_apps(app_labels=None):
+    """Source of a module with generated serializers for all ProtoBufMixin models
+
+    :param app_labels: restrict to models of these apps
+    :returns: (str, number of models)
+    """
+    from django.apps import apps
+    from .models import ProtoBufMixin
+
+    pb_models = [
+        model for model in apps.get_models()
+        if issubclass(model, ProtoBufMixin) and model.pb_model is not None
+        and (not app_labels or model._meta.app_label in app_labels)
+    ]
+    return generate_module(pb_models), len(pb_models)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Static type compatibility of protobuf fields and the Django fields they map to.
+
+Every (pb field, Django field) pair converted by the default serializers is
+classified by ``analyze()`` when the system checks or ``manage.py pb_compat``
+run. The classification is a report, ``to_pb()`` and ``from_pb()`` don't
+consult it:
+
+* ``identity``: both sides hold the same Python type and range, ``pb_type_cast``
+  leaves values of the exact type alone
+* ``safe``: a cast is needed but never fails, e.g. ``IntegerField`` to ``string``,
+  or only rounds, ``FloatField`` to ``float``
+* ``lossy``: the conversion fails or loses information for some values in either
+  direction, e.g. ``IntegerField`` and ``int64`` as ``from_pb`` overflows the column
+* ``incompatible``: conversion fails for any value, e.g. ``BooleanField`` to
+  ``string`` without ``pb_type_cast``
+* ``unchecked``: relations, custom serializers and types without static information
+
+Incompatible pairs are reported as ``pb_model.E001`` errors and lossy ones as
+``pb_model.W001`` warnings by the Django system checks, except for the pb fields
+listed in ``pb_compat_ignore`` of the model. ``manage.py pb_compat`` prints the
+whole analysis.
+"""
+
+from __future__ import absolute_import
+import collections
+
+from django.core import checks
+from django.core.validators import MaxValueValidator, MinValueValidator
+from google.protobuf.descriptor import FieldDescriptor as FD
+
+from . import fields
+
+
+IDENTITY = 'identity'
+SAFE = 'safe'
+LOSSY = 'lossy'
+INCOMPATIBLE = 'incompatible'
+UNCHECKED = 'unchecked'
+
+FieldCompatibility = collections.namedtuple('FieldCompatibility', ['pb_field', 'dj_field', 'level', 'reason'])
+
+_INT32 = ('int', -2 ** 31, 2 ** 31 - 1)
+_INT64 = ('int', -2 ** 63, 2 ** 63 - 1)
+
+DJ_FIELD_KINDS = {
+    'SmallIntegerField': ('int', -2 ** 15, 2 ** 15 - 1),
+    'PositiveSmallIntegerField': ('int', 0, 2 ** 15 - 1),
+    'IntegerField': _INT32,
+    'AutoField': _INT32,
+    'PositiveIntegerField': ('int', 0, 2 ** 31 - 1),
+    'BigIntegerField': _INT64,
+    'BigAutoField': _INT64,
+    'FloatField': ('double', None, None),
+    'DecimalField': ('decimal', None, None),
+    'BooleanField': ('bool', None, None),
+    'NullBooleanField': ('bool', None, None),
+    'CharField': ('text', None, None),
+    'TextField': ('text', None, None),
+    'SlugField': ('text', None, None),
+    'FilePathField': ('text', None, None),
+    'GenericIPAddressField': ('text', None, None),
+    'BinaryField': ('bytes', None, None),
+}  # Django internal type in key, (kind, min, max) in value
+
+PB_FIELD_KINDS = {
+    FD.TYPE_INT32: _INT32,
+    FD.TYPE_SINT32: _INT32,
+    FD.TYPE_SFIXED32: _INT32,
+    FD.TYPE_ENUM: _INT32,
+    FD.TYPE_UINT32: ('int', 0, 2 ** 32 - 1),
+    FD.TYPE_FIXED32: ('int', 0, 2 ** 32 - 1),
+    FD.TYPE_INT64: _INT64,
+    FD.TYPE_SINT64: _INT64,
+    FD.TYPE_SFIXED64: _INT64,
+    FD.TYPE_UINT64: ('int', 0, 2 ** 64 - 1),
+    FD.TYPE_FIXED64: ('int', 0, 2 ** 64 - 1),
+    FD.TYPE_DOUBLE: ('double', None, None),
+    FD.TYPE_FLOAT: ('float', None, None),
+    FD.TYPE_BOOL: ('bool', None, None),
+    FD.TYPE_STRING: ('text', None, None),
+    FD.TYPE_BYTES: ('bytes', None, None),
+}  # pb field type in key, (kind, min, max) in value
+
+_NUMBERS = frozenset(['int', 'double', 'float', 'decimal', 'bool'])
+
+
+def _pb_kind(pb_field):
+    if pb_field.message_type is None:
+        return PB_FIELD_KINDS.get(pb_field.type)
+    if pb_field.message_type.full_name.startswith('google.protobuf.') \
+            and pb_field.message_type.name in fields.GFIELD_TYPE_CAST:
+        return _pb_kind(pb_field.message_type.fields_by_name['value'])
+    return None
+
+
+def _validated_range(dj_field, min_value, max_value):
+    """Range of an integer field narrowed by its own min/max validators"""
+    for validator in getattr(dj_field, '_validators', []):
+        if isinstance(validator, MinValueValidator):
+            min_value = max(min_value, validator.limit_value)
+        elif isinstance(validator, MaxValueValidator):
+            max_value = min(max_value, validator.limit_value)
+    return min_value, max_value
+
+
+def _is_default_converted(model, pb_field, dj_field):
+    if pb_field.label == FD.LABEL_REPEATED or dj_field.is_relation:
+        return False
+    if isinstance(dj_field, fields.ProtoBufFieldMixin):
+        return False
+    serializers = model.pb_2_dj_field_serializers
+    return not (serializers.get(type(dj_field)) or serializers.get(pb_field.name))
+
+
+def classify(pb_field, dj_field, type_cast=True):
+    """Compatibility of a pair converted by the default serializers
+
+    :param type_cast: whether values are cast, see ``pb_type_cast``
+    :returns: (level, reason)
+    """
+    dj_kind = DJ_FIELD_KINDS.get(dj_field.get_internal_type())
+    pb_kind = _pb_kind(pb_field)
+    if dj_kind is None or pb_kind is None:
+        return UNCHECKED, "no static type information"
+
+    (dj_type, dj_min, dj_max), (pb_type, pb_min, pb_max) = dj_kind, pb_kind
+    if dj_type == 'int':
+        dj_min, dj_max = _validated_range(dj_field, dj_min, dj_max)
+    if dj_type == pb_type:
+        if dj_type != 'int':
+            return IDENTITY, ""
+        problems = []
+        if not pb_min <= dj_min <= dj_max <= pb_max:
+            problems.append("to_pb fails outside of [{}, {}]".format(pb_min, pb_max))
+        if not dj_min <= pb_min <= pb_max <= dj_max:
+            problems.append("from_pb values outside of [{}, {}] don't fit".format(dj_min, dj_max))
+        if problems:
+            return LOSSY, ", ".join(problems)
+        return IDENTITY, ""
+
+    if (dj_type, pb_type) == ('double', 'float'):
+        return SAFE, "rounded to single precision, float values convert back exactly"
+    if 'bytes' in (dj_type, pb_type):
+        return INCOMPATIBLE, "{} can't be converted to {}".format(dj_type, pb_type)
+    if not type_cast:
+        if dj_type in ('int', 'double') and pb_type in ('int', 'double', 'float'):
+            return LOSSY, "{} is assigned to {} as is".format(dj_type, pb_type)
+        return INCOMPATIBLE, "{} is assigned to {} as is".format(dj_type, pb_type)
+    if dj_type in _NUMBERS and pb_type == 'text':
+        return SAFE, "{} is cast to text".format(dj_type)
+    if dj_type in _NUMBERS and pb_type in _NUMBERS:
+        return LOSSY, "{} is cast to {}".format(dj_type, pb_type)
+    return LOSSY, "casting {} to {} fails for some values".format(dj_type, pb_type)
+
+
+def analyze(model):
+    """Compatibility of every pb field of a model mapped to a Django field
+
+    Only forward fields are looked at, so this works while classes are created.
+
+    :param model: ProtoBufMixin model class
+    :returns: list of FieldCompatibility
+    """
+    if model.pb_model is None:
+        return []
+
+    dj_field_map = {f.name: f for f in model._meta.fields + model._meta.many_to_many}
+    results = []
+    for pb_field in model.pb_model.DESCRIPTOR.fields:
+        dj_field = dj_field_map.get(model.pb_2_dj_field_map.get(pb_field.name, pb_field.name))
+        if dj_field is None:
+            continue
+        if _is_default_converted(model, pb_field, dj_field):
+            level, reason = classify(pb_field, dj_field, type_cast=model.pb_type_cast)
+        else:
+            level, reason = UNCHECKED, "relation or custom serializer"
+        results.append(FieldCompatibility(pb_field, dj_field, level, reason))
+    return results
+
+
+def check_model(model):
+    """System check messages of the incompatible and lossy fields of a model"""
+    messages = []
+    for pb_field, dj_field, level, reason in analyze(model):
+        if level not in (INCOMPATIBLE, LOSSY) or pb_field.name in model.pb_compat_ignore:
+            continue
+        text = "Field '{}' ({}) can't be converted reliably to protobuf field '{}' ({}): {}.".format(
+            dj_field.name, type(dj_field).__name__, pb_field.full_name,
+            pb_field.message_type.name if pb_field.message_type is not None else _pb_type_name(pb_field), reason
+        )
+        if level == INCOMPATIBLE:
+            messages.append(checks.Error(
+                text, hint="Change either field type, or add a serializer in pb_2_dj_field_serializers.",
+                obj=model, id='pb_model.E001',
+            ))
+        else:
+            messages.append(checks.Warning(
+                text, hint="Change either field type, or list the pb field in pb_compat_ignore if that's intended.",
+                obj=model, id='pb_model.W001',
+            ))
+    return messages
+
+
+def _pb_type_name(pb_field):
+    for name, value in vars(FD).items():
+        if name.startswith('TYPE_') and value == pb_field.type:
+            return name[len('TYPE_'):].lower()
+    return str(pb_field.type)
+
+
+def report(models):
+    """Text table of the analysis of the given models"""
+    lines = []
+    for model in models:
+        for pb_field, dj_field, level, reason in analyze(model):
+            lines.append('{:<40} {:<32} {:<13} {}'.format(
+                '{}.{}'.format(model._meta.label, dj_field.name), pb_field.full_name, level, reason
+            ).rstrip())
+    return '\n'.join(lines)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Identity map of messages built during one serialization.
+
+While a context is active, ``to_pb()`` remembers the message of every saved
+object by ``(model, pk, expand_level)`` and answers repeated conversions of
+the same row with a copy of it instead of walking the fields again. Every
+top level ``to_pb()`` call opens a context for its own tree, wrap several
+calls in ``serialization_context()`` to share one across a batch:
+
+    with serialization_context() as context:
+        messages = [obj.to_pb() for obj in queryset]
+    context.saved  # conversions answered from the identity map
+
+Objects changed inside a context are not serialized again. Messages are
+copied into the identity map since callers may change them before the next
+``to_pb()``, except in the contexts ``to_pb()`` and ``to_pb_list()`` open
+themselves: their messages aren't returned before the context is closed, so
+they are kept as is and only copied when their row is seen again.
+"""
+
+from __future__ import absolute_import
+import contextlib
+import threading
+
+
+_local = threading.local()
+
+
+class SerializationContext(object):
+    """Messages built so far, keyed by (model, pk, expand_level)
+
+    :attr conversions: number of messages built
+    :attr saved: number of conversions answered with an already built message
+    :attr shared: whether built messages are returned while the context is active
+    """
+
+    def __init__(self, shared=True):
+        self.messages = {}
+        self.shared = shared
+        self.conversions = 0
+        self.saved = 0
+
+    def get(self, key):
+        message = self.messages.get(key)
+        if message is not None:
+            self.saved += 1
+        return message
+
+    def add(self, key, message):
+        self.conversions += 1
+        self.messages[key] = message
+
+
+def current_context():
+    """Active context of the current thread, None outside of a context"""
+    return getattr(_local, 'context', None)
+
+
+@contextlib.contextmanager
+def serialization_context(shared=True):
+    """Activate a context, or reuse the active one when nested
+
+    :param shared: False when no message built in the context is handed out before it is closed
+    """
+    context = current_context()
+    if context is not None:
+        yield context
+        return
+
+    _local.context = context = SerializationContext(shared=shared)
+    try:
+        yield context
+    finally:
+        _local.context = None
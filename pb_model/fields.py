@@ -2,17 +2,27 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import absolute_import
+import base64
+import functools
 import sys
 import logging
 import json
+import threading
 import uuid
+import zlib
+
+import six
 
 from django.db import models
+from django.db.models.query import ModelIterable
 from django.conf import settings
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject, empty
 
 from google.protobuf.descriptor import FieldDescriptor as FD
 
+from . import lookups
+
 
 LOGGER = logging.getLogger(__name__)
 
@@ -23,6 +33,25 @@ PB_FIELD_TYPE_MESSAGE = FD.MAX_TYPE + 4
 PB_FIELD_TYPE_REPEATED_MESSAGE = FD.MAX_TYPE + 5
 PB_FIELD_TYPE_MESSAGE_MAP = FD.MAX_TYPE + 6
 
+BUFFER_TYPES = (memoryview, bytearray) if sys.version_info >= (3,) else (memoryview, bytearray, buffer)  # noqa: F821
+
+
+def as_bytes(value):
+    """bytes of a buffer object, e.g. a ``memoryview`` returned by the database adapter
+
+    The object a ``memoryview`` of a whole ``bytes`` object refers to is returned
+    as is, other buffers are copied once.
+    """
+    if type(value) is bytes:
+        return value
+    if isinstance(value, memoryview):
+        obj = getattr(value, 'obj', None)
+        if type(obj) is bytes and value.contiguous and value.nbytes == len(obj):
+            return obj
+        return value.tobytes()
+    return bytes(value)
+
+
 FIELD_TYPE_CAST = {
     FD.TYPE_DOUBLE: float,
     FD.TYPE_FLOAT: float,
@@ -31,7 +60,7 @@ FIELD_TYPE_CAST = {
     FD.TYPE_INT32: int,
     FD.TYPE_BOOL: bool,
     FD.TYPE_STRING: str,
-    FD.TYPE_BYTES: bytes,
+    FD.TYPE_BYTES: as_bytes,
     FD.TYPE_UINT32: int,
     FD.TYPE_SINT32: int,
     FD.TYPE_SINT64: int,
@@ -45,7 +74,7 @@ GFIELD_TYPE_CAST = {
     "UInt32Value": int,
     "BoolValue": bool,
     "StringValue": str,
-    "BytesValue": bytes,
+    "BytesValue": as_bytes,
 }
 
 
@@ -56,12 +85,16 @@ def normalize_dj_value(pb_field, dj_field_value, force_type_cast):
             type_cast = GFIELD_TYPE_CAST.get(mtype.name)
         else:
             type_cast = FIELD_TYPE_CAST.get(pb_field.type)
-        if type_cast:
+        # values of the exact target type are left alone, the cast would return an equal value
+        if type_cast and type(dj_field_value) is not type_cast:
             dj_field_value = type_cast(dj_field_value)
     return dj_field_value
 
 
 def set_pb_value(pb_obj, pb_field, dj_field_value):
+    if isinstance(dj_field_value, BUFFER_TYPES):
+        # protobuf only accepts bytes, also when the value isn't cast
+        dj_field_value = as_bytes(dj_field_value)
     mtype = pb_field.message_type
     if mtype and mtype.full_name.startswith("google.protobuf"):
         if dj_field_value is not None:
@@ -73,9 +106,8 @@ def set_pb_value(pb_obj, pb_field, dj_field_value):
 def _defaultfield_to_pb(pb_obj, pb_field, dj_field_value, force_type_cast, **_):
     """ handling any fields conversion to protobuf
     """
-    LOGGER.debug("Django Value field, assign proto msg field: {} = {}".format(pb_field.name, dj_field_value))
-    if sys.version_info < (3,) and type(dj_field_value) is buffer:
-        dj_field_value = bytes(dj_field_value)
+    # lazy arguments, formatting would copy large bytes values
+    LOGGER.debug("Django Value field, assign proto msg field: %s = %s", pb_field.name, dj_field_value)
     try:
         dj_field_value = normalize_dj_value(pb_field, dj_field_value, force_type_cast)
         set_pb_value(pb_obj, pb_field, dj_field_value)
@@ -84,17 +116,47 @@ def _defaultfield_to_pb(pb_obj, pb_field, dj_field_value, force_type_cast, **_):
         raise
 
 
+DJ_FIELD_PYTHON_TYPES = {
+    models.AutoField: int,
+    models.BigAutoField: int,
+    models.IntegerField: int,
+    models.BigIntegerField: int,
+    models.SmallIntegerField: int,
+    models.PositiveIntegerField: int,
+    models.PositiveSmallIntegerField: int,
+    models.FloatField: float,
+    models.BooleanField: bool,
+    models.NullBooleanField: bool,
+    models.CharField: six.text_type,
+    models.TextField: six.text_type,
+}  # dj field type in key, type of the values its to_python() returns unchanged in value
+
+_TO_PYTHON = {}
+
+
+def _to_python(dj_field_type, value):
+    """``to_python()`` of a field type, values it would return unchanged are returned right away"""
+    try:
+        python_type, to_py = _TO_PYTHON[dj_field_type]
+    except KeyError:
+        python_type, to_py = _TO_PYTHON[dj_field_type] = (
+            DJ_FIELD_PYTHON_TYPES.get(dj_field_type), dj_field_type().to_python
+        )
+    if type(value) is python_type:
+        return value
+    return to_py(value)
+
+
 def normalize_pb_value(pb_field, pb_value, dj_field_type, force_type_cast):
     mtype = pb_field.message_type
 
     if force_type_cast:
-        to_py = dj_field_type().to_python
         if mtype:
             if mtype.name in GFIELD_TYPE_CAST:
-                return to_py(pb_value.value)
+                return _to_python(dj_field_type, pb_value.value)
         else:
             if pb_field.type in FIELD_TYPE_CAST:
-                return to_py(pb_value)
+                return _to_python(dj_field_type, pb_value)
 
     if mtype and mtype.full_name.startswith("google.protobuf"):
         return pb_value.value
@@ -106,7 +168,7 @@ def _defaultfield_from_pb(instance, dj_field_name, pb_field, pb_value, dj_field_
     """ handling any fields setting from protobuf
     """
     pb_value = normalize_pb_value(pb_field, pb_value, dj_field_type, force_type_cast)
-    LOGGER.debug("Django Value Field, set dj field: {} = {}".format(dj_field_name, pb_value))
+    LOGGER.debug("Django Value Field, set dj field: %s = %s", dj_field_name, pb_value)
     setattr(instance, dj_field_name, pb_value)
 
 
@@ -181,9 +243,93 @@ class ProtoBufFieldMixin(object):
         raise NotImplementedError()
 
 
+class LazyJSON(SimpleLazyObject):
+    """Proxy to a JSON document fetched from the database.
+
+    The document is decoded on first use only, ``raw`` keeps the original
+    string so an untouched value can be written back as is. Proxies are only
+    created for rows loaded by ``LazyJSONModelIterable`` and never leave the
+    instance ``__dict__``.
+    """
+    def __init__(self, raw):
+        self.__dict__['raw'] = raw
+        super(LazyJSON, self).__init__(functools.partial(json.loads, raw))
+
+    def decode(self):
+        if self._wrapped is empty:
+            self._setup()
+        return self._wrapped
+
+
+_lazy_rows = threading.local()
+
+
+def _json_from_db(raw):
+    """``LazyJSON`` while a ``LazyJSONModelIterable`` builds instances, the decoded value otherwise"""
+    if getattr(_lazy_rows, 'active', False):
+        return LazyJSON(raw)
+    return json.loads(raw)
+
+
+class LazyJSONModelIterable(ModelIterable):
+    """Yields model instances whose JSONField values are decoded on first attribute access
+
+    ``values()``, ``values_list()`` and querysets using other iterables get
+    plain decoded values.
+    """
+    def __iter__(self):
+        objs = super(LazyJSONModelIterable, self).__iter__()
+        annotations = list(self.queryset.query.annotation_select)
+        while True:
+            active, _lazy_rows.active = getattr(_lazy_rows, 'active', False), True
+            try:
+                obj = next(objs)
+            except StopIteration:
+                return
+            finally:
+                _lazy_rows.active = active
+            for name in annotations:
+                value = getattr(obj, name, None)
+                if type(value) is LazyJSON:
+                    setattr(obj, name, value.decode())
+            yield obj
+
+
+class LazyJSONDescriptor(object):
+    """Model attribute of a JSONField, replaces ``LazyJSON`` proxies by
+    the decoded value on first access.
+
+    Deferred loading is delegated to the descriptor Django installed for the field.
+    """
+    def __init__(self, field_name, deferred):
+        self._field_name = field_name
+        self._deferred = deferred
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+
+        value = self._deferred.__get__(instance, cls)
+        if type(value) is LazyJSON:
+            value = instance.__dict__[self._field_name] = value.decode()
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self._field_name] = value
+
+
 class JSONField(models.TextField):
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(JSONField, self).contribute_to_class(cls, name, **kwargs)
+        descriptor = getattr(cls, self.attname, None)
+        if self.column and not isinstance(descriptor, LazyJSONDescriptor):
+            setattr(cls, self.attname, LazyJSONDescriptor(self.attname, descriptor))
+
     def from_db_value(self, value, expression, connection, context=None):
-        return self._deserialize(value)
+        if value is None:
+            return None
+
+        return _json_from_db(value)
 
     def to_python(self, value):
         if isinstance(value, str):
@@ -191,7 +337,17 @@ class JSONField(models.TextField):
 
         return value
 
+    def pre_save(self, model_instance, add):
+        # Read around the descriptor to keep never accessed values undecoded
+        if self.attname in model_instance.__dict__:
+            return model_instance.__dict__[self.attname]
+        return super(JSONField, self).pre_save(model_instance, add)
+
     def get_prep_value(self, value):
+        if type(value) is LazyJSON:
+            if value._wrapped is empty:
+                return value.raw
+            value = value._wrapped
         return json.dumps(value)
 
     def _deserialize(self, value):
@@ -212,6 +368,12 @@ class ArrayField(JSONField, ProtoBufFieldMixin):
 
 
 class MapField(JSONField, ProtoBufFieldMixin):
+    def get_transform(self, name):
+        transform = super(MapField, self).get_transform(name)
+        if transform is not None:
+            return transform
+        return lookups.KeyTransformFactory(name)
+
     @staticmethod
     def to_pb(pb_obj, pb_field, dj_field_value, **_):
         getattr(pb_obj, pb_field.name).update(dj_field_value)
@@ -221,6 +383,321 @@ class MapField(JSONField, ProtoBufFieldMixin):
         setattr(instance, dj_field_name, dict(pb_value))
 
 
+ArrayField.register_lookup(lookups.ArrayContains)
+ArrayField.register_lookup(lookups.ArrayLength)
+MapField.register_lookup(lookups.MapContains)
+MapField.register_lookup(lookups.MapHasKey)
+MapField.register_lookup(lookups.MapLength)
+
+
+COMPRESSION_HEADER = b'\xfe'  # never starts UTF-8 text, JSON or a serialized protobuf message
+COMPRESSION_METHODS = {
+    'none': b'\x00',
+    'zlib': b'z',
+    'lzma': b'x',
+}
+COMPRESSION_TEXT_HEADER = u'\ufffe'  # noncharacter, doesn't start real text
+COMPRESSION_TEXT_METHODS = {
+    'none': u'-',
+    'zlib': u'z',
+    'lzma': u'x',
+}
+
+
+def _compressors(method, level=None):
+    if method == 'zlib':
+        if level is None:
+            return zlib.compress, zlib.decompress
+        return (lambda data: zlib.compress(data, level)), zlib.decompress
+    if method == 'lzma':
+        import lzma
+        return functools.partial(lzma.compress, preset=level), lzma.decompress
+    raise ValueError("Unknown compression method {!r}".format(method))
+
+
+class CompressedFieldMixin(object):
+    """Compresses values of at least ``compress_threshold`` bytes
+
+    Compressed values start with a header and a method marker, values
+    without the header are read as is, so rows written before switching a
+    column to a compressed field still load. Values that don't shrink are
+    stored uncompressed. Lookups other than ``exact``/``in``/``isnull`` are
+    not supported, the database only sees compressed bytes.
+    """
+    compression = 'zlib'
+    compression_level = 1  # fast, larger levels shrink text columns only slightly more
+    compress_threshold = 1024
+
+    def __init__(self, *args, **kwargs):
+        self.compression = kwargs.pop('compression', self.compression)
+        self.compression_level = kwargs.pop('compression_level', self.compression_level)
+        self.compress_threshold = kwargs.pop('compress_threshold', self.compress_threshold)
+        if self.compression not in COMPRESSION_METHODS:
+            raise ValueError("Unknown compression method {!r}".format(self.compression))
+        super(CompressedFieldMixin, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(CompressedFieldMixin, self).deconstruct()
+        if self.compression != type(self).compression:
+            kwargs['compression'] = self.compression
+        if self.compression_level != type(self).compression_level:
+            kwargs['compression_level'] = self.compression_level
+        if self.compress_threshold != type(self).compress_threshold:
+            kwargs['compress_threshold'] = self.compress_threshold
+        return name, path, args, kwargs
+
+    def get_lookup(self, lookup_name):
+        if lookup_name not in ('exact', 'in', 'isnull'):
+            return None
+        return super(CompressedFieldMixin, self).get_lookup(lookup_name)
+
+    def get_transform(self, name):
+        return None
+
+    def _compressed(self, data):
+        """Compressed data, None when it isn't worth it"""
+        if len(data) >= self.compress_threshold and self.compression != 'none':
+            compressed = _compressors(self.compression, self.compression_level)[0](data)
+            if len(compressed) + 2 < len(data):
+                return compressed
+        return None
+
+    def compress(self, data):
+        compressed = self._compressed(data)
+        if compressed is not None:
+            return COMPRESSION_HEADER + COMPRESSION_METHODS[self.compression] + compressed
+        if data[:1] == COMPRESSION_HEADER:
+            return COMPRESSION_HEADER + COMPRESSION_METHODS['none'] + data
+        return data
+
+    @staticmethod
+    def decompress(data):
+        data = as_bytes(data)
+        if data[:1] != COMPRESSION_HEADER:
+            return data
+        method = data[1:2]
+        if method == COMPRESSION_METHODS['none']:
+            return data[2:]
+        for name, header in COMPRESSION_METHODS.items():
+            if header == method:
+                return _compressors(name)[1](data[2:])
+        raise ValueError("Unknown compression header {!r}".format(data[:2]))
+
+
+class CompressedBinaryField(CompressedFieldMixin, models.BinaryField):
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        return connection.Database.Binary(self.compress(as_bytes(value)))
+
+    def from_db_value(self, value, expression, connection, context=None):
+        return None if value is None else self.decompress(value)
+
+
+class CompressedTextMixin(CompressedFieldMixin):
+    """Keeps the text column: compressed values are stored base64 encoded behind
+    ``COMPRESSION_TEXT_HEADER`` and a method letter, switching a ``TextField`` needs
+    no column type change.
+    """
+
+    def compress_text(self, text):
+        compressed = self._compressed(text.encode('utf-8'))
+        if compressed is not None:
+            return COMPRESSION_TEXT_HEADER + COMPRESSION_TEXT_METHODS[self.compression] + \
+                base64.b64encode(compressed).decode('ascii')
+        if text[:1] == COMPRESSION_TEXT_HEADER:
+            return COMPRESSION_TEXT_HEADER + COMPRESSION_TEXT_METHODS['none'] + text
+        return text
+
+    @staticmethod
+    def decompress_text(text):
+        if text[:1] != COMPRESSION_TEXT_HEADER:
+            return text
+        method = text[1:2]
+        if method == COMPRESSION_TEXT_METHODS['none']:
+            return text[2:]
+        for name, header in COMPRESSION_TEXT_METHODS.items():
+            if header == method:
+                return _compressors(name)[1](base64.b64decode(text[2:])).decode('utf-8')
+        raise ValueError("Unknown compression header {!r}".format(text[:2]))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is None:
+            return None
+        if isinstance(value, six.binary_type):
+            value = value.decode('utf-8')
+        return self.compress_text(value)
+
+    def _from_db_text(self, value):
+        return None if value is None else self.decompress_text(value)
+
+
+class CompressedTextField(CompressedTextMixin, models.TextField):
+    def from_db_value(self, value, expression, connection, context=None):
+        return self._from_db_text(value)
+
+
+class CompressedJSONMixin(CompressedTextMixin):
+    """JSON fields keep the stored text of a never decoded value and write it back as is"""
+    def from_db_value(self, value, expression, connection, context=None):
+        text = self._from_db_text(value)
+        if text is None:
+            return None
+        lazy = _json_from_db(text)
+        if type(lazy) is LazyJSON:
+            lazy.__dict__['stored'] = value
+        return lazy
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if type(value) is LazyJSON and value._wrapped is empty and 'stored' in value.__dict__:
+            return value.__dict__['stored']
+        return super(CompressedJSONMixin, self).get_db_prep_value(value, connection, prepared=prepared)
+
+
+class CompressedJSONField(CompressedJSONMixin, JSONField):
+    pass
+
+
+class CompressedArrayField(CompressedJSONMixin, ArrayField):
+    pass
+
+
+class CompressedMapField(CompressedJSONMixin, MapField):
+    pass
+
+
+COMPRESSED_FIELD_TYPES = {
+    FD.TYPE_STRING: CompressedTextField,
+    FD.TYPE_BYTES: CompressedBinaryField,
+    PB_FIELD_TYPE_REPEATED: CompressedArrayField,
+    PB_FIELD_TYPE_MAP: CompressedMapField,
+}  # for pb_auto_field_type_mapping of models with large string, bytes, repeated and map fields
+
+
+class InlineMessage(object):
+    """Attribute access to an inline stored message through its columns on the owner instance."""
+    __slots__ = ('instance', 'field')
+
+    def __init__(self, instance, field):
+        object.__setattr__(self, 'instance', instance)
+        object.__setattr__(self, 'field', field)
+
+    def __getattr__(self, name):
+        if name not in self.field.message_type.fields_by_name:
+            raise AttributeError(name)
+        return getattr(self.instance, self.field.column_name(name))
+
+    def __setattr__(self, name, value):
+        if name not in self.field.message_type.fields_by_name:
+            raise AttributeError(name)
+        setattr(self.instance, self.field.column_name(name), value)
+
+    def __eq__(self, other):
+        if not isinstance(other, InlineMessage):
+            return NotImplemented
+        return self.field.values(self.instance) == other.field.values(other.instance)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class InlineMessageDescriptor(object):
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+
+        if all(value is None for value in self.field.values(instance)):
+            return None
+        return InlineMessage(instance, self.field)
+
+    def __set__(self, instance, value):
+        self.field.set_value(instance, value)
+
+
+class InlineMessageField(models.Field, ProtoBufFieldMixin):
+    """
+    Stores a singular message field as prefixed columns on the owner table, one per
+    message field (``<name>_<message field name>``), instead of a ForeignKey.
+    Message fields may only be scalars or Timestamps. The message is considered
+    unset when all of its columns are NULL.
+    """
+    def __init__(self, message_type, *args, **kwargs):
+        kwargs.setdefault('null', True)
+        kwargs.setdefault('editable', False)
+        super(InlineMessageField, self).__init__(*args, **kwargs)
+        self.message_type = message_type
+
+    def get_attname_column(self):
+        return self.get_attname(), None
+
+    def column_name(self, pb_field_name):
+        return '%s_%s' % (self.name, pb_field_name)
+
+    def column_names(self):
+        return [self.column_name(f.name) for f in self.message_type.fields]
+
+    def values(self, instance):
+        return [getattr(instance, name) for name in self.column_names()]
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        kwargs['private_only'] = True
+        super(InlineMessageField, self).contribute_to_class(cls, name, **kwargs)
+        for pb_field in self.message_type.fields:
+            cls.add_to_class(self.column_name(pb_field.name), self._create_column(cls, pb_field))
+        setattr(cls, self.attname, InlineMessageDescriptor(self))
+
+    def _create_column(self, cls, pb_field):
+        if pb_field.label == pb_field.LABEL_REPEATED:
+            raise TypeError("Inline message field '{}' can't store repeated field '{}'".format(self.name, pb_field.name))
+        if pb_field.message_type is None:
+            return cls._create_generic_field(pb_field.type)
+        elif pb_field.message_type.name == 'Timestamp':
+            field_type = cls.pb_auto_field_type_mapping[PB_FIELD_TYPE_TIMESTAMP]
+        else:
+            raise TypeError("Inline message field '{}' can't store message field '{}'".format(self.name, pb_field.name))
+        return field_type(null=True)
+
+    def set_value(self, instance, value):
+        if value is None:
+            for name in self.column_names():
+                setattr(instance, name, None)
+        elif isinstance(value, InlineMessage):
+            for name, column_value in zip(self.column_names(), value.field.values(value.instance)):
+                setattr(instance, name, column_value)
+        else:
+            for pb_field in self.message_type.fields:
+                name = self.column_name(pb_field.name)
+                if pb_field.message_type is not None and not value.HasField(pb_field.name):
+                    setattr(instance, name, None)
+                else:
+                    column_type = type(instance._meta.get_field(name))
+                    instance._protobuf_to_value(name, column_type, pb_field, getattr(value, pb_field.name))
+
+    def fill_pb(self, instance, pb_message):
+        pb_message.SetInParent()
+        for pb_field in self.message_type.fields:
+            name = self.column_name(pb_field.name)
+            value = getattr(instance, name)
+            if value is not None:
+                column_type = type(instance._meta.get_field(name))
+                instance._value_to_protobuf(pb_message, pb_field, column_type, value, expand_level=None)
+
+    @staticmethod
+    def to_pb(pb_obj, pb_field, dj_field_value, **_):
+        dj_field_value.field.fill_pb(dj_field_value.instance, getattr(pb_obj, pb_field.name))
+
+    @staticmethod
+    def from_pb(instance, dj_field_name, pb_field, pb_value, **_):
+        setattr(instance, dj_field_name, pb_value)
+
+
 class RepeatedMessageField(models.ManyToManyField, ProtoBufFieldMixin):
     class Descriptor(models.fields.related_descriptors.ManyToManyDescriptor):
         def __init__(self, field_name, index_field_name, rel, reverse=False):
@@ -256,7 +733,9 @@ class RepeatedMessageField(models.ManyToManyField, ProtoBufFieldMixin):
         setattr(cls, self.attname, RepeatedMessageField.Descriptor(name, index_field_name, self.remote_field, reverse=False))
 
     def save(self, instance):
-        for message in getattr(instance, self.attname):
+        if self.attname not in instance.__dict__:
+            return  # never loaded nor assigned, nothing changed
+        for message in instance.__dict__[self.attname]:
             type(instance).__dict__[self.attname].related_manager_cls(instance).add(message)
         setattr(instance, '%s_index' % self.attname, [q.id for q in instance.__dict__[self.attname]])
 
@@ -265,9 +744,9 @@ class RepeatedMessageField(models.ManyToManyField, ProtoBufFieldMixin):
 
     @staticmethod
     def to_pb(pb_obj, pb_field, dj_field_value, expand_level, **_):
-        getattr(pb_obj, pb_field.name).extend(
-            [m.to_pb(expand_level=expand_level) for m in dj_field_value]
-        )
+        repeated = getattr(pb_obj, pb_field.name)
+        for m in dj_field_value:
+            m.to_pb(expand_level=expand_level, into=repeated.add())
 
     @staticmethod
     def from_pb(instance, dj_field_name, pb_field, pb_value, **_):
@@ -317,7 +796,9 @@ class MessageMapField(models.ManyToManyField, ProtoBufFieldMixin):
         setattr(cls, self.attname, MessageMapField.Descriptor(name, index_field_name, self.remote_field, reverse=False))
 
     def save(self, instance):
-        for message in getattr(instance, self.attname).values():
+        if self.attname not in instance.__dict__:
+            return  # never loaded nor assigned, nothing changed
+        for message in instance.__dict__[self.attname].values():
             type(instance).__dict__[self.attname].related_manager_cls(instance).add(message)
         setattr(instance, '%s_index' % self.attname, {key: message.id for key, message in instance.__dict__[self.attname].items()})
 
@@ -326,12 +807,156 @@ class MessageMapField(models.ManyToManyField, ProtoBufFieldMixin):
 
     @staticmethod
     def to_pb(pb_obj, pb_field, dj_field_value, expand_level, **_):
+        message_map = getattr(pb_obj, pb_field.name)
         for key in dj_field_value:
-            getattr(pb_obj, pb_field.name)[key].CopyFrom(
-                dj_field_value[key].to_pb(expand_level=expand_level)
-            )
+            dj_field_value[key].to_pb(expand_level=expand_level, into=message_map[key])
 
     @staticmethod
     def from_pb(instance, dj_field_name, pb_field, pb_value, **_):
         related_model = instance._meta.get_field(dj_field_name).related_model
         setattr(instance, dj_field_name, {key: related_model().from_pb(pb_message) for key, pb_message in pb_value.items()})
+
+
+class OrderedThroughMixin(object):
+    """
+    Keeps the order (or the keys) of a message collection in an indexed column of
+    the m2m through table instead of the ``<name>_index`` JSON column, so the
+    whole collection is loaded with one ordered join query.
+    """
+    through_column_name = None
+
+    class Descriptor(models.fields.related_descriptors.ManyToManyDescriptor):
+        def __get__(self, instance, cls=None):
+            if instance is None:
+                raise AttributeError('Can only be accessed via an instance.')
+
+            if self.field.attname not in instance.__dict__:
+                instance.__dict__[self.field.attname] = self.field.load_collection(instance)
+            return instance.__dict__[self.field.attname]
+
+        def __set__(self, instance, value):
+            instance.__dict__[self.field.attname] = value
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        models.ManyToManyField.contribute_to_class(self, cls, name, **kwargs)
+        through = self.remote_field.through
+        if isinstance(through, type) and through._meta.auto_created:
+            through.add_to_class(self.through_column_name, self.create_through_column())
+            owner_name = next(f.name for f in through._meta.fields if f.is_relation and f.remote_field.model is cls)
+            through._meta.unique_together = ((owner_name, self.through_column_name),)
+        setattr(cls, self.attname, self.Descriptor(self.remote_field, reverse=False))
+
+    def create_through_column(self):
+        raise NotImplementedError()
+
+    def load_collection(self, instance):
+        raise NotImplementedError()
+
+    def collection_items(self, collection):
+        """
+        :param collection: python value of the field
+        :return: iterable of (through column value, related instance) pairs
+        """
+        raise NotImplementedError()
+
+    def index_items(self, index):
+        """
+        :param index: decoded ``<name>_index`` value of the unordered field
+        :return: iterable of (through column value, related id) pairs
+        """
+        raise NotImplementedError()
+
+    def _through_manager(self, instance=None):
+        db = instance._state.db if instance is not None else None
+        return self.remote_field.through._default_manager.db_manager(db)
+
+    def _through_rows(self, instance):
+        return self._through_manager(instance).filter(
+            **{self.m2m_field_name(): instance.pk}
+        ).select_related(self.m2m_reverse_field_name()).order_by(self.through_column_name)
+
+    def _create_through_row(self, owner_id, related_id, column_value):
+        through = self.remote_field.through
+        return through(**{
+            through._meta.get_field(self.m2m_field_name()).attname: owner_id,
+            through._meta.get_field(self.m2m_reverse_field_name()).attname: related_id,
+            self.through_column_name: column_value,
+        })
+
+    def save(self, instance):
+        if self.attname not in instance.__dict__:
+            return
+
+        manager = self._through_manager(instance)
+        manager.filter(**{self.m2m_field_name(): instance.pk}).delete()
+        manager.bulk_create([
+            self._create_through_row(instance.pk, message.pk, column_value)
+            for column_value, message in self.collection_items(instance.__dict__[self.attname])
+        ])
+
+    def copy_index(self, pk_index_pairs):
+        """
+        Copies ``<name>_index`` data of the unordered field into the through table,
+        meant to be used from a data migration between adding the ordered field and
+        removing the old one, for example:
+
+        ```
+        def forwards(apps, schema_editor):
+            Root = apps.get_model('app', 'Root')
+            field = Root._meta.get_field('ordered_items')
+            field.copy_index(Root.objects.values_list('pk', 'items_index'))
+        ```
+
+        :param pk_index_pairs: iterable of (owner pk, index value) pairs
+        :return: number of created through rows
+        """
+        rows = []
+        for owner_id, index in pk_index_pairs:
+            if isinstance(index, str):
+                index = json.loads(index)
+            rows.extend(
+                self._create_through_row(owner_id, related_id, column_value)
+                for column_value, related_id in self.index_items(index or ())
+            )
+        self._through_manager().bulk_create(rows)
+        return len(rows)
+
+
+class OrderedRepeatedMessageField(OrderedThroughMixin, RepeatedMessageField):
+    """RepeatedMessageField storing element order in a ``position`` column of the through table."""
+    through_column_name = 'position'
+
+    def create_through_column(self):
+        return models.PositiveIntegerField(default=0)
+
+    def load_collection(self, instance):
+        if instance.pk is None:
+            return []
+        related_name = self.m2m_reverse_field_name()
+        return [getattr(row, related_name) for row in self._through_rows(instance)]
+
+    def collection_items(self, collection):
+        return enumerate(collection)
+
+    def index_items(self, index):
+        return enumerate(index)
+
+
+class OrderedMessageMapField(OrderedThroughMixin, MessageMapField):
+    """MessageMapField storing map keys in a ``key`` column of the through table."""
+    through_column_name = 'key'
+
+    def create_through_column(self):
+        return models.CharField(max_length=255, default='')
+
+    def load_collection(self, instance):
+        if instance.pk is None:
+            return {}
+        related_name = self.m2m_reverse_field_name()
+        return {row.key: getattr(row, related_name) for row in self._through_rows(instance)}
+
+    def collection_items(self, collection):
+        return collection.items()
+
+    def index_items(self, index):
+        return index.items()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Persistence of whole object graphs built by ``from_pb``.
+
+``from_pb`` of a nested message creates unsaved related instances: ForeignKey
+targets of message fields and the elements of ``RepeatedMessageField`` and
+``MessageMapField`` collections. ``save_graph()`` orders these objects by
+level, every object after the objects it refers to, and writes each level with
+one ``bulk_create`` per model, rows already in the database with one
+``bulk_update()``. Foreign keys and ``<name>_index`` columns are wired before a
+level is written, the through rows of its collections right after, all in a
+single transaction.
+
+Only related objects which were never saved are followed, instances loaded
+from the database are left alone.
+"""
+
+from __future__ import absolute_import
+import collections
+import logging
+
+from django.db import connections, models, router, transaction
+
+from . import fields, outbox
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _cached_related(obj, dj_field):
+    """Related instance assigned to a forward relation, without querying"""
+    if hasattr(dj_field, 'is_cached'):
+        return dj_field.get_cached_value(obj) if dj_field.is_cached(obj) else None
+    return getattr(obj, dj_field.get_cache_name(), None)
+
+
+def _collection_fields(model):
+    return [f for f in model._meta.many_to_many if isinstance(f, fields.ProtoBufFieldMixin)]
+
+
+def _collection(obj, dj_field):
+    """Related instances of a loaded or assigned message collection"""
+    value = obj.__dict__.get(dj_field.attname)
+    if value is None:
+        return []
+    return list(value.values()) if isinstance(value, dict) else list(value)
+
+
+def unsaved_related(obj):
+    """Unsaved instances ``obj`` refers to, which have to be written first"""
+    related = [_cached_related(obj, f) for f in obj._meta.concrete_fields if f.many_to_one or f.one_to_one]
+    for dj_field in _collection_fields(type(obj)):
+        related.extend(_collection(obj, dj_field))
+    return [r for r in related if r is not None and r._state.adding]
+
+
+def _levels(roots):
+    """Objects of the graph grouped by level, leaves first
+
+    :returns: list of lists of instances
+    """
+    levels, visiting = {}, set()
+
+    def visit(obj):
+        key = id(obj)
+        if key in levels:
+            return levels[key][0]
+        if key in visiting:
+            raise ValueError("Object graph of {} contains a cycle".format(obj._meta.label))
+        visiting.add(key)
+        level = max([visit(dependency) + 1 for dependency in unsaved_related(obj)] or [0])
+        visiting.discard(key)
+        levels[key] = (level, obj)
+        return level
+
+    for root in roots:
+        visit(root)
+
+    grouped = collections.defaultdict(list)
+    for level, obj in levels.values():
+        grouped[level].append(obj)
+    return [grouped[level] for level in sorted(grouped)]
+
+
+def _wire(obj):
+    """Copy primary keys of written related instances to foreign keys and index columns"""
+    for dj_field in obj._meta.concrete_fields:
+        if dj_field.many_to_one or dj_field.one_to_one:
+            related = _cached_related(obj, dj_field)
+            if related is not None:
+                setattr(obj, dj_field.attname, related.pk)
+    for dj_field in _collection_fields(type(obj)):
+        value = obj.__dict__.get(dj_field.attname)
+        if value is None or isinstance(dj_field, fields.OrderedThroughMixin):
+            continue
+        if isinstance(value, dict):
+            index = {key: message.pk for key, message in value.items()}
+        else:
+            index = [message.pk for message in value]
+        setattr(obj, '%s_index' % dj_field.attname, index)
+
+
+def _through_rows(obj, dj_field):
+    if isinstance(dj_field, fields.OrderedThroughMixin):
+        return [
+            dj_field._create_through_row(obj.pk, message.pk, column_value)
+            for column_value, message in dj_field.collection_items(obj.__dict__[dj_field.attname])
+        ]
+
+    through = dj_field.remote_field.through
+    owner_attname = through._meta.get_field(dj_field.m2m_field_name()).attname
+    related_attname = through._meta.get_field(dj_field.m2m_reverse_field_name()).attname
+    related_pks = []
+    for message in _collection(obj, dj_field):
+        if message.pk not in related_pks:
+            related_pks.append(message.pk)
+    return [through(**{owner_attname: obj.pk, related_attname: pk}) for pk in related_pks]
+
+
+def _split_existing(model, objs, using):
+    """(new, existing) instances, by looking up the primary keys set by ``from_pb``"""
+    pks = [obj.pk for obj in objs if obj.pk is not None and obj._state.adding]
+    found = set()
+    if pks:
+        found = set(model._base_manager.using(using).filter(pk__in=pks).values_list('pk', flat=True))
+    new, existing = [], []
+    for obj in objs:
+        if obj._state.adding and obj.pk not in found:
+            new.append(obj)
+        else:
+            existing.append(obj)
+    return new, existing
+
+
+def _insert(model, objs, using):
+    if connections[using].features.can_return_ids_from_bulk_insert or all(obj.pk is not None for obj in objs):
+        model._default_manager.db_manager(using).bulk_create(objs)
+    else:
+        LOGGER.debug("Primary keys of bulk inserted rows are unknown, inserting {} one by one".format(
+            model._meta.label
+        ))
+        for obj in objs:
+            obj.save_base(using=using, force_insert=True)
+        if getattr(model, 'pb_outbox', False):
+            outbox.record_saved(model, objs, using=using)
+    for obj in objs:
+        obj._state.adding, obj._state.db = False, using
+
+
+def bulk_update(model, objs, field_names=None, using=None):
+    """Write field values of existing rows with one ``UPDATE ... CASE`` statement per batch
+
+    Goes through the model's queryset ``update()``, so ``pb_outbox`` and
+    ``pb_reference_cache`` of ProtoBufMixin models are taken care of.
+
+    :param field_names: defaults to all concrete fields but the primary key
+    """
+    if not objs:
+        return
+    dj_fields = [
+        model._meta.get_field(name) for name in field_names
+    ] if field_names is not None else [f for f in model._meta.concrete_fields if not f.primary_key]
+    manager = model._default_manager.db_manager(using)
+    batch_size = max(1, connections[manager.db].ops.bulk_batch_size(['pk', 'pk'] + dj_fields, objs))
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        values = {
+            dj_field.attname: models.Case(*[
+                models.When(pk=obj.pk, then=models.Value(dj_field.pre_save(obj, False), output_field=dj_field))
+                for obj in batch
+            ], output_field=dj_field)
+            for dj_field in dj_fields
+        }
+        manager.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+
+
+def _update(model, objs, using):
+    bulk_update(model, objs, using=using)
+    for obj in objs:
+        obj._state.adding, obj._state.db = False, using
+
+
+def _write_level(objs, using):
+    by_model = collections.OrderedDict()
+    for obj in objs:
+        if hasattr(obj, '_pb_materialize'):
+            obj._pb_materialize()
+        _wire(obj)
+        by_model.setdefault(type(obj), []).append(obj)
+
+    through_rows = collections.OrderedDict()
+    for model, model_objs in by_model.items():
+        new, existing = _split_existing(model, model_objs, using)
+        if new:
+            _insert(model, new, using)
+        if existing:
+            _update(model, existing, using)
+
+        for dj_field in _collection_fields(model):
+            for obj in new:
+                if dj_field.attname in obj.__dict__:
+                    through_rows.setdefault(dj_field.remote_field.through, []).extend(_through_rows(obj, dj_field))
+            for obj in existing:
+                dj_field.save(obj)
+        for obj in model_objs:
+            if hasattr(obj, '_pb_reconcile'):
+                obj._pb_reconcile(using=using)  # collections of pb_2_dj_reconcile_fields
+
+    for through, rows in through_rows.items():
+        through._default_manager.db_manager(using).bulk_create(rows)
+
+
+def save_graph(objs, using=None):
+    """Write instances and the unsaved instances they refer to, level by level
+
+    :param objs: model instance, or list of instances
+    :returns: the written instances, grouped by level with leaves first
+    """
+    if isinstance(objs, models.Model):
+        objs = [objs]
+    objs = list(objs)
+    if not objs:
+        return []
+
+    using = using or router.db_for_write(type(objs[0]), instance=objs[0])
+    levels = _levels(objs)
+    with transaction.atomic(using=using):
+        for level in levels:
+            _write_level(level, using)
+    LOGGER.debug("Saved object graph of {} objects in {} levels".format(sum(map(len, levels)), len(levels)))
+    return levels
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Bulk ingestion of length-delimited message streams.
+
+Messages are read from the stream one at a time and converted with ``from_pb``;
+every ``batch_size`` objects are written in their own transaction, so memory
+use and transaction length do not grow with the size of the upload.
+
+Batches whose objects refer to unsaved related instances built from nested
+messages are written with ``graph.save_graph`` instead of ``bulk_create``,
+which would store their foreign keys as NULL.
+"""
+
+from __future__ import absolute_import
+import logging
+
+from django.db import transaction
+
+from . import fields, graph, stream
+
+
+LOGGER = logging.getLogger(__name__)
+
+BATCH_ERROR = "Batch could not be written"  # reported instead of the exception, which is logged
+
+
+def _can_bulk_create(model):
+    """``bulk_create`` skips ``save()``, which ProtoBufFieldMixin m2m fields rely on"""
+    return not any(isinstance(f, fields.ProtoBufFieldMixin) for f in model._meta.many_to_many)
+
+
+def _iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def save_batch(model, messages, use_bulk_create=None, using=None):
+    """Convert and write one batch of messages in a single transaction
+
+    :param model: ProtoBufMixin model class
+    :param messages: list of serialized messages
+    :param use_bulk_create: ``bulk_create`` or one ``save()`` per object,
+        defaults to ``bulk_create`` unless the model has ProtoBufFieldMixin m2m fields
+    :returns: number of written objects
+    """
+    objs = model.from_pb_batch([model.pb_model.FromString(data) for data in messages])
+    return save_objects(model, objs, use_bulk_create=use_bulk_create, using=using)
+
+
+def save_objects(model, objs, use_bulk_create=None, using=None):
+    """Write converted objects in a single transaction, see ``save_batch``"""
+    if use_bulk_create is None:
+        use_bulk_create = _can_bulk_create(model)
+    with transaction.atomic(using=using):
+        if use_bulk_create and any(graph.unsaved_related(obj) for obj in objs):
+            graph.save_graph(objs, using=using)
+        elif use_bulk_create:
+            model._default_manager.db_manager(using).bulk_create(objs)
+        else:
+            for obj in objs:
+                obj.save(using=using)
+    return len(objs)
+
+
+def ingest(model, fileobj, batch_size=500, use_bulk_create=None, max_message_size=None, using=None):
+    """Write all messages of a length-delimited stream, one transaction per batch
+
+    A failing batch is rolled back and reported with ``BATCH_ERROR``, its
+    exception is logged, the following batches are still written. A malformed
+    stream stops the ingestion and is reported as the error of the batch being
+    read, with the ``StreamError`` message describing the stream.
+
+    :param model: ProtoBufMixin model class
+    :param fileobj: file-like object with ``read(size)``, e.g. a ``HttpRequest``
+    :param batch_size: number of messages per transaction
+    :returns: list of per batch results ``{'batch', 'count', 'error'}``
+    """
+    results = []
+    messages = stream.iter_delimited(fileobj, max_message_size=max_message_size)
+    try:
+        for index, batch in enumerate(_iter_batches(messages, batch_size)):
+            result = {'batch': index, 'count': 0, 'error': None}
+            try:
+                result['count'] = save_batch(model, batch, use_bulk_create=use_bulk_create, using=using)
+            except Exception:
+                LOGGER.warning("Failed to ingest batch %s of %s", index, model._meta.label, exc_info=True)
+                result['error'] = BATCH_ERROR
+            results.append(result)
+    except stream.StreamError as e:
+        LOGGER.warning("Malformed stream of %s: %s", model._meta.label, e)
+        results.append({'batch': len(results), 'count': 0, 'error': str(e)})
+    return results
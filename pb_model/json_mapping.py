@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Protobuf JSON mapping rendered straight from model attributes.
+
+``model_to_dict`` gives the same result as ``json_format.MessageToDict(obj.to_pb())``
+without building the message for plain value, wrapper, Timestamp, UUID and relation
+fields. Fields converted by ``ProtoBufFieldMixin`` fields or custom serializers are
+set on a temporary message and rendered by ``json_format``.
+"""
+
+from __future__ import absolute_import
+import base64
+import math
+import uuid
+
+import six
+from django.conf import settings
+from django.utils import timezone
+
+from google.protobuf import json_format
+from google.protobuf import timestamp_pb2
+from google.protobuf.descriptor import FieldDescriptor as FD
+from google.protobuf.internal import type_checkers
+
+from . import fields
+
+
+VALUE = 'value'
+WRAPPER = 'wrapper'
+TIMESTAMP = 'timestamp'
+UUID = 'uuid'
+FOREIGN_KEY = 'foreign_key'
+MANY = 'many'
+GENERIC = 'generic'
+
+_INT64_TYPES = (FD.CPPTYPE_INT64, FD.CPPTYPE_UINT64)
+_FLOAT_TYPES = (FD.CPPTYPE_FLOAT, FD.CPPTYPE_DOUBLE)
+# missing in older protobuf releases, whose json_format writes float fields as they are
+_to_shortest_float = getattr(type_checkers, 'ToShortestFloat', None)
+
+_PLANS = {}
+_TO_PYTHON = {}
+_MISSING = object()
+
+
+def _has_presence(pb_field):
+    return (pb_field.message_type is not None or pb_field.containing_oneof is not None
+            or pb_field.file.syntax == 'proto2')
+
+
+def _field_kind(instance, pb_field, dj_field):
+    if isinstance(dj_field, fields.ProtoBufFieldMixin):
+        return GENERIC
+
+    funcs = instance._get_serializers(type(dj_field), pb_field)
+    if funcs == instance._pb_default_serializers:
+        if dj_field.is_relation:
+            if pb_field.message_type is None:
+                return GENERIC
+            if not hasattr(dj_field.related_model, 'to_pb_dict'):
+                return GENERIC
+            if dj_field.many_to_many or dj_field.one_to_many:
+                return MANY if _default_m2m_to_protobuf(instance) else GENERIC
+            return FOREIGN_KEY
+        if pb_field.label == FD.LABEL_REPEATED:
+            return GENERIC
+        if pb_field.message_type is None:
+            return VALUE
+        if pb_field.message_type.name in fields.GFIELD_TYPE_CAST:
+            return WRAPPER
+    elif pb_field.label != FD.LABEL_REPEATED:
+        if funcs == (fields._datetimefield_to_pb, fields._datetimefield_from_pb) \
+                and pb_field.message_type is not None \
+                and pb_field.message_type.full_name == 'google.protobuf.Timestamp':
+            return TIMESTAMP
+        if funcs == (fields._uuid_to_pb, fields._uuid_from_pb) and pb_field.type == FD.TYPE_STRING:
+            return UUID
+    return GENERIC
+
+
+def _default_m2m_to_protobuf(instance):
+    from .models import ProtoBufMixin
+    return six.get_unbound_function(type(instance)._m2m_to_protobuf) is \
+        six.get_unbound_function(ProtoBufMixin._m2m_to_protobuf)
+
+
+def get_plan(instance):
+    """Per model list of (pb_field, dj_field, kind), ordered like ``ListFields()``"""
+    model = type(instance)
+    try:
+        return _PLANS[model]
+    except KeyError:
+        pass
+
+    dj_field_map = {f.name: f for f in instance._meta.get_fields()}
+    plan = []
+    for pb_field in sorted(instance.pb_model.DESCRIPTOR.fields, key=lambda f: f.number):
+        dj_field = dj_field_map.get(instance.pb_2_dj_field_map.get(pb_field.name, pb_field.name))
+        kind = None if dj_field is None else _field_kind(instance, pb_field, dj_field)
+        plan.append((pb_field, dj_field, kind))
+    _PLANS[model] = plan
+    return plan
+
+
+def _scalar_to_json(pb_field, value):
+    """Same as ``json_format`` for a value already accepted by the field"""
+    cpp_type = pb_field.cpp_type
+    if cpp_type == FD.CPPTYPE_ENUM:
+        enum_value = pb_field.enum_type.values_by_number.get(value)
+        return enum_value.name if enum_value is not None else value
+    if cpp_type == FD.CPPTYPE_STRING:
+        if pb_field.type == FD.TYPE_BYTES:
+            return base64.b64encode(value).decode('utf-8')
+        return value
+    if cpp_type == FD.CPPTYPE_BOOL:
+        return bool(value)
+    if cpp_type in _INT64_TYPES:
+        return str(value)
+    if cpp_type in _FLOAT_TYPES:
+        if math.isinf(value):
+            return '-Infinity' if value < 0.0 else 'Infinity'
+        if math.isnan(value):
+            return 'NaN'
+        if cpp_type == FD.CPPTYPE_FLOAT and _to_shortest_float is not None:
+            return _to_shortest_float(value)
+    return value
+
+
+def _check_value(pb_field, value):
+    if six.PY2 and type(value) is buffer:  # noqa: F821
+        value = bytes(value)
+    try:
+        return type_checkers.GetTypeChecker(pb_field).CheckValue(value)
+    except TypeError as e:
+        e.args = ["Failed to serialize field '{}' - {}".format(pb_field.name, e)]
+        raise
+
+
+def _timestamp_to_json(value):
+    if settings.USE_TZ:
+        value = timezone.make_naive(value, timezone=timezone.utc)
+    micros = value.microsecond
+    result = value.replace(microsecond=0).isoformat()
+    if micros % 1000 == 0:
+        return result + ('.{:03d}Z'.format(micros // 1000) if micros else 'Z')
+    return result + '.{:06d}Z'.format(micros)
+
+
+def _relation_expand_level(expand_level):
+    return expand_level - 1 if expand_level else expand_level
+
+
+def _field_to_json(instance, pb_field, dj_field, kind, expand_level):
+    """JSON value of a field, ``_MISSING`` when ``MessageToDict`` would leave it out"""
+    value = getattr(instance, dj_field.name)
+    if dj_field.null and value is None:
+        return _MISSING
+
+    if kind == VALUE:
+        value = _check_value(pb_field, fields.normalize_dj_value(pb_field, value, instance.pb_type_cast))
+        if not _has_presence(pb_field) and value == pb_field.default_value:
+            return _MISSING
+        return _scalar_to_json(pb_field, value)
+    if kind == WRAPPER:
+        if value is None:
+            return _MISSING
+        value_field = pb_field.message_type.fields_by_name['value']
+        value = _check_value(value_field, fields.normalize_dj_value(pb_field, value, instance.pb_type_cast))
+        return _scalar_to_json(value_field, value)
+    if kind == TIMESTAMP:
+        return _timestamp_to_json(value)
+    if kind == UUID:
+        value = str(value)
+        return value if value else _MISSING
+    if kind == FOREIGN_KEY:
+        if not (expand_level is None or expand_level):
+            return _MISSING
+        return value.to_pb_dict(expand_level=_relation_expand_level(expand_level))
+    if kind == MANY:
+        if not (expand_level is None or expand_level):
+            return _MISSING
+        items = [
+            related.to_pb_dict(expand_level=_relation_expand_level(expand_level)) for related in value.all()
+        ]
+        return items if items else _MISSING
+    raise ValueError(kind)
+
+
+def model_to_dict(instance, expand_level=None):
+    """``json_format.MessageToDict(instance.to_pb(expand_level))`` without the message
+
+    :param instance: ProtoBufMixin model instance
+    :returns: dict
+    """
+    plan = get_plan(instance)
+    values, generic_pb_obj, excs = {}, None, []
+    dj_field_map = None
+    for pb_field, dj_field, kind in plan:
+        if dj_field is None:
+            continue
+        try:
+            if kind == GENERIC:
+                if generic_pb_obj is None:
+                    generic_pb_obj = instance.pb_model()
+                    dj_field_map = {f.name: f for f in instance._meta.get_fields()}
+                instance._field_to_pb(pb_field, generic_pb_obj, dj_field_map, expand_level)
+            else:
+                values[pb_field.name] = _field_to_json(instance, pb_field, dj_field, kind, expand_level)
+        except Exception as exc:
+            excs.append(exc)
+
+    excs_str = "\n".join(map(str, excs))
+    if excs_str:
+        raise Exception("multiple exceptions found:\n{}".format(excs_str))
+
+    generic = json_format.MessageToDict(generic_pb_obj) if generic_pb_obj is not None else {}
+    result = {}
+    for pb_field, _, kind in plan:
+        if kind == GENERIC:
+            if pb_field.json_name in generic:
+                result[pb_field.json_name] = generic[pb_field.json_name]
+        else:
+            value = values.get(pb_field.name, _MISSING)
+            if value is not _MISSING:
+                result[pb_field.json_name] = value
+    return result
+
+
+def _parse_scalar(pb_field, value):
+    """Same accepted input as ``json_format.ParseDict`` for a scalar field"""
+    cpp_type = pb_field.cpp_type
+    try:
+        if cpp_type == FD.CPPTYPE_ENUM:
+            if isinstance(value, six.string_types):
+                enum_value = pb_field.enum_type.values_by_name.get(value)
+                if enum_value is None:
+                    raise json_format.ParseError(
+                        'Invalid enum value {} for enum type {}'.format(value, pb_field.enum_type.full_name)
+                    )
+                return enum_value.number
+            value = int(value)
+        elif cpp_type == FD.CPPTYPE_STRING:
+            if pb_field.type == FD.TYPE_BYTES:
+                if isinstance(value, six.text_type):
+                    value = value.encode('utf-8')
+                return base64.urlsafe_b64decode(value.replace(b'+', b'-').replace(b'/', b'_')
+                                                + b'=' * (-len(value) % 4))
+        elif cpp_type in _FLOAT_TYPES and isinstance(value, six.string_types):
+            value = {'NaN': float('nan'), 'Infinity': float('inf'), '-Infinity': float('-inf')}.get(value, value)
+            value = float(value)
+        elif cpp_type not in (FD.CPPTYPE_BOOL, FD.CPPTYPE_STRING) + _FLOAT_TYPES:
+            if isinstance(value, float) and not value.is_integer():
+                raise json_format.ParseError("Couldn't parse integer: {}".format(value))
+            value = int(value)
+        return type_checkers.GetTypeChecker(pb_field).CheckValue(value)
+    except (TypeError, ValueError) as e:
+        raise json_format.ParseError('Failed to parse {} field: {}.'.format(pb_field.name, e))
+
+
+def _to_python(dj_field):
+    try:
+        return _TO_PYTHON[type(dj_field)]
+    except KeyError:
+        to_python = _TO_PYTHON[type(dj_field)] = type(dj_field)().to_python
+        return to_python
+
+
+def _value_from_json(instance, pb_field, dj_field, kind, value):
+    """Returns the converted value, ``_MISSING`` when ``from_pb`` would skip it"""
+    if kind == VALUE:
+        value = _parse_scalar(pb_field, value)
+        if not _has_presence(pb_field) and value == pb_field.default_value:
+            return _MISSING
+        if instance.pb_type_cast and pb_field.type in fields.FIELD_TYPE_CAST:
+            return _to_python(dj_field)(value)
+        return value
+    if kind == WRAPPER:
+        value = _parse_scalar(pb_field.message_type.fields_by_name['value'], value)
+        return _to_python(dj_field)(value) if instance.pb_type_cast else value
+    if kind == TIMESTAMP:
+        timestamp = timestamp_pb2.Timestamp()
+        timestamp.FromJsonString(value)
+        value = timestamp.ToDatetime()
+        if settings.USE_TZ:
+            value = timezone.localtime(timezone.make_aware(value, timezone.utc))
+        return value
+    if kind == UUID:
+        return uuid.UUID(value) if value else _MISSING
+    raise ValueError(kind)
+
+
+def dict_to_model(instance, data):
+    """``instance.from_pb(json_format.ParseDict(data, instance.pb_model()))`` without the message
+
+    :param instance: ProtoBufMixin model instance
+    :param data: dict in protobuf JSON mapping
+    :returns: instance
+    """
+    plan = get_plan(instance)
+    by_name = {}
+    for entry in plan:
+        by_name[entry[0].json_name] = entry
+        by_name[entry[0].name] = entry
+
+    generic = {}
+    for key, value in data.items():
+        try:
+            pb_field, dj_field, kind = by_name[key]
+        except KeyError:
+            raise json_format.ParseError(
+                'Message type "{}" has no field named "{}".'.format(instance.pb_model.DESCRIPTOR.full_name, key)
+            )
+        if value is None:
+            continue
+        if kind in (GENERIC, FOREIGN_KEY, MANY) or dj_field is None:
+            generic[key] = value
+            continue
+        value = _value_from_json(instance, pb_field, dj_field, kind, value)
+        if value is not _MISSING:
+            setattr(instance, dj_field.name, value)
+
+    if generic:
+        pb_obj = json_format.ParseDict(generic, instance.pb_model())
+        dj_field_map = {f.name: f for f in instance._meta.get_fields()}
+        for pb_field, pb_value in pb_obj.ListFields():
+            instance._field_from_pb(pb_field, pb_value, dj_field_map)
+    return instance
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Seeded random messages for load testing.
+
+``MessageGenerator`` fills every field of a message: scalars, enums, wrapper
+types, Timestamps, repeated, map and nested message fields (down to
+``max_depth``) and one member of every oneof. Sizes are ints, ``(min, max)``
+tuples drawn uniformly, or callables taking the ``random.Random`` instance:
+
+    generator = MessageGenerator(seed=1, repeated_size=(0, 100), string_size=lambda rand: int(rand.expovariate(0.01)))
+    messages = [generator.message(models_pb2.Root) for _ in range(1000)]
+
+``MessageGenerator.for_model(Model)`` only generates the fields mapped to
+value columns of a ProtoBufMixin model, within the range of their column,
+and ``populate()`` writes generated rows in bulk:
+
+    python -m pb_model.loadgen populate app_label.Model --rows=100000 --batch_size=1000 --seed=1
+
+with ``DJANGO_SETTINGS_MODULE`` set.
+"""
+
+from __future__ import absolute_import, print_function
+import datetime
+import logging
+import random
+import string
+import time
+import uuid
+
+import six
+from google.protobuf.descriptor import FieldDescriptor as FD
+
+from . import compat
+
+
+LOGGER = logging.getLogger(__name__)
+
+EPOCH = datetime.datetime(2020, 1, 1)
+TIMESTAMP_RANGE = 365 * 24 * 3600  # seconds after EPOCH
+
+INT_RANGES = {
+    FD.TYPE_INT32: (-2 ** 31, 2 ** 31 - 1),
+    FD.TYPE_SINT32: (-2 ** 31, 2 ** 31 - 1),
+    FD.TYPE_SFIXED32: (-2 ** 31, 2 ** 31 - 1),
+    FD.TYPE_UINT32: (0, 2 ** 32 - 1),
+    FD.TYPE_FIXED32: (0, 2 ** 32 - 1),
+    FD.TYPE_INT64: (-2 ** 63, 2 ** 63 - 1),
+    FD.TYPE_SINT64: (-2 ** 63, 2 ** 63 - 1),
+    FD.TYPE_SFIXED64: (-2 ** 63, 2 ** 63 - 1),
+    FD.TYPE_UINT64: (0, 2 ** 64 - 1),
+    FD.TYPE_FIXED64: (0, 2 ** 64 - 1),
+}
+
+_ALPHABET = string.ascii_letters + string.digits + ' '
+
+
+class MessageGenerator(object):
+    """Random messages of any type, reproducible with ``seed``
+
+    :param repeated_size: number of items of repeated fields
+    :param map_size: number of entries of map fields
+    :param string_size: length of strings
+    :param bytes_size: length of bytes
+    :param presence: probability of setting a nested message field
+    :param max_depth: nested messages below this depth stay unset
+    :param field_values: {pb field full name: callable taking the ``random.Random``
+        instance}, overriding the values of scalar fields
+    :param skip_fields: pb field full names left unset
+    """
+
+    def __init__(self, seed=None, repeated_size=(0, 5), map_size=(0, 5), string_size=(0, 32), bytes_size=(0, 32),
+                 presence=0.8, max_depth=3, field_values=None, skip_fields=()):
+        self.random = random.Random(seed)
+        self.repeated_size = repeated_size
+        self.map_size = map_size
+        self.string_size = string_size
+        self.bytes_size = bytes_size
+        self.presence = presence
+        self.max_depth = max_depth
+        self.field_values = field_values or {}
+        self.skip_fields = frozenset(skip_fields)
+
+    @classmethod
+    def for_model(cls, model, **kwargs):
+        """Generator of messages that ``model().from_pb()`` stores without relations
+
+        Fields mapped to relations or missing on the model are left unset,
+        integers and strings fit their column, UUIDField strings are UUIDs.
+        """
+        field_values, skip_fields = dict(kwargs.pop('field_values', {})), set(kwargs.pop('skip_fields', ()))
+        dj_field_map = {f.name: f for f in model._meta.fields + model._meta.many_to_many}
+        for pb_field in model.pb_model.DESCRIPTOR.fields:
+            dj_field = dj_field_map.get(model.pb_2_dj_field_map.get(pb_field.name, pb_field.name))
+            if dj_field is None or dj_field.is_relation or dj_field.primary_key:
+                skip_fields.add(pb_field.full_name)
+            elif pb_field.full_name not in field_values and pb_field.message_type is None:
+                values = cls._column_values(pb_field, dj_field)
+                if values is not None:
+                    field_values[pb_field.full_name] = values
+        return cls(field_values=field_values, skip_fields=skip_fields, **kwargs)
+
+    @staticmethod
+    def _column_values(pb_field, dj_field):
+        internal_type = dj_field.get_internal_type()
+        if internal_type == 'UUIDField':
+            return lambda rand: str(uuid.UUID(int=rand.getrandbits(128)))
+        kind = compat.DJ_FIELD_KINDS.get(internal_type)
+        if kind is None:
+            return None
+        if kind[0] == 'int' and pb_field.type in INT_RANGES:
+            dj_min, dj_max = compat._validated_range(dj_field, kind[1], kind[2])
+            pb_min, pb_max = INT_RANGES[pb_field.type]
+            min_value, max_value = max(dj_min, pb_min), min(dj_max, pb_max)
+            return lambda rand: rand.randint(min_value, max_value)
+        if kind[0] == 'text' and pb_field.type == FD.TYPE_STRING and dj_field.max_length:
+            max_length = dj_field.max_length
+            return lambda rand: u''.join(rand.choice(_ALPHABET) for _ in range(rand.randint(0, max_length)))
+        return None
+
+    def size(self, distribution):
+        if callable(distribution):
+            return max(0, int(distribution(self.random)))
+        if isinstance(distribution, (tuple, list)):
+            return self.random.randint(*distribution)
+        return distribution
+
+    def message(self, message_class, depth=0):
+        """New message of a generated message class"""
+        pb_obj = message_class()
+        self.fill(pb_obj, depth=depth)
+        return pb_obj
+
+    def fill(self, pb_obj, depth=0):
+        oneofs = {
+            oneof.name: self.random.choice(oneof.fields).name
+            for oneof in pb_obj.DESCRIPTOR.oneofs if oneof.fields
+        }
+        for pb_field in pb_obj.DESCRIPTOR.fields:
+            if pb_field.full_name in self.skip_fields:
+                continue
+            if pb_field.containing_oneof is not None and oneofs[pb_field.containing_oneof.name] != pb_field.name:
+                continue
+            if pb_field.message_type is not None and pb_field.message_type.GetOptions().map_entry:
+                self._fill_map(pb_obj, pb_field, depth)
+            elif pb_field.label == FD.LABEL_REPEATED:
+                self._fill_repeated(pb_obj, pb_field, depth)
+            elif pb_field.message_type is not None:
+                if depth < self.max_depth and self.random.random() < self.presence:
+                    self._fill_message(getattr(pb_obj, pb_field.name), pb_field, depth + 1)
+            else:
+                setattr(pb_obj, pb_field.name, self.scalar(pb_field))
+        return pb_obj
+
+    def _fill_message(self, pb_obj, pb_field, depth):
+        full_name = pb_field.message_type.full_name
+        if full_name == 'google.protobuf.Timestamp':
+            pb_obj.FromDatetime(EPOCH + datetime.timedelta(seconds=self.random.randint(0, TIMESTAMP_RANGE)))
+        elif full_name.startswith('google.protobuf.') and 'value' in pb_obj.DESCRIPTOR.fields_by_name:
+            pb_obj.value = self.scalar(pb_obj.DESCRIPTOR.fields_by_name['value'])
+        else:
+            pb_obj.SetInParent()
+            self.fill(pb_obj, depth=depth)
+
+    def _fill_repeated(self, pb_obj, pb_field, depth):
+        repeated = getattr(pb_obj, pb_field.name)
+        if pb_field.message_type is None:
+            repeated.extend(self.scalar(pb_field) for _ in range(self.size(self.repeated_size)))
+        elif depth < self.max_depth:
+            for _ in range(self.size(self.repeated_size)):
+                self._fill_message(repeated.add(), pb_field, depth + 1)
+
+    def _fill_map(self, pb_obj, pb_field, depth):
+        key_field, value_field = (pb_field.message_type.fields_by_name[name] for name in ('key', 'value'))
+        if value_field.message_type is not None and depth >= self.max_depth:
+            return
+        entries = getattr(pb_obj, pb_field.name)
+        for _ in range(self.size(self.map_size)):
+            key = self.scalar(key_field)
+            if value_field.message_type is None:
+                entries[key] = self.scalar(value_field)
+            else:
+                self._fill_message(entries[key], value_field, depth + 1)
+
+    def scalar(self, pb_field):
+        """Random value of a scalar or enum field"""
+        if pb_field.full_name in self.field_values:
+            return self.field_values[pb_field.full_name](self.random)
+        type_ = pb_field.type
+        if type_ in INT_RANGES:
+            return self.random.randint(*INT_RANGES[type_])
+        if type_ in (FD.TYPE_DOUBLE, FD.TYPE_FLOAT):
+            return round(self.random.uniform(-1e6, 1e6), 2)
+        if type_ == FD.TYPE_BOOL:
+            return self.random.random() < 0.5
+        if type_ == FD.TYPE_ENUM:
+            return self.random.choice(pb_field.enum_type.values).number
+        if type_ == FD.TYPE_STRING:
+            return u''.join(self.random.choice(_ALPHABET) for _ in range(self.size(self.string_size)))
+        if type_ == FD.TYPE_BYTES:
+            return bytes(bytearray(self.random.getrandbits(8) for _ in range(self.size(self.bytes_size))))
+        raise TypeError("Can't generate values of field {}".format(pb_field.full_name))
+
+
+def _foreign_key_values(model, using=None):
+    """{attname: [pks]} of the non-null foreign keys of a model, picked from existing rows"""
+    values = {}
+    for dj_field in model._meta.fields:
+        if dj_field.many_to_one and not dj_field.null:
+            pks = list(dj_field.related_model._default_manager.using(using).values_list('pk', flat=True)[:10000])
+            if not pks:
+                raise ValueError("{} needs rows of {} for {}, populate it first".format(
+                    model._meta.label, dj_field.related_model._meta.label, dj_field.name
+                ))
+            values[dj_field.attname] = pks
+    return values
+
+
+def populate(model, rows, batch_size=1000, seed=None, using=None, **generator_kwargs):
+    """Write ``rows`` objects of generated messages, ``batch_size`` per transaction
+
+    Relations are not generated, non-null foreign keys point at random existing rows.
+
+    :param model: ProtoBufMixin model class, or its "app_label.ModelName"
+    :returns: (rows, seconds)
+    """
+    from django.apps import apps
+    from . import ingest
+
+    if isinstance(model, six.string_types):
+        model = apps.get_model(model)
+    generator = MessageGenerator.for_model(model, seed=seed, **generator_kwargs)
+    foreign_keys = _foreign_key_values(model, using=using)
+
+    written, start = 0, time.time()
+    while written < rows:
+        objs = []
+        for _ in range(min(batch_size, rows - written)):
+            obj = model().from_pb(generator.message(model.pb_model))
+            for attname, pks in foreign_keys.items():
+                setattr(obj, attname, generator.random.choice(pks))
+            objs.append(obj)
+        written += ingest.save_objects(model, objs, using=using)
+        LOGGER.debug("Populated {} of {} {} rows".format(written, rows, model._meta.label))
+    return written, time.time() - start
+
+
+class _Command(object):
+    def populate(self, model, rows=10000, batch_size=1000, seed=None, using=None):
+        """Populate a model at a target row count and print the throughput"""
+        import django
+        django.setup()
+        written, seconds = populate(model, rows, batch_size=batch_size, seed=seed, using=using)
+        print("{} rows of {} in {:.2f}s, {:.0f} rows/s".format(written, model, seconds, written / max(seconds, 1e-9)))
+
+
+if __name__ == '__main__':
+    import fire
+    fire.Fire(_Command)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Database side lookups for JSON encoded ``ArrayField`` and ``MapField`` columns.
+
+The columns are plain text, so every lookup parses them with the JSON functions
+of the database: JSON1 on SQLite and ``jsonb`` operators on PostgreSQL.
+Other vendors raise ``NotSupportedError``.
+"""
+
+from __future__ import absolute_import
+import json
+
+from django.db import NotSupportedError
+from django.db.models import IntegerField, Lookup, TextField, Transform
+
+
+def _key_path(key_name):
+    return '$.{}'.format(json.dumps(key_name))
+
+
+class JSONVendorMixin(object):
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError(
+            "'{}' lookup on JSON columns is not supported by {}".format(self.lookup_name, connection.vendor)
+        )
+
+
+class ArrayContains(JSONVendorMixin, Lookup):
+    """``list_field__contains=42``: the array has an element equal to the value."""
+    lookup_name = 'contains'
+    prepare_rhs = False
+
+    def as_sqlite(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        sql = "EXISTS (SELECT 1 FROM json_each({}) WHERE json_each.value = json_extract(%s, '$'))".format(lhs)
+        return sql, list(params) + [json.dumps(self.rhs)]
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        return '({})::jsonb @> %s::jsonb'.format(lhs), list(params) + [json.dumps([self.rhs])]
+
+
+class MapContains(JSONVendorMixin, Lookup):
+    """``map_field__contains={'key': 'value'}``: the map holds all given items."""
+    lookup_name = 'contains'
+    prepare_rhs = False
+
+    def as_sqlite(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        if not self.rhs:
+            return '{} IS NOT NULL'.format(lhs), list(lhs_params)
+
+        sqls, params = [], []
+        for key, value in sorted(self.rhs.items()):
+            sqls.append("json_extract({}, %s) = json_extract(%s, '$')".format(lhs))
+            params.extend(lhs_params)
+            params.extend([_key_path(key), json.dumps(value)])
+        return '({})'.format(' AND '.join(sqls)), params
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        return '({})::jsonb @> %s::jsonb'.format(lhs), list(params) + [json.dumps(self.rhs)]
+
+
+class MapHasKey(JSONVendorMixin, Lookup):
+    """``map_field__has_key='key'``"""
+    lookup_name = 'has_key'
+    prepare_rhs = False
+
+    def as_sqlite(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        return 'json_type({}, %s) IS NOT NULL'.format(lhs), list(params) + [_key_path(self.rhs)]
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        return '({})::jsonb ? %s'.format(lhs), list(params) + [self.rhs]
+
+
+class ArrayLength(JSONVendorMixin, Transform):
+    """``list_field__len__gte=2``"""
+    lookup_name = 'len'
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection):
+        lhs, params = compiler.compile(self.lhs)
+        return 'json_array_length({})'.format(lhs), params
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = compiler.compile(self.lhs)
+        return 'jsonb_array_length(({})::jsonb)'.format(lhs), params
+
+
+class MapLength(JSONVendorMixin, Transform):
+    """``map_field__len=0``"""
+    lookup_name = 'len'
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection):
+        lhs, params = compiler.compile(self.lhs)
+        return '(SELECT COUNT(*) FROM json_each({}))'.format(lhs), params
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = compiler.compile(self.lhs)
+        return '(SELECT COUNT(*) FROM jsonb_object_keys(({})::jsonb))'.format(lhs), params
+
+
+class KeyTransform(JSONVendorMixin, Transform):
+    """
+    ``map_field__<key>``: value stored under a map key. Compared with ``exact`` the
+    value is matched as JSON, other lookups see it as text.
+    """
+    lookup_name = 'key'
+    output_field = TextField()
+
+    def __init__(self, key_name, *args, **kwargs):
+        super(KeyTransform, self).__init__(*args, **kwargs)
+        self.key_name = key_name
+
+    def as_sqlite(self, compiler, connection):
+        lhs, params = compiler.compile(self.lhs)
+        return 'json_extract({}, %s)'.format(lhs), list(params) + [_key_path(self.key_name)]
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = compiler.compile(self.lhs)
+        return '(({})::jsonb ->> %s)'.format(lhs), list(params) + [self.key_name]
+
+
+class KeyTransformFactory(object):
+    def __init__(self, key_name):
+        self.key_name = key_name
+
+    def __call__(self, *args, **kwargs):
+        return KeyTransform(self.key_name, *args, **kwargs)
+
+
+@KeyTransform.register_lookup
+class KeyTransformExact(JSONVendorMixin, Lookup):
+    lookup_name = 'exact'
+    prepare_rhs = False
+
+    def as_sqlite(self, compiler, connection):
+        lhs, params = self.process_lhs(compiler, connection)
+        if self.rhs is None:
+            return '{} IS NULL'.format(lhs), list(params)
+        return "{} = json_extract(%s, '$')".format(lhs), list(params) + [json.dumps(self.rhs)]
+
+    def as_postgresql(self, compiler, connection):
+        lhs, params = compiler.compile(self.lhs.lhs)
+        sql = '(({})::jsonb -> %s) = %s::jsonb'.format(lhs)
+        return sql, list(params) + [self.lhs.key_name, json.dumps(self.rhs)]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import io
+
+from django.core.management.base import BaseCommand
+
+from pb_model import codegen
+
+
+class Command(BaseCommand):
+    help = "Generate specialized to_pb/from_pb functions for ProtoBufMixin models"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Path of the Python module to write")
+        parser.add_argument('app_label', nargs='*', help="Only generate for models of these apps")
+
+    def handle(self, *args, **options):
+        source, count = codegen.generate_for_apps(options['app_label'])
+        with io.open(options['output'], 'w', encoding='utf-8') as f:
+            f.write(source)
+        self.stdout.write("Generated serializers for {} models into {}".format(count, options['output']))
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from pb_model import compat
+
+
+class Command(BaseCommand):
+    help = "Print the type compatibility of the protobuf and Django fields of ProtoBufMixin models"
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_label', nargs='*', help="Only report models of these apps")
+
+    def handle(self, *args, **options):
+        from pb_model.models import ProtoBufMixin
+
+        pb_models = sorted((
+            model for model in apps.get_models()
+            if issubclass(model, ProtoBufMixin) and model.pb_model is not None
+            and (not options['app_label'] or model._meta.app_label in options['app_label'])
+        ), key=lambda model: model._meta.label)
+        self.stdout.write(compat.report(pb_models))
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Runtime metrics of ``to_pb`` and ``from_pb`` conversions.
+
+Metrics are off by default and cost one attribute check per conversion.
+Once enabled, every conversion is counted per model with its cumulative
+time, bytes (serialized size of the produced message for ``to_pb``, of the
+converted one for ``from_pb``), database queries and exceptions:
+
+    from pb_model import metrics
+
+    metrics.enable()
+    ...
+    metrics.snapshot()    # {'app.Model': {'to_pb': {'calls': 3, 'seconds': ..., 'fields': {}}}}
+    metrics.prometheus()  # text exposition format
+
+Times are inclusive: the conversion of a parent includes the nested ones.
+``enable(per_field=True)`` also measures every field, which bypasses the
+generated serializers (see ``pb_model.codegen``) and is meant for profiling.
+
+Queries are counted with ``connection.execute_wrapper`` (Django >= 2.0), on
+older versions by wrapping the cursors of the connections.
+"""
+
+from __future__ import absolute_import
+import threading
+import time
+
+from django.db import connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.signals import connection_created
+
+
+TO_PB = 'to_pb'
+FROM_PB = 'from_pb'
+
+enabled = False
+measure_fields = False  # enable(per_field=True)
+
+_lock = threading.Lock()
+_local = threading.local()
+_stats = {}  # (model label, operation, field name or None) in key, Stats in value
+_EXECUTE_WRAPPERS = hasattr(BaseDatabaseWrapper, 'execute_wrapper')  # Django >= 2.0
+
+
+class Stats(object):
+    __slots__ = ('calls', 'seconds', 'bytes', 'queries', 'errors')
+
+    def __init__(self):
+        self.calls = self.bytes = self.queries = self.errors = 0
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _count_queries(count=1):
+    _local.queries = getattr(_local, 'queries', 0) + count
+
+
+def _count_query(execute, sql, params, many, context):
+    _count_queries()
+    return execute(sql, params, many, context)
+
+
+class _CountingCursor(object):
+    """Cursor counting its queries, for Django < 2.0 which has no ``execute_wrapper``"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def callproc(self, procname, params=None):
+        _count_queries()
+        return self.cursor.callproc(procname, params)
+
+    def execute(self, sql, params=None):
+        _count_queries()
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        _count_queries()
+        return self.cursor.executemany(sql, param_list)
+
+
+def _counting(make_cursor):
+    def make_counting_cursor(cursor):
+        return _CountingCursor(make_cursor(cursor))
+    make_counting_cursor.counting = True
+    return make_counting_cursor
+
+
+def _install_query_counter(sender=None, connection=None, **_):
+    if connection is None:
+        return
+    if _EXECUTE_WRAPPERS:
+        if _count_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_count_query)
+    elif not getattr(connection.make_cursor, 'counting', False):
+        # instance attributes, the wrapped cursors are made by BaseDatabaseWrapper._prepare_cursor()
+        connection.make_cursor = _counting(connection.make_cursor)
+        connection.make_debug_cursor = _counting(connection.make_debug_cursor)
+
+
+def _query_count():
+    return getattr(_local, 'queries', 0)
+
+
+def enable(per_field=False):
+    """Start collecting, also per field when ``per_field``"""
+    global enabled, measure_fields
+    connection_created.connect(_install_query_counter, dispatch_uid='pb_model_metrics')
+    for connection in connections.all():
+        _install_query_counter(connection=connection)
+    enabled, measure_fields = True, per_field
+
+
+def disable():
+    """Stop collecting, collected metrics are kept until ``reset()``"""
+    global enabled, measure_fields
+    enabled = measure_fields = False
+    connection_created.disconnect(dispatch_uid='pb_model_metrics')
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+class Measurement(object):
+    """Context manager recording one conversion
+
+    :attr result: message whose serialized size is recorded, set it before leaving
+    :param message: message whose growth is recorded instead, for fields of ``to_pb``
+    """
+    __slots__ = ('key', 'message', 'result', 'start', 'start_bytes', 'start_queries')
+
+    def __init__(self, key, message=None):
+        self.key, self.message, self.result = key, message, None
+
+    def __enter__(self):
+        self.start_bytes = self.message.ByteSize() if self.message is not None else 0
+        self.start_queries = _query_count()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.time() - self.start
+        queries = _query_count() - self.start_queries
+        if self.message is not None:
+            nbytes = self.message.ByteSize() - self.start_bytes
+        else:
+            nbytes = self.result.ByteSize() if self.result is not None else 0
+        with _lock:
+            stats = _stats.get(self.key)
+            if stats is None:
+                stats = _stats[self.key] = Stats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.bytes += nbytes
+            stats.queries += queries
+            stats.errors += exc_type is not None
+        return False
+
+
+def measure(model, operation, field_name=None, message=None):
+    """Measurement of one conversion of a model, or of one of its fields"""
+    return Measurement((model._meta.label, operation, field_name), message=message)
+
+
+def snapshot():
+    """Collected metrics as ``{model label: {operation: {...totals, 'fields': {name: {...}}}}}``"""
+    with _lock:
+        items = [(key, stats.as_dict()) for key, stats in _stats.items()]
+    result = {}
+    for (label, operation, field_name), values in items:
+        totals = result.setdefault(label, {}).setdefault(operation, dict(Stats().as_dict(), fields={}))
+        if field_name is None:
+            totals.update(values)
+        else:
+            totals['fields'][field_name] = values
+    return result
+
+
+_PROMETHEUS_METRICS = [
+    ('calls', 'pb_model_conversions_total', 'Number of conversions.'),
+    ('seconds', 'pb_model_conversion_seconds_total', 'Cumulative conversion time, nested conversions included.'),
+    ('bytes', 'pb_model_conversion_bytes_total', 'Serialized size of the converted messages.'),
+    ('queries', 'pb_model_conversion_queries_total', 'Database queries issued by conversions.'),
+    ('errors', 'pb_model_conversion_errors_total', 'Conversions which raised an exception.'),
+]
+
+
+def _label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus():
+    """Collected metrics in the Prometheus text exposition format"""
+    with _lock:
+        items = sorted(((key, stats.as_dict()) for key, stats in _stats.items()), key=lambda item: (
+            item[0][0], item[0][1], item[0][2] or ''
+        ))
+    lines = []
+    for attr, name, help_text in _PROMETHEUS_METRICS:
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} counter'.format(name))
+        for (label, operation, field_name), values in items:
+            lines.append('{}{{model="{}",operation="{}",field="{}"}} {}'.format(
+                name, _label_value(label), operation, _label_value(field_name or ''), values[attr]
+            ))
+    return '\n'.join(lines) + '\n'
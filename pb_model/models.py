@@ -3,16 +3,19 @@
 
 from __future__ import absolute_import
 import functools
+import json
 import logging
 import six
 
-from django.db import models
+from django.db import IntegrityError, connections, models, router, transaction
 from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.contrib.postgres import fields as postgres_fields
+from django.db.models.query_utils import DeferredAttribute
 
 from google.protobuf.descriptor import FieldDescriptor as FD
 
-from . import fields
+from . import cache, codegen, compat, context, fields, graph, json_mapping, metrics, outbox, readonly, reconcile, references
 from six.moves import map
 
 
@@ -27,6 +30,46 @@ class DjangoPBModelError(Exception):
     pass
 
 
+def _int_range(min_value, max_value):
+    return {'validators': [MinValueValidator(min_value), MaxValueValidator(max_value)]}
+
+
+# Column types of generated scalar fields selected by ``pb_storage_profile``. "compact" uses
+# the narrowest native column with range validators instead of DecimalField/NullBooleanField,
+# proto3 fields without presence are non-null columns defaulting to the protobuf default.
+STORAGE_PROFILES = {
+    'compact': {
+        FD.TYPE_DOUBLE: (models.FloatField, {}),
+        FD.TYPE_FLOAT: (models.FloatField, {}),
+        FD.TYPE_INT32: (models.IntegerField, {}),
+        FD.TYPE_SINT32: (models.IntegerField, {}),
+        FD.TYPE_SFIXED32: (models.IntegerField, {}),
+        FD.TYPE_INT64: (models.BigIntegerField, {}),
+        FD.TYPE_SINT64: (models.BigIntegerField, {}),
+        FD.TYPE_SFIXED64: (models.BigIntegerField, {}),
+        FD.TYPE_UINT32: (models.BigIntegerField, _int_range(0, 2 ** 32 - 1)),
+        FD.TYPE_FIXED32: (models.BigIntegerField, _int_range(0, 2 ** 32 - 1)),
+        FD.TYPE_UINT64: (models.BigIntegerField, _int_range(0, 2 ** 63 - 1)),
+        FD.TYPE_FIXED64: (models.BigIntegerField, _int_range(0, 2 ** 63 - 1)),
+        FD.TYPE_BOOL: (models.BooleanField, {}),
+        FD.TYPE_STRING: (models.TextField, {}),
+        FD.TYPE_BYTES: (models.BinaryField, {}),
+        FD.TYPE_ENUM: (models.IntegerField, {}),  # proto3 enums are open, any int32 value is accepted
+    },
+}  # profile name in key, {pb field type: (dj field type, field kwargs)} in value
+
+
+_BOUND_SERIALIZERS = {}
+
+
+def _bound_serializers(serializers, type_cast):
+    """``default_serializers`` with ``force_type_cast`` applied, one tuple per value"""
+    key = (tuple(serializers), type_cast)
+    if key not in _BOUND_SERIALIZERS:
+        _BOUND_SERIALIZERS[key] = tuple(functools.partial(func, force_type_cast=type_cast) for func in serializers)
+    return _BOUND_SERIALIZERS[key]
+
+
 class Meta(type(models.Model)):
     def __init__(self, name, bases, attrs):
         super(Meta, self).__init__(name, bases, attrs)
@@ -36,6 +79,11 @@ class Meta(type(models.Model)):
         self.pb_auto_field_type_mapping = self.pb_auto_field_type_mapping.copy()
         self.pb_auto_field_type_mapping.update(attrs.get('pb_auto_field_type_mapping', {}))
 
+        if self.pb_storage_profile is not None and self.pb_storage_profile not in STORAGE_PROFILES:
+            raise DjangoPBModelError("Unknown pb_storage_profile {!r} of {}, expected one of: {}".format(
+                self.pb_storage_profile, name, ', '.join(sorted(STORAGE_PROFILES))
+            ))
+
         if self.pb_model is not None:
             if self.pb_2_dj_fields == '__all__':
                 self.pb_2_dj_fields = list(self.pb_model.DESCRIPTOR.fields_by_name.keys())
@@ -48,6 +96,16 @@ class Meta(type(models.Model)):
                     if field is not None:
                         field.contribute_to_class(self, dj_field_name)
 
+        for dj_field_name in self.pb_2_dj_reference_fields:
+            dj_field = self._meta.get_field(dj_field_name)
+            if not (dj_field.many_to_one or dj_field.one_to_one) or not dj_field.concrete:
+                raise DjangoPBModelError("pb_2_dj_reference_fields of {} lists {}, which is not a ForeignKey".format(
+                    name, dj_field_name
+                ))
+
+        # shared by all instances, ProtoBufMixin adds no per-instance state in __init__
+        self._pb_default_serializers = _bound_serializers(self.default_serializers, self.pb_type_cast)
+
     def _create_field(self, message_field):
         message_field_type = message_field.type
 
@@ -63,10 +121,12 @@ class Meta(type(models.Model)):
         elif Meta._is_message_field(message_field):
             if message_field.message_type.name == 'Timestamp':
                 return self._create_timestamp_field()
+            elif self._is_inline_message_field(message_field):
+                return self._create_inline_message_field(message_field)
             else:
                 return self._create_message_field(message_field.containing_type.name, message_field.message_type.name, message_field.name)
         else:
-            return self._create_generic_field(message_field_type)
+            return self._create_generic_field(message_field_type, message_field)
 
     @staticmethod
     def _is_message_field(field_descriptor):
@@ -103,14 +163,35 @@ class Meta(type(models.Model)):
         """
         return Meta._is_map_field(field_descriptor) and Meta._is_message_field(field_descriptor.message_type.fields_by_name['value'])
 
-    def _create_generic_field(self, type_):
+    def _create_generic_field(self, type_, message_field=None):
         """
-        Creates a django field of the type that is defined in `pb_auto_field_type_mapping`.
+        Creates a django field of the type that is defined in `pb_auto_field_type_mapping`,
+        or in `pb_storage_profile` when set.
         :param type_: Protobuf field type.
+        :param message_field: protobuf field descriptor, None for nullable columns
         :return: Django field.
         """
-        field_type = self.pb_auto_field_type_mapping[type_]
-        return field_type(null=True)
+        profile = STORAGE_PROFILES.get(self.pb_storage_profile, {})
+        if type_ not in profile:
+            field_type = self.pb_auto_field_type_mapping[type_]
+            return field_type(null=True)
+
+        field_type, kwargs = profile[type_]
+        kwargs = dict(kwargs)
+        if message_field is None or Meta._has_presence(message_field):
+            kwargs['null'] = True
+        else:
+            kwargs['default'] = message_field.default_value
+        return field_type(**kwargs)
+
+    @staticmethod
+    def _has_presence(field_descriptor):
+        """
+        Checks if unset and default values of a scalar field can be told apart (proto2 or oneof).
+        :param field_descriptor: protobuf field descriptor
+        :return: bool
+        """
+        return field_descriptor.containing_oneof is not None or field_descriptor.file.syntax == 'proto2'
 
     def _create_timestamp_field(self):
         field_type = self.pb_auto_field_type_mapping[fields.PB_FIELD_TYPE_TIMESTAMP]
@@ -124,6 +205,27 @@ class Meta(type(models.Model)):
         field_type = self.pb_auto_field_type_mapping[fields.PB_FIELD_TYPE_REPEATED]
         return field_type()
 
+    def _is_inline_message_field(self, field_descriptor):
+        """
+        Checks if a given message field is stored in columns of the model itself,
+        either listed in `pb_2_dj_inline_fields` or by type mapping.
+        :param field_descriptor: protobuf field descriptor
+        :return: bool
+        """
+        field_type = self.pb_auto_field_type_mapping[fields.PB_FIELD_TYPE_MESSAGE]
+        return field_descriptor.name in self.pb_2_dj_inline_fields or issubclass(field_type, fields.InlineMessageField)
+
+    def _create_inline_message_field(self, field_descriptor):
+        """
+        Creates a field that stores the message in prefixed columns of the model.
+        :param field_descriptor: protobuf field descriptor
+        :return: InlineMessageField
+        """
+        field_type = self.pb_auto_field_type_mapping[fields.PB_FIELD_TYPE_MESSAGE]
+        if not issubclass(field_type, fields.InlineMessageField):
+            field_type = fields.InlineMessageField
+        return field_type(field_descriptor.message_type)
+
     def _create_message_field(self, own_type, related_type, field_name):
         field_type = self.pb_auto_field_type_mapping[fields.PB_FIELD_TYPE_MESSAGE]
         return field_type(to=related_type, related_name='%s_%s' % (own_type, field_name), on_delete=models.deletion.CASCADE, null=True)
@@ -151,6 +253,107 @@ class Meta(type(models.Model)):
         return field_type(to=related_type, related_name='%s_%s' % (own_type, field_name))
 
 
+class ProtoBufQuerySet(models.QuerySet):
+    """QuerySet rendering its objects in the protobuf JSON mapping
+
+    Bulk writes of models with ``pb_outbox`` are recorded in the outbox.
+    JSON columns of fetched instances are decoded on first access.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ProtoBufQuerySet, self).__init__(*args, **kwargs)
+        self._iterable_class = fields.LazyJSONModelIterable
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if not self.model.pb_outbox:
+            return super(ProtoBufQuerySet, self).bulk_create(objs, *args, **kwargs)
+
+        objs = list(objs)
+        ignore_conflicts = kwargs.get('ignore_conflicts', args[1] if len(args) > 1 else False)
+        features = connections[self.db].features
+        can_return_pks = getattr(  # renamed in Django 3.0
+            features, 'can_return_rows_from_bulk_insert', getattr(features, 'can_return_ids_from_bulk_insert', False)
+        )
+        with transaction.atomic(using=self.db):
+            if all(obj.pk for obj in objs):
+                objs = super(ProtoBufQuerySet, self).bulk_create(objs, *args, **kwargs)
+                # rows skipped by ignore_conflicts keep their stored values
+                outbox.record_saved(self.model, [obj.pk for obj in objs] if ignore_conflicts else objs, using=self.db)
+            elif can_return_pks and not ignore_conflicts:
+                objs = super(ProtoBufQuerySet, self).bulk_create(objs, *args, **kwargs)
+                outbox.record_saved(self.model, objs, using=self.db)
+            else:
+                LOGGER.debug("Primary keys of bulk inserted rows are unknown, saving one by one")
+                for obj in objs:
+                    if ignore_conflicts:
+                        try:
+                            with transaction.atomic(using=self.db):
+                                obj.save(force_insert=True, using=self.db)
+                        except IntegrityError:
+                            pass
+                    else:
+                        obj.save(force_insert=True, using=self.db)
+        return objs
+
+    def bulk_update(self, objs, *args, **kwargs):
+        cache.clear_model(self.model)
+        if not self.model.pb_outbox:
+            return super(ProtoBufQuerySet, self).bulk_update(objs, *args, **kwargs)
+
+        objs = list(objs)
+        with transaction.atomic(using=self.db):
+            rows = super(ProtoBufQuerySet, self).bulk_update(objs, *args, **kwargs)
+            # fetched again, only the listed fields were written
+            outbox.record_saved(self.model, [obj.pk for obj in objs], using=self.db)
+        return rows
+    bulk_update.alters_data = True
+
+    def update(self, **kwargs):
+        cache.clear_model(self.model)
+        if not self.model.pb_outbox:
+            return super(ProtoBufQuerySet, self).update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            rows = super(ProtoBufQuerySet, self).update(**kwargs)
+            outbox.record_saved(self.model, pks, using=self.db)
+        return rows
+    update.alters_data = True
+
+    def delete(self):
+        cache.clear_model(self.model)
+        if not self.model.pb_outbox:
+            return super(ProtoBufQuerySet, self).delete()
+
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            deleted = super(ProtoBufQuerySet, self).delete()
+            outbox.record_deleted(self.model, pks, using=self.db)
+        return deleted
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def to_pb_list(self, expand_level=None):
+        """List of ``to_pb()`` of all objects, sharing one serialization context
+
+        :returns: list of ProtoBuf instances
+        """
+        with context.serialization_context(shared=False) as _context:
+            messages = [obj.to_pb(expand_level=expand_level) for obj in self]
+        LOGGER.debug(
+            "Serialized %s objects, %s conversions, %s saved by the identity map",
+            len(messages), _context.conversions, _context.saved
+        )
+        return messages
+
+    def to_pb_dicts(self, expand_level=None):
+        """List of ``to_pb_dict()`` of all objects
+
+        :returns: list of dict
+        """
+        return [obj.to_pb_dict(expand_level=expand_level) for obj in self]
+
+
 class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
     """This is mixin for model.Model.
     By setting attribute ``pb_model``, you can specify target ProtoBuf Message
@@ -162,10 +365,19 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
     class Meta:
         abstract = True
 
+    objects = ProtoBufQuerySet.as_manager()
+
     pb_model = None
     pb_type_cast = True
+    pb_storage_profile = None  # name in STORAGE_PROFILES to override the column types of generated scalar fields
+    pb_outbox = False  # record changes in the OutboxMessage table, see pb_model.outbox
+    pb_compat_ignore = []  # pb field names whose lossy or incompatible conversion is intended, see pb_model.compat
+    pb_reference_cache = None  # True or {'max_size': ..., 'ttl': ...} to cache as ForeignKey target, see pb_model.cache
     pb_2_dj_fields = []  # list of pb field names that are mapped, special case pb_2_dj_fields = '__all__'
     pb_2_dj_field_map = {}  # pb field in keys, dj field in value
+    pb_2_dj_inline_fields = []  # list of pb message fields stored in prefixed columns instead of a relation
+    pb_2_dj_reference_fields = []  # list of dj ForeignKey fields set from the id of the nested message, see pb_model.references
+    pb_2_dj_reconcile_fields = {}  # reverse FK / m2m dj field name in key, True or options in value, see pb_model.reconcile
     pb_2_dj_field_serializers = {
         models.DateTimeField: (fields._datetimefield_to_pb,
                                fields._datetimefield_from_pb),
@@ -204,16 +416,34 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
 
     default_serializers = (fields._defaultfield_to_pb, fields._defaultfield_from_pb)
 
-    def __init__(self, *args, **kwargs):
-        super(ProtoBufMixin, self).__init__(*args, **kwargs)
+    def save(self, *args, **kwargs):
+        self._pb_materialize()
+        if self.pb_outbox or '_pb_reconcile_pending' in self.__dict__:
+            with transaction.atomic(using=kwargs.get('using')):
+                self._save(*args, **kwargs)
+                self._pb_reconcile(using=self._state.db)
+                if self.pb_outbox:
+                    outbox.record_saved(type(self), [self], using=self._state.db)
+        else:
+            self._save(*args, **kwargs)
 
-        self.default_serializers = tuple([functools.partial(func, force_type_cast=self.pb_type_cast) for func in self.default_serializers])
-        for m2m_field in self._meta.many_to_many:
-            if issubclass(type(m2m_field), fields.ProtoBufFieldMixin):
-                m2m_field.load(self)
-        # TODO: also object.update
+    def _pb_reconcile(self, using=None):
+        """Apply the collections of ``pb_2_dj_reconcile_fields`` kept by ``from_pb``"""
+        pending = self.__dict__.pop('_pb_reconcile_pending', {})
+        for dj_field_name, pb_messages in pending.items():
+            reconcile.reconcile(self, dj_field_name, pb_messages, using=using)
 
-    def save(self, *args, **kwargs):
+    def save_graph(self, using=None):
+        """Save this instance with the unsaved related instances built by ``from_pb``
+
+        Objects are written level by level with one ``bulk_create`` per model,
+        in a single transaction, see ``pb_model.graph``.
+
+        :returns: the written instances, grouped by level with leaves first
+        """
+        return graph.save_graph([self], using=using)
+
+    def _save(self, *args, **kwargs):
         super(ProtoBufMixin, self).save(*args, **kwargs)
         for m2m_field in self._meta.many_to_many:
             if issubclass(type(m2m_field), fields.ProtoBufFieldMixin):
@@ -221,19 +451,33 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
         kwargs['force_insert'] = False
         super(ProtoBufMixin, self).save(*args, **kwargs)
 
+    def delete(self, using=None, keep_parents=False):
+        if not self.pb_outbox:
+            return super(ProtoBufMixin, self).delete(using=using, keep_parents=keep_parents)
+
+        pk, using = self.pk, using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            deleted = super(ProtoBufMixin, self).delete(using=using, keep_parents=keep_parents)
+            outbox.record_deleted(type(self), [pk], using=using)
+        return deleted
+
     def _field_to_pb(self, _f, _pb_obj, _dj_field_map, expand_level):
         _dj_f_name = self.pb_2_dj_field_map.get(_f.name, _f.name)
         if _dj_f_name not in _dj_field_map:
-            LOGGER.warning("No such django field: {}".format(_f.name))
+            LOGGER.warning("No such django field: %s", _f.name)
             return
 
         try:
-            _dj_f_value, _dj_f_type = getattr(self, _dj_f_name), _dj_field_map[
-                _dj_f_name]
+            _dj_f_type = _dj_field_map[_dj_f_name]
+            if self._is_reference_field(_dj_f_type, _f):
+                # only the foreign key value, the target is looked up in the reference cache
+                _dj_f_value = getattr(self, _dj_f_type.attname)
+            else:
+                _dj_f_value = getattr(self, _dj_f_name)
             if not (_dj_f_type.null and _dj_f_value is None):
                 # See if there's a custom serializer for this field relation or not.
                 field_serializers = self._get_serializers(type(_dj_f_type), _f)
-                if field_serializers and field_serializers != self.default_serializers:
+                if field_serializers and field_serializers != self._pb_default_serializers:
                     self._value_to_protobuf(
                         _pb_obj, _f, type(_dj_f_type), _dj_f_value,
                         expand_level=expand_level
@@ -266,21 +510,81 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
                 )
             )
 
-    def to_pb(self, expand_level=None):
+    def to_pb(self, expand_level=None, into=None):
         """Convert django model to protobuf instance by pre-defined name
 
+        Related objects reached several times are converted once per
+        serialization context, see ``pb_model.context``.
+
+        :param into: empty message to fill instead of a new one, e.g. a
+            sub-message or an ``add()``ed element of the parent message
         :returns: ProtoBuf instance
         """
-        _pb_obj = self.pb_model()
+        if not metrics.enabled:
+            return self._to_pb_in_context(expand_level, into)
+        with metrics.measure(type(self), metrics.TO_PB) as measurement:
+            measurement.result = self._to_pb_in_context(expand_level, into)
+        return measurement.result
+
+    def _to_pb_in_context(self, expand_level, into):
+        _context = context.current_context()
+        if _context is None:
+            # only the nested conversions of this call can be answered from its context
+            with context.serialization_context(shared=False):
+                return self._to_pb(expand_level, into)
+        if self.pk is None:
+            return self._to_pb(expand_level, into)
+
+        key = (type(self), self.pk, expand_level)
+        _cached = _context.get(key)
+        if _cached is None:
+            _pb_obj = self._to_pb(expand_level, into)
+            if _context.shared:
+                # the result belongs to the caller, the identity map keeps its own copy
+                _cached = self.pb_model()
+                _cached.CopyFrom(_pb_obj)
+            else:
+                _cached = _pb_obj
+            _context.add(key, _cached)
+            return _pb_obj
+
+        _pb_obj = self.pb_model() if into is None else into
+        _pb_obj.CopyFrom(_cached)
+        return _pb_obj
+
+    def _to_pb(self, expand_level, into=None):
+        if into is None:
+            _pb_obj = self.pb_model()
+        else:
+            _pb_obj = into
+            _pb_obj.SetInParent()
+
+        compiled = codegen.get_compiled(type(self)) if not metrics.measure_fields else None
+        if compiled is not None:
+            try:
+                return compiled[0](self, _pb_obj, expand_level)
+            except Exception:
+                LOGGER.warning(
+                    "Generated to_pb failed for %s, using the generic path from now on",
+                    self._meta.model, exc_info=True
+                )
+                codegen.disable(type(self))
+                _pb_obj.Clear()
+                _pb_obj.SetInParent()
+
         _dj_field_map = {f.name: f for f in self._meta.get_fields()}
 
         excs = []
         for _f in _pb_obj.DESCRIPTOR.fields:
             try:
-                self._field_to_pb(
-                    _f, _pb_obj=_pb_obj, _dj_field_map=_dj_field_map,
-                    expand_level=expand_level
-                )
+                if metrics.measure_fields:
+                    with metrics.measure(type(self), metrics.TO_PB, _f.name, message=_pb_obj):
+                        self._field_to_pb(_f, _pb_obj=_pb_obj, _dj_field_map=_dj_field_map, expand_level=expand_level)
+                else:
+                    self._field_to_pb(
+                        _f, _pb_obj=_pb_obj, _dj_field_map=_dj_field_map,
+                        expand_level=expand_level
+                    )
             except Exception as exc:
                 excs.append(exc)
 
@@ -288,9 +592,26 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
         if excs_str:
             raise Exception("multiple exceptions found:\n{}".format(excs_str))
 
-        LOGGER.info("Coverted Protobuf object: {}".format(_pb_obj))
+        LOGGER.info("Coverted Protobuf object: %s", _pb_obj)
         return _pb_obj
 
+    def to_pb_dict(self, expand_level=None):
+        """Convert django model to protobuf JSON mapping
+
+        Same result as ``json_format.MessageToDict(self.to_pb(expand_level))``
+        without building the protobuf message.
+
+        :returns: dict
+        """
+        return json_mapping.model_to_dict(self, expand_level=expand_level)
+
+    def to_pb_json(self, expand_level=None, indent=2, sort_keys=False):
+        """Same result as ``json_format.MessageToJson(self.to_pb(expand_level))``
+
+        :returns: str
+        """
+        return json.dumps(self.to_pb_dict(expand_level=expand_level), indent=indent, sort_keys=sort_keys)
+
     def _relation_to_protobuf(
             self, pb_obj, pb_field, dj_field_type, dj_field_value, expand_level
     ):
@@ -308,10 +629,38 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
             self._m2m_to_protobuf(
                 pb_obj, pb_field, dj_field_value, expand_level=expand_level
             )
+        elif self._is_reference_field(dj_field_type, pb_field):
+            self._reference_to_protobuf(
+                pb_obj, pb_field, dj_field_type, dj_field_value, expand_level=expand_level
+            )
         else:
-            getattr(pb_obj, pb_field.name).CopyFrom(dj_field_value.to_pb(
-                expand_level=expand_level
-            ))
+            dj_field_value.to_pb(expand_level=expand_level, into=getattr(pb_obj, pb_field.name))
+
+    def _is_reference_field(self, dj_field_type, pb_field):
+        """Whether a ForeignKey points at a model with ``pb_reference_cache``"""
+        return (
+            dj_field_type.is_relation and dj_field_type.concrete
+            and (dj_field_type.many_to_one or dj_field_type.one_to_one)
+            and cache.get_reference_cache(dj_field_type.related_model) is not None
+            and dj_field_type.target_field.primary_key
+            and self._get_serializers(type(dj_field_type), pb_field) == self._pb_default_serializers
+        )
+
+    def _reference_to_protobuf(self, pb_obj, pb_field, dj_field_type, fk_value, expand_level):
+        """Merge the cached message of a ForeignKey target, fetch and cache it on a miss
+
+        :param fk_value: value of the foreign key column
+        """
+        reference_cache = cache.get_reference_cache(dj_field_type.related_model)
+        cached = reference_cache.get(fk_value, expand_level=expand_level)
+        if cached is None:
+            instance = getattr(self, dj_field_type.name)
+            data = instance.to_pb(expand_level=expand_level).SerializeToString()
+            reference_cache.set(fk_value, instance, data, expand_level=expand_level)
+        else:
+            instance, data = cached
+            references.cache_related(self, dj_field_type, instance)
+        getattr(pb_obj, pb_field.name).MergeFromString(data)
 
     def _m2m_to_protobuf(self, pb_obj, pb_field, dj_m2m_field, expand_level):
         """
@@ -340,9 +689,9 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
         :returns: None
 
         """
-        getattr(pb_obj, pb_field.name).extend(
-            [_m2m.to_pb(expand_level=expand_level) for _m2m in dj_m2m_field.all()]
-        )
+        repeated = getattr(pb_obj, pb_field.name)
+        for _m2m in dj_m2m_field.all():
+            _m2m.to_pb(expand_level=expand_level, into=repeated.add())
 
     def _get_serializers(self, dj_field_type, pb_field=None):
         """Getting the correct serializers for a field type
@@ -353,7 +702,7 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
         if issubclass(dj_field_type, fields.ProtoBufFieldMixin):
             funcs = dj_field_type.to_pb, dj_field_type.from_pb
         else:
-            defaults = self.default_serializers
+            defaults = self._pb_default_serializers
             funcs = self.pb_2_dj_field_serializers.get(dj_field_type, None)
             if not funcs:
                 if pb_field:
@@ -385,31 +734,143 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
         s_funcs = self._get_serializers(dj_field_type, pb_field)
         s_funcs[0](pb_obj, pb_field, dj_field_value, expand_level=expand_level)
 
-    def from_pb(self, _pb_obj):
+    def from_pb(self, _pb_obj, lazy=False):
         """Convert given protobuf obj to mixin Django model
 
+        :param lazy: keep a reference to the message and convert plain value
+            fields on first attribute access, ``save()`` or ``full_clean()``;
+            the primary key and relations are converted right away
         :returns: Django model instance
         """
+        if not metrics.enabled:
+            return self._from_pb(_pb_obj, lazy)
+        with metrics.measure(type(self), metrics.FROM_PB) as measurement:
+            measurement.result = _pb_obj
+            return self._from_pb(_pb_obj, lazy)
+
+    def _from_pb(self, _pb_obj, lazy):
+        compiled = codegen.get_compiled(type(self)) if not (lazy or metrics.measure_fields) else None
+        if compiled is not None:
+            try:
+                return compiled[1](self, _pb_obj)
+            except Exception:
+                LOGGER.warning(
+                    "Generated from_pb failed for %s, using the generic path from now on",
+                    self._meta.model, exc_info=True
+                )
+                codegen.disable(type(self))
+
         _dj_field_map = {f.name: f for f in self._meta.get_fields()}
         LOGGER.debug("ListFields() return fields which contains value only")
         for _f, _v in _pb_obj.ListFields():
-            _dj_f_name = self.pb_2_dj_field_map.get(_f.name, _f.name)
-            _dj_f_type = _dj_field_map[_dj_f_name]
+            if lazy:
+                _dj_f_type = _dj_field_map[self.pb_2_dj_field_map.get(_f.name, _f.name)]
+                if self._is_lazy_field(_dj_f_type):
+                    # DeferredAttribute asks refresh_from_db() for the missing value, see _pb_materialize()
+                    self.__dict__.pop(_dj_f_type.attname, None)
+                    self.__dict__.setdefault('_pb_pending', {})[_dj_f_type.attname] = (_f, _v, _dj_field_map)
+                    continue
+            if metrics.measure_fields:
+                with metrics.measure(type(self), metrics.FROM_PB, _f.name):
+                    self._field_from_pb(_f, _v, _dj_field_map)
+            else:
+                self._field_from_pb(_f, _v, _dj_field_map)
+        LOGGER.info("Coveretd Django model instance: %s", self)
+        return self
+
+    def _is_lazy_field(self, dj_field):
+        """Concrete value fields whose attribute falls back to ``refresh_from_db()`` when unset"""
+        descriptor = getattr(type(self), getattr(dj_field, 'attname', ''), None)
+        return (
+            dj_field.concrete and not dj_field.is_relation and not dj_field.primary_key
+            and isinstance(descriptor, (DeferredAttribute, fields.LazyJSONDescriptor))
+        )
 
-            field_serializers = self._get_serializers(type(_dj_f_type), _f)
-            if field_serializers and field_serializers != self.default_serializers:
-                self._protobuf_to_value(_dj_f_name, type(_dj_f_type), _f, _v)
+    def _pb_materialize(self, attnames=None):
+        """Convert pending fields of a lazy ``from_pb()``, all of them by default
 
-            if _f.message_type is not None:
-                dj_field = _dj_field_map[_dj_f_name]
-                if dj_field.is_relation and not issubclass(
-                        type(dj_field), fields.ProtoBufFieldMixin
-                ):
-                    self._protobuf_to_relation(_dj_f_name, dj_field, _f, _v)
-                    continue
+        Fields assigned since the lazy ``from_pb()`` keep their value.
+
+        :returns: names of the converted fields
+        """
+        pending = self.__dict__.get('_pb_pending')
+        if not pending:
+            return []
+        converted = []
+        for attname in list(pending if attnames is None else attnames):
+            if attname not in pending:
+                continue
+            _f, _v, _dj_field_map = pending.pop(attname)
+            if attname not in self.__dict__:
+                self._field_from_pb(_f, _v, _dj_field_map)
+            converted.append(attname)
+        return converted
+
+    def refresh_from_db(self, using=None, fields=None):
+        if fields:
+            converted = self._pb_materialize(fields)
+            fields = [f for f in fields if f not in converted]
+            if not fields:
+                return
+        super(ProtoBufMixin, self).refresh_from_db(using=using, fields=fields)
+
+    def full_clean(self, *args, **kwargs):
+        self._pb_materialize()
+        super(ProtoBufMixin, self).full_clean(*args, **kwargs)
+
+    @classmethod
+    def check(cls, **kwargs):
+        errors = super(ProtoBufMixin, cls).check(**kwargs)
+        errors.extend(compat.check_model(cls))
+        errors.extend(outbox.check_model(cls))
+        return errors
+
+    @classmethod
+    def pb_view(cls, pb_obj):
+        """Read-only view of a message with the attribute names of this model
+
+        Fields are converted lazily on access, no model instance is built,
+        see ``pb_model.readonly``.
+
+        :returns: MessageView
+        """
+        return readonly.pb_view(cls, pb_obj)
+
+    @classmethod
+    def from_pb_batch(cls, pb_objs, lazy=False):
+        """``from_pb()`` of a batch of messages, loading the ``pb_2_dj_reference_fields``
+        targets of all of them with one query per related model
+
+        :raises: ``DoesNotExist`` of the related model for missing targets
+        :returns: list of Django model instances
+        """
+        return references.from_pb_batch(cls, pb_objs, lazy=lazy)
+
+    def from_pb_dict(self, pb_dict):
+        """Update model from protobuf JSON mapping
+
+        Same result as ``self.from_pb(json_format.ParseDict(pb_dict, self.pb_model()))``.
+
+        :returns: Django model instance
+        """
+        return json_mapping.dict_to_model(self, pb_dict)
+
+    def _field_from_pb(self, _f, _v, _dj_field_map):
+        _dj_f_name = self.pb_2_dj_field_map.get(_f.name, _f.name)
+        _dj_f_type = _dj_field_map[_dj_f_name]
+
+        field_serializers = self._get_serializers(type(_dj_f_type), _f)
+        if field_serializers and field_serializers != self._pb_default_serializers:
             self._protobuf_to_value(_dj_f_name, type(_dj_f_type), _f, _v)
-        LOGGER.info("Coveretd Django model instance: {}".format(self))
-        return self
+
+        if _f.message_type is not None:
+            dj_field = _dj_field_map[_dj_f_name]
+            if dj_field.is_relation and not issubclass(
+                    type(dj_field), fields.ProtoBufFieldMixin
+            ):
+                self._protobuf_to_relation(_dj_f_name, dj_field, _f, _v)
+                return
+        self._protobuf_to_value(_dj_f_name, type(_dj_f_type), _f, _v)
 
     def _protobuf_to_relation(self, dj_field_name, dj_field, pb_field,
                               pb_value):
@@ -426,6 +887,12 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
             self._protobuf_to_m2m(dj_field_name, dj_field, pb_value)
             return
 
+        if dj_field_name in self.pb_2_dj_reference_fields:
+            value = references.reference_id(dj_field, pb_value)
+            if value is not None:
+                references.set_reference(self, dj_field, value)
+                return
+
         if hasattr(dj_field, 'related_model'):
             # django > 1.8 compatible
             setattr(self, dj_field_name, dj_field.related_model().from_pb(pb_value))
@@ -435,8 +902,10 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
     def _protobuf_to_m2m(self, dj_field_name, dj_field, pb_repeated_set):
         """
         This is hook function to handle repeated list to m2m field while converting
-        from protobuf to django. By default, no operation is performed, which means
-        you may query current relation if your coverted django model instance has a valid PK.
+        from protobuf to django. Fields listed in ``pb_2_dj_reconcile_fields`` are kept
+        and reconciled in bulk on ``save()``, see ``pb_model.reconcile``. Otherwise, no
+        operation is performed, which means you may query current relation if your
+        coverted django model instance has a valid PK.
 
         If you want to modify your database while converting on-the-fly, overwrite
         logics such as:
@@ -462,7 +931,8 @@ class ProtoBufMixin(six.with_metaclass(Meta, models.Model)):
         :returns: None
 
         """
-        return
+        if dj_field_name in self.pb_2_dj_reconcile_fields:
+            self.__dict__.setdefault('_pb_reconcile_pending', {})[dj_field_name] = list(pb_repeated_set)
 
     def _protobuf_to_value(self, dj_field_name, dj_field_type, pb_field,
                            pb_value):
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Transactional outbox of ``ProtoBufMixin`` models with ``pb_outbox = True``.
+
+Add ``'pb_model.outbox'`` to ``INSTALLED_APPS`` to install the ``OutboxMessage``
+table. Every ``save()``, ``delete()`` and queryset ``bulk_create()``/``update()``/``delete()``
+inserts an ``OutboxMessage`` row in the same transaction as the write. Saved objects
+are serialized right away, rows touched by ``update()`` are fetched and serialized
+in batches, deletes are written as tombstones without payload.
+
+``drain(publish)`` hands the rows to a publisher in large ordered batches and
+deletes them afterwards.
+
+Writes going through a manager whose queryset is not a ``ProtoBufQuerySet``
+and deletes cascading from other models are not captured.
+"""
+
+from __future__ import absolute_import
+import logging
+
+import six
+from django.core import checks
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+
+
+default_app_config = 'pb_model.outbox.apps.OutboxConfig'
+
+LOGGER = logging.getLogger(__name__)
+
+SAVE = 'save'
+DELETE = 'delete'
+
+BATCH_SIZE = 500
+
+
+def _outbox_model():
+    from .models import OutboxMessage
+    return OutboxMessage
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _db_for_outbox(using):
+    return using or router.db_for_write(_outbox_model()) or DEFAULT_DB_ALIAS
+
+
+def check_model(model):
+    """System check messages of a model with ``pb_outbox``"""
+    from django.apps import apps
+    from ..models import ProtoBufQuerySet
+
+    if not model.pb_outbox:
+        return []
+    messages = []
+    if not apps.is_installed('pb_model.outbox'):
+        messages.append(checks.Error(
+            "pb_outbox requires the OutboxMessage table.", hint="Add 'pb_model.outbox' to INSTALLED_APPS.",
+            obj=model, id='pb_model.E002',
+        ))
+    for manager in model._meta.managers:
+        if not issubclass(manager._queryset_class, ProtoBufQuerySet):
+            messages.append(checks.Error(
+                "Manager '{}' bypasses the outbox, its queryset isn't a ProtoBufQuerySet.".format(manager.name),
+                hint="Build the manager with ProtoBufQuerySet.as_manager() or Manager.from_queryset().",
+                obj=model, id='pb_model.E003',
+            ))
+    return messages
+
+
+def record_saved(model, objs, using=None):
+    """Insert outbox rows with the serialized messages of saved objects
+
+    Called inside the transaction of the write, objects given by primary key
+    are fetched from it in batches.
+
+    :param model: ProtoBufMixin model class
+    :param objs: saved instances, or their primary keys
+    """
+    using = _db_for_outbox(using)
+    outbox_model = _outbox_model()
+    instances, pks = [], []
+    for obj in objs:
+        if isinstance(obj, model):
+            instances.append(obj)
+        else:
+            pks.append(obj)
+    for chunk in _chunks(pks, BATCH_SIZE):
+        instances.extend(model._base_manager.using(using).in_bulk(chunk).values())
+
+    outbox_model._default_manager.db_manager(using).bulk_create([
+        outbox_model(
+            model_label=model._meta.label, object_pk=six.text_type(instance.pk), operation=SAVE,
+            payload=instance.to_pb().SerializeToString(),
+        )
+        for instance in instances
+    ], batch_size=BATCH_SIZE)
+
+
+def record_deleted(model, pks, using=None):
+    """Insert tombstone rows for deleted objects
+
+    :param model: ProtoBufMixin model class
+    :param pks: primary keys of the deleted objects
+    """
+    outbox_model = _outbox_model()
+    outbox_model._default_manager.db_manager(_db_for_outbox(using)).bulk_create([
+        outbox_model(model_label=model._meta.label, object_pk=six.text_type(pk), operation=DELETE)
+        for pk in pks
+    ], batch_size=BATCH_SIZE)
+
+
+def drain(publish, batch_size=1000, using=None):
+    """Publish and delete outbox rows in insertion order
+
+    ``publish`` is called with lists of ``OutboxMessage`` of at most ``batch_size``
+    rows, a batch is deleted once ``publish`` returned, in the same transaction.
+
+    Rows are locked with ``SELECT ... FOR UPDATE`` (``SKIP LOCKED`` where supported)
+    so that concurrent drains publish disjoint batches. Backends without row locks,
+    e.g. SQLite, ignore it: run a single drain at a time there.
+
+    :param publish: callable taking a list of ``OutboxMessage``
+    :returns: number of published rows
+    """
+    using = _db_for_outbox(using)
+    outbox_model = _outbox_model()
+    features = connections[using].features
+    published = 0
+    while True:
+        with transaction.atomic(using=using):
+            queryset = outbox_model._default_manager.using(using).order_by('id')
+            if features.has_select_for_update_skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            elif features.has_select_for_update:
+                queryset = queryset.select_for_update()
+            rows = list(queryset[:batch_size])
+            if not rows:
+                return published
+            publish(rows)
+            outbox_model._default_manager.using(using).filter(id__in=[row.id for row in rows]).delete()
+            published += len(rows)
+            LOGGER.debug("Published %d outbox rows", len(rows))
@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from django.apps import AppConfig  # pragma: no cover
+
+
+class OutboxConfig(AppConfig):  # pragma: no cover
+    name = 'pb_model.outbox'  # pragma: no cover
+    label = 'pb_model_outbox'  # pragma: no cover
+    verbose_name = 'ProtoBuf outbox'  # pragma: no cover
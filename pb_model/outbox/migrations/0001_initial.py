@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model_label', models.CharField(max_length=255)),
+                ('object_pk', models.CharField(max_length=255)),
+                ('operation', models.CharField(choices=[('save', 'save'), ('delete', 'delete')], max_length=8)),
+                ('payload', models.BinaryField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='outboxmessage',
+            index_together=set([('model_label', 'object_pk')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from django.apps import apps
+from django.db import models
+
+from . import DELETE, SAVE
+
+
+class OutboxMessage(models.Model):
+    """Serialized change of a ``ProtoBufMixin`` model with ``pb_outbox``
+
+    ``payload`` is empty for tombstones.
+    """
+    OPERATIONS = [(SAVE, 'save'), (DELETE, 'delete')]
+
+    id = models.BigAutoField(primary_key=True)
+    model_label = models.CharField(max_length=255)
+    object_pk = models.CharField(max_length=255)
+    operation = models.CharField(max_length=8, choices=OPERATIONS)
+    payload = models.BinaryField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = [('model_label', 'object_pk')]
+
+    def __str__(self):
+        return '{} {} {}'.format(self.operation, self.model_label, self.object_pk)
+
+    def to_pb(self):
+        """Message of the row, None for tombstones
+
+        :returns: ProtoBuf instance
+        """
+        if self.payload is None:
+            return None
+        return apps.get_model(self.model_label).pb_model.FromString(bytes(self.payload))
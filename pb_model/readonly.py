@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Read-only views of protobuf messages with the attribute names of a model.
+
+``Model.pb_view(message)`` wraps a message without building a model instance:
+no ``Model.__init__``, signals or m2m loads. Attributes are converted on first
+access with the same serializers as ``from_pb()`` and kept in ``__slots__``, so
+``view.created_at`` is a datetime and ``view.fk_field`` a view of the related
+model. Fields missing from the message have the default of the Django field,
+like an instance returned by ``Model().from_pb(message)``.
+
+Only the fields present in both the message and the model are exposed.
+"""
+
+from __future__ import absolute_import
+import threading
+
+import six
+from google.protobuf.descriptor import FieldDescriptor as FD
+
+from . import fields
+
+
+_VIEW_CLASSES = {}
+_VIEW_CLASSES_LOCK = threading.Lock()
+
+
+class MessageView(object):
+    """Base of the generated view classes, see ``pb_view()``"""
+    __slots__ = ('_pb_obj',)
+
+    _pb_view_model = None
+
+    def __init__(self, pb_obj):
+        object.__setattr__(self, '_pb_obj', pb_obj)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{} is read-only".format(type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError("{} is read-only".format(type(self).__name__))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._pb_obj == other._pb_obj
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '<{}: {}>'.format(type(self).__name__, self.pk)
+
+    @property
+    def pk(self):
+        return getattr(self, self._pb_view_model._meta.pk.name, None)
+
+    def to_pb(self):
+        """The wrapped message, e.g. to forward it unchanged"""
+        return self._pb_obj
+
+    def to_model(self):
+        """Model instance of the message, same as ``Model().from_pb(message)``"""
+        return self._pb_view_model().from_pb(self._pb_obj)
+
+
+class _LazyAttribute(object):
+    """Converts the message field on first access and keeps the result in a slot"""
+    __slots__ = ('slot', 'convert')
+
+    def __init__(self, slot, convert):
+        self.slot = slot
+        self.convert = convert
+
+    def __get__(self, view, cls=None):
+        if view is None:
+            return self
+        try:
+            return self.slot.__get__(view, cls)
+        except AttributeError:
+            value = self.convert(view._pb_obj)
+            self.slot.__set__(view, value)
+            return value
+
+    def __set__(self, view, value):
+        raise AttributeError("{} is read-only".format(type(view).__name__))
+
+
+class _Value(object):
+    """Stands in for the model instance of ``from_pb`` serializers"""
+    __slots__ = ('value',)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, 'value', value)
+
+
+def _is_present(pb_field):
+    """Whether ``ListFields()`` of a message would contain the field"""
+    name = pb_field.name
+    if pb_field.label == FD.LABEL_REPEATED:
+        return lambda pb_obj: len(getattr(pb_obj, name)) > 0
+    if pb_field.message_type is not None or pb_field.containing_oneof is not None or pb_field.file.syntax == 'proto2':
+        return lambda pb_obj: pb_obj.HasField(name)
+    default = pb_field.default_value
+    return lambda pb_obj: getattr(pb_obj, name) != default
+
+
+def _relation_converter(pb_field, related_model):
+    name = pb_field.name
+    if pb_field.label != FD.LABEL_REPEATED:
+        return lambda pb_obj: pb_view(related_model, getattr(pb_obj, name)) if pb_obj.HasField(name) else None
+    if pb_field.message_type.GetOptions().map_entry:
+        return lambda pb_obj: {key: pb_view(related_model, value) for key, value in getattr(pb_obj, name).items()}
+    return lambda pb_obj: tuple(pb_view(related_model, value) for value in getattr(pb_obj, name))
+
+
+def _value_converter(model, pb_field, dj_field):
+    name, dj_field_type = pb_field.name, type(dj_field)
+    funcs = six.get_unbound_function(model._get_serializers)(model, dj_field_type, pb_field)
+    from_pb = funcs[1]
+    is_present = _is_present(pb_field)
+
+    def convert(pb_obj):
+        if not is_present(pb_obj):
+            return dj_field.get_default()
+        value = _Value()
+        from_pb(value, dj_field.name, pb_field, getattr(pb_obj, name), dj_field_type=dj_field_type)
+        return value.value
+    return convert
+
+
+def _is_message_relation(dj_field):
+    if isinstance(dj_field, (fields.RepeatedMessageField, fields.MessageMapField)):
+        return True
+    return dj_field.is_relation and not isinstance(dj_field, fields.ProtoBufFieldMixin)
+
+
+def _create_view_class(model):
+    dj_field_map = {f.name: f for f in model._meta.get_fields()}
+    converters = {}
+    foreign_keys = {}
+    for pb_field in model.pb_model.DESCRIPTOR.fields:
+        dj_field = dj_field_map.get(model.pb_2_dj_field_map.get(pb_field.name, pb_field.name))
+        if dj_field is None:
+            continue
+        if _is_message_relation(dj_field):
+            if pb_field.message_type is None:
+                continue
+            converters[dj_field.name] = _relation_converter(pb_field, dj_field.related_model)
+            if dj_field.concrete and (dj_field.many_to_one or dj_field.one_to_one):
+                foreign_keys[dj_field.attname] = dj_field.name
+        else:
+            converters[dj_field.name] = _value_converter(model, pb_field, dj_field)
+
+    slots = {name: '_v_{}'.format(name) for name in converters}
+    cls = type(str('{}View'.format(model.__name__)), (MessageView,), {
+        '__slots__': tuple(slots.values()),
+        '__module__': __name__,
+        '_pb_view_model': model,
+    })
+    for name, convert in converters.items():
+        setattr(cls, name, _LazyAttribute(cls.__dict__[slots[name]], convert))
+    for attname, name in foreign_keys.items():
+        if attname not in converters:
+            setattr(cls, attname, property(lambda view, _name=name: getattr(getattr(view, _name), 'pk', None)))
+    return cls
+
+
+def view_class(model):
+    """View class of a ProtoBufMixin model, created once per model"""
+    try:
+        return _VIEW_CLASSES[model]
+    except KeyError:
+        pass
+    with _VIEW_CLASSES_LOCK:
+        if model not in _VIEW_CLASSES:
+            _VIEW_CLASSES[model] = _create_view_class(model)
+    return _VIEW_CLASSES[model]
+
+
+def pb_view(model, pb_obj):
+    """Read-only view of a message with the attribute names of ``model``
+
+    :param model: ProtoBufMixin model class
+    :param pb_obj: message of ``model.pb_model``
+    :returns: MessageView
+    """
+    return view_class(model)(pb_obj)
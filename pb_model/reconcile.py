@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Reconciliation of reverse ForeignKey and many-to-many collections with repeated messages.
+
+By default ``from_pb`` ignores repeated messages mapped to a reverse
+ForeignKey (e.g. ``Comfy.items``) or a ``ManyToManyField``. Fields listed in
+``pb_2_dj_reconcile_fields`` are kept by ``from_pb`` and applied when the
+instance is saved: the incoming messages are matched against the existing
+children by primary key or by a natural key, then
+
+* reverse ForeignKey: new children are inserted with one ``bulk_create``,
+  changed ones updated with one ``UPDATE ... CASE`` statement and the missing
+  ones deleted with one ``DELETE``
+* many-to-many: related rows are inserted and updated the same way, missing
+  links are added and stale ones removed with one statement each on the
+  through table; related rows are never deleted
+
+Options per field, ``True`` for the defaults:
+
+* ``key``: list of field names of the related model identifying a child,
+  defaults to the primary key; children whose key matches no existing row
+  are inserted
+* ``delete``: delete missing children (unlink for many-to-many), ``True`` by
+  default
+
+The children's own relations are not followed, and ``m2m_changed`` is not sent.
+"""
+
+from __future__ import absolute_import
+import collections
+import functools
+import logging
+import operator
+
+from django.db import connections, models
+
+from . import graph
+
+
+LOGGER = logging.getLogger(__name__)
+
+Result = collections.namedtuple('Result', ['inserted', 'updated', 'deleted'])
+
+
+def field_options(model, dj_field_name):
+    """Normalized options of a field listed in ``pb_2_dj_reconcile_fields``"""
+    options = model.pb_2_dj_reconcile_fields[dj_field_name]
+    options = {} if options is True else dict(options)
+    related_model = model._meta.get_field(dj_field_name).related_model
+    key = options.get('key')
+    options['key'] = [related_model._meta.get_field(name) for name in key] if key else [related_model._meta.pk]
+    options.setdefault('delete', True)
+    return options
+
+
+def _key(obj, key_fields):
+    return tuple(f.to_python(getattr(obj, f.attname)) for f in key_fields)
+
+
+def _value_fields(model):
+    return [f for f in model._meta.concrete_fields if not f.primary_key]
+
+
+def _changed(old, new, value_fields):
+    return any(getattr(old, f.attname) != getattr(new, f.attname) for f in value_fields)
+
+
+def _match(children, existing, key_fields, value_fields):
+    """Split children in (inserts, updates) and give matched ones the primary key of their row
+
+    :param existing: {key: existing instance}
+    :returns: (inserts, updates, matched keys)
+    """
+    inserts, updates, matched = [], [], set()
+    is_pk_key = [f.primary_key for f in key_fields] == [True]
+    for child in children:
+        key = _key(child, key_fields)
+        old = existing.get(key)
+        if old is None:
+            if is_pk_key:
+                child.pk = None  # not a row of this collection, inserted as a new one
+            inserts.append(child)
+            continue
+        matched.add(key)
+        child.pk = old.pk
+        child._state.adding, child._state.db = False, old._state.db
+        if _changed(old, child, value_fields):
+            updates.append(child)
+    return inserts, updates, matched
+
+
+def _key_filter(key_fields, keys):
+    if len(key_fields) == 1:
+        return models.Q(**{'{}__in'.format(key_fields[0].attname): [key[0] for key in keys]})
+    return functools.reduce(operator.or_, [
+        models.Q(**{f.attname: value for f, value in zip(key_fields, key)}) for key in keys
+    ])
+
+
+def _reconcile_reverse_fk(instance, dj_field, children, options, using):
+    related_model, fk = dj_field.related_model, dj_field.field
+    key_fields, value_fields = options['key'], _value_fields(related_model)
+    manager = related_model._default_manager.db_manager(using)
+
+    for child in children:
+        setattr(child, fk.attname, instance.pk)
+    existing = {
+        _key(obj, key_fields): obj for obj in related_model._base_manager.using(using).filter(**{fk.attname: instance.pk})
+    }
+    inserts, updates, matched = _match(children, existing, key_fields, value_fields)
+
+    deletes = [obj.pk for key, obj in existing.items() if key not in matched] if options['delete'] else []
+    if deletes:
+        manager.filter(pk__in=deletes).delete()
+    if inserts:
+        manager.bulk_create(inserts)
+    graph.bulk_update(related_model, updates, using=using)
+    return Result(len(inserts), len(updates), len(deletes))
+
+
+def _insert_related(related_model, objs, key_fields, using):
+    """Insert related rows of a many-to-many collection, their primary keys are needed for the links"""
+    manager = related_model._default_manager.db_manager(using)
+    if connections[using].features.can_return_ids_from_bulk_insert or all(obj.pk is not None for obj in objs):
+        manager.bulk_create(objs)
+    elif not any(f.primary_key for f in key_fields):
+        manager.bulk_create(objs)
+        pks = dict(
+            (_key(obj, key_fields), obj.pk)
+            for obj in related_model._base_manager.using(using).filter(_key_filter(key_fields, [
+                _key(obj, key_fields) for obj in objs
+            ]))
+        )
+        for obj in objs:
+            obj.pk = pks[_key(obj, key_fields)]
+    else:
+        LOGGER.debug("Primary keys of bulk inserted rows are unknown, inserting {} one by one".format(
+            related_model._meta.label
+        ))
+        for obj in objs:
+            obj.save_base(using=using, force_insert=True)
+
+
+def _reconcile_m2m(instance, dj_field, children, options, using):
+    if dj_field.auto_created:  # reverse side of a ManyToManyField
+        m2m_field = dj_field.field
+        source_name, target_name = m2m_field.m2m_reverse_field_name(), m2m_field.m2m_field_name()
+    else:
+        m2m_field = dj_field
+        source_name, target_name = m2m_field.m2m_field_name(), m2m_field.m2m_reverse_field_name()
+    through = m2m_field.remote_field.through
+    source_attname = through._meta.get_field(source_name).attname
+    target_attname = through._meta.get_field(target_name).attname
+
+    related_model = dj_field.related_model
+    key_fields, value_fields = options['key'], _value_fields(related_model)
+    keys = [_key(child, key_fields) for child in children]
+    existing = {}
+    if keys:
+        existing = {
+            _key(obj, key_fields): obj
+            for obj in related_model._base_manager.using(using).filter(_key_filter(key_fields, keys))
+        }
+    inserts, updates, _ = _match(children, existing, key_fields, value_fields)
+    if inserts:
+        _insert_related(related_model, inserts, key_fields, using)
+    graph.bulk_update(related_model, updates, using=using)
+
+    through_manager = through._default_manager.db_manager(using)
+    linked = set(through_manager.filter(**{source_attname: instance.pk}).values_list(target_attname, flat=True))
+    wanted = []
+    for child in children:
+        if child.pk not in wanted:
+            wanted.append(child.pk)
+    through_manager.bulk_create([
+        through(**{source_attname: instance.pk, target_attname: pk}) for pk in wanted if pk not in linked
+    ])
+    unlinked = [pk for pk in linked if pk not in wanted] if options['delete'] else []
+    if unlinked:
+        through_manager.filter(**{source_attname: instance.pk, '{}__in'.format(target_attname): unlinked}).delete()
+    return Result(len(inserts), len(updates), len(unlinked))
+
+
+def reconcile(instance, dj_field_name, pb_messages, using=None):
+    """Make a reverse ForeignKey or many-to-many collection of a saved instance match messages
+
+    :param instance: saved ProtoBufMixin instance
+    :param dj_field_name: name of a field listed in ``pb_2_dj_reconcile_fields``
+    :param pb_messages: messages of the related model
+    :returns: Result(inserted, updated, deleted), deleted counts unlinked rows for many-to-many
+    """
+    using = using or instance._state.db
+    dj_field = instance._meta.get_field(dj_field_name)
+    options = field_options(type(instance), dj_field_name)
+    children = [dj_field.related_model().from_pb(pb_message) for pb_message in pb_messages]
+    if dj_field.one_to_many:
+        result = _reconcile_reverse_fk(instance, dj_field, children, options, using)
+    else:
+        result = _reconcile_m2m(instance, dj_field, children, options, using)
+    LOGGER.debug("Reconciled {}.{}: {}".format(instance._meta.label, dj_field_name, result))
+    return result
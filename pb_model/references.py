@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+ForeignKeys converted from the id of a nested message.
+
+For the ForeignKey fields listed in ``pb_2_dj_reference_fields``, ``from_pb``
+sets ``<field>_id`` from the primary key carried by the nested message
+instead of building an unsaved related instance from it. Nested messages
+without an id are still converted to new instances.
+
+``Model.from_pb_batch(messages)`` converts a batch of messages and resolves
+the referenced ids of all of them at once, with one ``in_bulk`` query per
+related model: missing rows raise the ``DoesNotExist`` of the related model,
+found ones are attached to the instances, so ``obj.fk_field`` needs no query.
+"""
+
+from __future__ import absolute_import
+import collections
+import logging
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def reference_id(dj_field, pb_value):
+    """Value of the target field carried by a nested message, None when unset
+
+    :param dj_field: ForeignKey or OneToOneField
+    :param pb_value: nested message of the related model
+    """
+    target_field = dj_field.target_field
+    dj_to_pb = {dj: pb for pb, dj in getattr(dj_field.related_model, 'pb_2_dj_field_map', {}).items()}
+    pb_field = pb_value.DESCRIPTOR.fields_by_name.get(dj_to_pb.get(target_field.name, target_field.name))
+    if pb_field is None:
+        return None
+    value = getattr(pb_value, pb_field.name)
+    if value == pb_field.default_value:
+        return None
+    return target_field.to_python(value)
+
+
+def _is_cached(instance, dj_field):
+    if hasattr(dj_field, 'is_cached'):
+        return dj_field.is_cached(instance)
+    return hasattr(instance, dj_field.get_cache_name())
+
+
+def cache_related(instance, dj_field, related):
+    """Cache a related instance on a forward relation which has none cached yet, without querying"""
+    if _is_cached(instance, dj_field):
+        return
+    if hasattr(dj_field, 'set_cached_value'):
+        dj_field.set_cached_value(instance, related)
+    else:
+        setattr(instance, dj_field.get_cache_name(), related)
+
+
+def set_reference(instance, dj_field, value):
+    """Assign a foreign key value, dropping a previously assigned related instance"""
+    if _is_cached(instance, dj_field):
+        if hasattr(dj_field, 'delete_cached_value'):
+            dj_field.delete_cached_value(instance)
+        else:
+            delattr(instance, dj_field.get_cache_name())
+    setattr(instance, dj_field.attname, value)
+
+
+def _load(related_model, target_field, values):
+    manager = related_model._base_manager
+    if target_field.primary_key:
+        return manager.in_bulk(values)
+    return {
+        getattr(obj, target_field.attname): obj
+        for obj in manager.filter(**{'{}__in'.format(target_field.name): values})
+    }
+
+
+def resolve(instances):
+    """Verify and attach the rows referenced by ``pb_2_dj_reference_fields`` of instances
+
+    :param instances: instances of ProtoBufMixin models
+    :raises: ``DoesNotExist`` of the related model listing the missing values
+    """
+    pending = collections.OrderedDict()  # (related model, target field) in key, [(instance, field, value)] in value
+    for instance in instances:
+        for dj_field_name in instance.pb_2_dj_reference_fields:
+            dj_field = instance._meta.get_field(dj_field_name)
+            value = getattr(instance, dj_field.attname)
+            if value is not None and not _is_cached(instance, dj_field):
+                pending.setdefault((dj_field.related_model, dj_field.target_field), []).append(
+                    (instance, dj_field, value)
+                )
+
+    for (related_model, target_field), references in pending.items():
+        loaded = _load(related_model, target_field, list(set(value for _, _, value in references)))
+        missing = sorted(set(value for _, _, value in references if value not in loaded), key=str)
+        if missing:
+            raise related_model.DoesNotExist("{} with {} {} referenced by {} don't exist".format(
+                related_model._meta.label, target_field.name, ', '.join(map(str, missing)),
+                ', '.join(sorted(set('{}.{}'.format(i._meta.label, f.name) for i, f, _ in references))),
+            ))
+        for instance, dj_field, value in references:
+            setattr(instance, dj_field.name, loaded[value])
+        LOGGER.debug("Resolved {} references to {} with one query".format(len(references), related_model._meta.label))
+
+
+def from_pb_batch(model, pb_objs, lazy=False):
+    """``model().from_pb()`` of every message, with references resolved together
+
+    :returns: list of model instances
+    """
+    instances = [model().from_pb(pb_obj, lazy=lazy) for pb_obj in pb_objs]
+    resolve(instances)
+    return instances
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Length-delimited protobuf streams: every message is prefixed by its size as
+a base 128 varint, the framing of ``writeDelimitedTo``/``parseDelimitedFrom``.
+"""
+
+from __future__ import absolute_import
+
+import six
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamError(Exception):
+    pass
+
+
+def encode_varint(value):
+    """Varint bytes of a non-negative integer"""
+    out = bytearray()
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def delimited(data):
+    """Frame one serialized message"""
+    return encode_varint(len(data)) + data
+
+
+class _BufferedReader(object):
+    """Reads a file-like object in chunks of ``chunk_size`` bytes
+
+    Message sizes are decoded from the buffer instead of one ``read(1)`` per byte.
+    """
+
+    def __init__(self, fileobj, chunk_size=CHUNK_SIZE):
+        self._read = fileobj.read
+        self._chunk_size = chunk_size
+        self._buffer = b''
+        self._pos = 0
+
+    def read_varint(self):
+        """Next varint, None at the end of the stream"""
+        result, shift = 0, 0
+        while True:
+            if self._pos >= len(self._buffer):
+                self._buffer, self._pos = self._read(self._chunk_size), 0
+                if not self._buffer:
+                    if shift:
+                        raise StreamError("Truncated message size")
+                    return None
+            value = six.indexbytes(self._buffer, self._pos)
+            self._pos += 1
+            result |= (value & 0x7f) << shift
+            if not value & 0x80:
+                return result
+            shift += 7
+            if shift >= 64:
+                raise StreamError("Message size is too long")
+
+    def read(self, size):
+        """Next ``size`` bytes, fewer at the end of the stream"""
+        end = self._pos + size
+        if end <= len(self._buffer):
+            data, self._pos = self._buffer[self._pos:end], end
+            return data
+
+        parts, missing = [self._buffer[self._pos:]], end - len(self._buffer)
+        self._buffer, self._pos = b'', 0
+        while missing > 0:
+            chunk = self._read(max(missing, self._chunk_size))
+            if not chunk:
+                break
+            if len(chunk) > missing:
+                chunk, self._buffer = chunk[:missing], chunk[missing:]
+            parts.append(chunk)
+            missing -= len(chunk)
+        return b''.join(parts)
+
+
+def iter_delimited(stream, max_message_size=None, chunk_size=CHUNK_SIZE):
+    """Yield serialized messages of a length-delimited stream
+
+    :param stream: file-like object with ``read(size)``
+    :param max_message_size: reject larger messages without reading them
+    :param chunk_size: size of the reads from ``stream``
+    """
+    reader = _BufferedReader(stream, chunk_size=chunk_size)
+    while True:
+        size = reader.read_varint()
+        if size is None:
+            return
+        if max_message_size is not None and size > max_message_size:
+            raise StreamError("Message of {} bytes exceeds {} bytes".format(size, max_message_size))
+        data = reader.read(size) if size else b''
+        if len(data) != size:
+            raise StreamError("Truncated message, expected {} bytes, got {}".format(size, len(data)))
+        yield data
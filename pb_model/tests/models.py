@@ -7,6 +7,7 @@ from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from django.utils import timezone
 
+from pb_model import fields
 from pb_model.models import ProtoBufMixin
 
 from . import models_pb2
@@ -18,6 +19,42 @@ class Relation(ProtoBufMixin, models.Model):
     num = models.IntegerField(default=0)
 
 
+class PlainRelation(models.Model):
+    """Relation without ProtoBufMixin, baseline of the instance overhead test"""
+    num = models.IntegerField(default=0)
+
+
+class TrackedRelation(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Relation
+
+    num = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        index_together = [('updated_at', 'id')]
+
+
+class OutboxRelation(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Relation
+    pb_outbox = True
+
+    num = models.IntegerField(default=0)
+
+
+class CachedRelation(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Relation
+    pb_reference_cache = {'max_size': 2, 'ttl': 60}
+
+    num = models.IntegerField(default=0)
+
+
+class CachedRelationReferrer(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Main
+
+    integer_field = models.IntegerField(default=0)
+    fk_field = models.ForeignKey(CachedRelation, null=True, on_delete=models.CASCADE)
+
+
 class M2MRelation(ProtoBufMixin, models.Model):
     pb_model = models_pb2.M2MRelation
 
@@ -46,6 +83,14 @@ class Main(ProtoBufMixin, models.Model):
     m2m_field = models.ManyToManyField(M2MRelation)
 
 
+class ReferencingMain(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Main
+    pb_2_dj_reference_fields = ['fk_field']
+
+    string_field = models.CharField(max_length=32, default='')
+    fk_field = models.ForeignKey(Relation, null=True, related_name='referencing_mains', on_delete=models.CASCADE)
+
+
 class Embedded(ProtoBufMixin, models.Model):
     pb_model = models_pb2.Root.Embedded
     pb_2_dj_fields = '__all__'
@@ -65,10 +110,48 @@ class Root(ProtoBufMixin, models.Model):
     pb_model = models_pb2.Root
     pb_2_dj_fields = '__all__'
     pb_2_dj_field_map = {'uint32_field': 'uint32_field_renamed'}
+    # default columns of the unsigned types are narrower than protobuf
+    pb_compat_ignore = ['uint32_field', 'uint64_field']
 
     uuid_field = models.UUIDField(null=True)
 
 
+class CompactRoot(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Root
+    pb_storage_profile = 'compact'
+    pb_compat_ignore = ['uint64_field']  # checked against the BigIntegerField range
+    pb_2_dj_fields = [
+        'uint32_field', 'int32_field', 'uint64_field', 'int64_field', 'float_field', 'double_field',
+        'string_field', 'bytes_field', 'bool_field', 'enum_field',
+    ]
+
+
+class CompressedRoot(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Root
+    pb_auto_field_type_mapping = dict(ProtoBufMixin.pb_auto_field_type_mapping)
+    pb_auto_field_type_mapping.update(fields.COMPRESSED_FIELD_TYPES)
+    pb_2_dj_fields = [
+        'int32_field', 'string_field', 'bytes_field', 'repeated_string_field', 'map_string_to_string_field',
+    ]
+
+
+class OrderedRoot(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Root
+
+    repeated_message_field = fields.OrderedRepeatedMessageField(
+        Embedded, related_name='ordered_root_repeated_message_field'
+    )
+    map_string_to_message_field = fields.OrderedMessageMapField(
+        Embedded, related_name='ordered_root_map_string_to_message_field'
+    )
+
+
+class InlineRoot(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Root
+    pb_2_dj_fields = ['int32_field', 'message_field']
+    pb_2_dj_inline_fields = ['message_field']
+
+
 class Sub(ProtoBufMixin, models.Model):
     pb_model = models_pb2.Sub
 
@@ -112,15 +195,38 @@ class Item(ProtoBufMixin, models.Model):
     nr = models.IntegerField()
 
 
+class ReconciledComfy(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Comfy
+    pb_2_dj_reconcile_fields = {'items': True}
+
+    number = models.IntegerField(default=0)
+
+
+class ReconciledItem(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Item
+
+    comfy = models.ForeignKey(ReconciledComfy, related_name='items', on_delete=models.CASCADE)
+    nr = models.IntegerField()
+
+
+class ReconciledMain(ProtoBufMixin, models.Model):
+    pb_model = models_pb2.Main
+    pb_2_dj_reconcile_fields = {'m2m_field': {'key': ['num']}}
+
+    m2m_field = models.ManyToManyField(M2MRelation, related_name='reconciled_mains')
+
+
 class SubBadFields(ProtoBufMixin, models.Model):
     pb_model = models_pb2.Sub
     pb_type_cast = False
+    pb_compat_ignore = ['id', 'name']  # incompatible on purpose
 
     name = models.BooleanField(default=True)
 
 
 class ComfyBadFields(ProtoBufMixin, models.Model):
     pb_model = models_pb2.ComfyWithGTypes
+    pb_compat_ignore = ['bool_val', 'float_val']  # incompatible on purpose
 
     number = models.IntegerField(default=0)
     sub = models.ForeignKey(SubBadFields, null=True)
@@ -1,21 +1,58 @@
 from __future__ import absolute_import
+import contextlib
 import datetime
+import json
+import logging
+import os
+import sys
+import tempfile
+import types
+import unittest
 import uuid
 
-from django.core.exceptions import ObjectDoesNotExist
-from django.test import TestCase
+import six
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.management import call_command
+from django.http import Http404
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext, isolate_apps
 from django.db import models as dj_models
+from django.utils import timezone
 
+from google.protobuf import json_format
 from google.protobuf.timestamp_pb2 import Timestamp
 from google.protobuf.descriptor import FieldDescriptor
 
 # Create your tests here.
 
-from pb_model.models import ProtoBufMixin
+from pb_model import cache, codegen, compat, export, fields, graph, ingest, json_mapping, loadgen, metrics, outbox, reconcile, stream, urls, views
+from pb_model.context import current_context, serialization_context
+from pb_model.models import DjangoPBModelError, ProtoBufMixin
+from pb_model.outbox.models import OutboxMessage
 from . import models, models_pb2
 from six.moves import map
 from six.moves import range
 
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+
+@contextlib.contextmanager
+def captured_logs(logger_name):
+    """Formatted records of a logger, TestCase.assertLogs isn't available on python 2"""
+    output = []
+    handler = logging.Handler()
+    handler.emit = lambda record: output.append(handler.format(record))
+    logger = logging.getLogger(logger_name)
+    logger.addHandler(handler)
+    try:
+        yield output
+    finally:
+        logger.removeHandler(handler)
+
 
 class ProtoBufConvertingTest(TestCase):
 
@@ -301,3 +338,1253 @@ class ComfyConvertingTest(TestCase):
                 ])
         ):
             comfy1.to_pb()
+
+
+class LazyJSONTest(TestCase):
+
+    def test_decoded_on_first_access(self):
+        models.ListWrapper.objects.create(data=['qwe', 'asd'])
+        dj_object = models.ListWrapper.objects.get()
+        self.assertIs(type(dj_object.__dict__['data']), fields.LazyJSON)
+
+        self.assertEqual(['qwe', 'asd'], dj_object.data)
+        self.assertIs(type(dj_object.__dict__['data']), list)
+
+    def test_untouched_value_saved_verbatim(self):
+        models.MapWrapper.objects.create(data={'qwe': 'asd'})
+        dj_object = models.MapWrapper.objects.get()
+        dj_object.save()
+        self.assertIs(type(dj_object.__dict__['data']), fields.LazyJSON)
+        self.assertEqual({'qwe': 'asd'}, models.MapWrapper.objects.get().data)
+
+        dj_object.data['zxc'] = 'qwe'
+        dj_object.save()
+        self.assertEqual({'qwe': 'asd', 'zxc': 'qwe'}, models.MapWrapper.objects.get().data)
+
+    def test_deferred_and_values(self):
+        models.ListWrapper.objects.create(data=['qwe'])
+        self.assertEqual(['qwe'], models.ListWrapper.objects.defer('data').get().data)
+        self.assertEqual(['qwe'], models.ListWrapper.objects.values_list('data', flat=True).get())
+
+    def test_values_are_plain(self):
+        models.ListWrapper.objects.create(data=['qwe'])
+        models.MapWrapper.objects.create(data={'qwe': 'asd'})
+
+        self.assertIs(type(models.ListWrapper.objects.values_list('data', flat=True).get()), list)
+        self.assertIs(type(models.ListWrapper.objects.values_list('id', 'data').get()[1]), list)
+        value = models.MapWrapper.objects.values('data').get()['data']
+        self.assertIs(type(value), dict)
+        self.assertEqual('{"qwe": "asd"}', json.dumps(value))
+        # other querysets than ProtoBufQuerySet decode right away
+        self.assertIs(type(models.MapWrapper._base_manager.get().__dict__['data']), dict)
+        annotated = models.MapWrapper.objects.annotate(copy=dj_models.F('data')).get()
+        self.assertIs(type(annotated.copy), dict)
+
+
+class OrderedThroughTest(TestCase):
+
+    def _create_embedded(self, *data):
+        return [models.Embedded.objects.create(data=d) for d in data]
+
+    def test_round_trip(self):
+        pb_object = models_pb2.Root(
+            repeated_message_field=[models_pb2.Root.Embedded(data=d) for d in (3, 1, 2)],
+            map_string_to_message_field={'qwe': models_pb2.Root.Embedded(data=4), 'asd': models_pb2.Root.Embedded(data=5)},
+        )
+        dj_object = models.OrderedRoot().from_pb(pb_object)
+        for m in dj_object.repeated_message_field:
+            m.save()
+        for m in dj_object.map_string_to_message_field.values():
+            m.save()
+        dj_object.save()
+
+        dj_object_from_db = models.OrderedRoot.objects.get()
+        field = models.OrderedRoot._meta.get_field('repeated_message_field')
+        with self.assertNumQueries(1):
+            self.assertEqual([3, 1, 2], [m.data for m in field.load_collection(dj_object_from_db)])
+        self.assertEqual(
+            {'qwe': 4, 'asd': 5},
+            {k: m.data for k, m in dj_object_from_db.map_string_to_message_field.items()}
+        )
+        self.assertFalse(hasattr(dj_object_from_db, 'repeated_message_field_index'))
+
+        result = dj_object_from_db.to_pb()
+        self.assertEqual(list(pb_object.repeated_message_field), list(result.repeated_message_field))
+        self.assertEqual(dict(pb_object.map_string_to_message_field), dict(result.map_string_to_message_field))
+
+    def test_reassign(self):
+        first, second = self._create_embedded(1, 2)
+        dj_object = models.OrderedRoot()
+        dj_object.repeated_message_field = [first, second]
+        dj_object.save()
+        dj_object.repeated_message_field = [second, first, second]
+        dj_object.save()
+        self.assertEqual([2, 1, 2], [m.data for m in models.OrderedRoot.objects.get().repeated_message_field])
+
+    def test_copy_index(self):
+        first, second, third = self._create_embedded(1, 2, 3)
+        dj_object = models.OrderedRoot.objects.create()
+
+        repeated = models.OrderedRoot._meta.get_field('repeated_message_field')
+        self.assertEqual(3, repeated.copy_index([(dj_object.pk, '[%d, %d, %d]' % (third.pk, first.pk, second.pk))]))
+        message_map = models.OrderedRoot._meta.get_field('map_string_to_message_field')
+        self.assertEqual(1, message_map.copy_index([(dj_object.pk, {'qwe': second.pk})]))
+
+        dj_object = models.OrderedRoot.objects.get()
+        self.assertEqual([3, 1, 2], [m.data for m in dj_object.repeated_message_field])
+        self.assertEqual({'qwe': 2}, {k: m.data for k, m in dj_object.map_string_to_message_field.items()})
+
+
+class JSONLookupTest(TestCase):
+
+    def setUp(self):
+        models.ListWrapper.objects.create(data=['qwe', 'asd'])
+        models.ListWrapper.objects.create(data=[])
+        models.MapWrapper.objects.create(data={'qwe': 'asd', 'zxc': 'asd'})
+        models.MapWrapper.objects.create(data={'asd': 'qwe'})
+
+    def test_array_lookups(self):
+        self.assertEqual(1, models.ListWrapper.objects.filter(data__contains='asd').count())
+        self.assertEqual(0, models.ListWrapper.objects.filter(data__contains='zxc').count())
+        self.assertEqual(1, models.ListWrapper.objects.filter(data__len=0).count())
+        self.assertEqual(1, models.ListWrapper.objects.filter(data__len__gt=1).count())
+
+    def test_map_lookups(self):
+        self.assertEqual(1, models.MapWrapper.objects.filter(data__has_key='zxc').count())
+        self.assertEqual(1, models.MapWrapper.objects.filter(data__contains={'qwe': 'asd'}).count())
+        self.assertEqual(0, models.MapWrapper.objects.filter(data__contains={'qwe': 'qwe'}).count())
+        self.assertEqual(1, models.MapWrapper.objects.filter(data__qwe='asd').count())
+        self.assertEqual(1, models.MapWrapper.objects.filter(data__asd__startswith='q').count())
+        self.assertEqual(1, models.MapWrapper.objects.filter(data__len=2).count())
+
+    def test_integer_values(self):
+        models.Root.objects.create(repeated_uint32_field=[1, 2, 42], timestamp_field=timezone.now())
+        self.assertEqual(1, models.Root.objects.filter(repeated_uint32_field__contains=42).count())
+        self.assertEqual(0, models.Root.objects.filter(repeated_uint32_field__contains=43).count())
+
+
+class InlineMessageFieldTest(TestCase):
+
+    def test_columns(self):
+        self.assertIsInstance(models.InlineRoot._meta.get_field('message_field'), fields.InlineMessageField)
+        self.assertIsInstance(models.InlineRoot._meta.get_field('message_field_data'), dj_models.IntegerField)
+        self.assertNotIn('message_field', [f.name for f in models.InlineRoot._meta.concrete_fields])
+
+    def test_round_trip(self):
+        pb_object = models_pb2.Root(int32_field=1, message_field=models_pb2.Root.Embedded(data=123))
+        dj_object = models.InlineRoot().from_pb(pb_object)
+        self.assertEqual(123, dj_object.message_field.data)
+        dj_object.save()
+
+        with self.assertNumQueries(1):
+            dj_object_from_db = models.InlineRoot.objects.get()
+            result = dj_object_from_db.to_pb()
+        self.assertEqual(123, dj_object_from_db.message_field_data)
+        self.assertEqual(pb_object.message_field, result.message_field)
+        self.assertFalse(models.Embedded.objects.exists())
+
+    def test_presence(self):
+        dj_object = models.InlineRoot.objects.create()
+        self.assertIsNone(dj_object.message_field)
+        self.assertFalse(dj_object.to_pb().HasField('message_field'))
+
+        dj_object.from_pb(models_pb2.Root(message_field=models_pb2.Root.Embedded()))
+        dj_object.save()
+        dj_object = models.InlineRoot.objects.get()
+        self.assertEqual(0, dj_object.message_field.data)
+        self.assertTrue(dj_object.to_pb().HasField('message_field'))
+
+        dj_object.message_field.data = 5
+        self.assertEqual(5, dj_object.to_pb().message_field.data)
+        dj_object.message_field = None
+        self.assertIsNone(dj_object.message_field_data)
+
+
+class CodegenTest(TestCase):
+    module_name = 'pb_model.tests.generated_serializers'
+
+    def setUp(self):
+        source, _ = codegen.generate_for_apps(['tests'])
+        module = types.ModuleType(self.module_name)
+        exec(compile(source, self.module_name, 'exec'), module.__dict__)
+        sys.modules[self.module_name] = module
+        self.addCleanup(sys.modules.pop, self.module_name)
+        self.registry = module.REGISTRY
+
+    def _record_calls(self, label):
+        """Wrap the generated functions of a model, returns the list of their calls"""
+        calls = []
+        entry = self.registry[label]
+
+        def to_pb(*args):
+            calls.append('to_pb')
+            return entry[1](*args)
+
+        def from_pb(*args):
+            calls.append('from_pb')
+            return entry[2](*args)
+
+        self.registry[label] = (entry[0], to_pb, from_pb)
+        return calls
+
+    def _convert_both_ways(self, dj_object, expand_level=None):
+        calls = self._record_calls(dj_object._meta.label)
+        generic_pb = dj_object.to_pb(expand_level=expand_level)
+        with override_settings(PB_MODEL_CODEGEN_MODULE=self.module_name):
+            self.assertIsNotNone(codegen.get_compiled(type(dj_object)))
+            generated_pb = dj_object.to_pb(expand_level=expand_level)
+            generated_object = type(dj_object)().from_pb(generated_pb)
+        self.assertEqual(generic_pb, generated_pb)
+        self.assertEqual(['to_pb', 'from_pb'], calls)
+        return generated_object
+
+    def test_same_result_as_generic(self):
+        relation = models.Relation.objects.create(num=10)
+        m2m_relation = models.M2MRelation.objects.create(num=2)
+        main = models.Main.objects.create(
+            string_field='Hello world', integer_field=2017, float_field=3.5,
+            bool_field=True, fk_field=relation
+        )
+        main.m2m_field.add(m2m_relation)
+
+        result = self._convert_both_ways(main)
+        self.assertEqual(main.string_field, result.string_field)
+        self.assertEqual(main.datetime_field, result.datetime_field)
+        self.assertEqual(relation.num, result.fk_field.num)
+
+        sub = models.Sub.objects.create(name="test_sub")
+        comfy = models.ComfyWithGTypes.objects.create(sub=sub, bool_val=True, float_val=3.5)
+        result = self._convert_both_ways(comfy, expand_level=0)
+        self.assertEqual(comfy.id, result.id)
+        self.assertEqual(3.5, result.float_val)
+        self.assertEqual("", result.str_val)
+
+    def test_stale_module_falls_back(self):
+        self.registry['tests.Relation'] = ('stale',) + self.registry['tests.Relation'][1:]
+        relation = models.Relation.objects.create(num=10)
+        with override_settings(PB_MODEL_CODEGEN_MODULE=self.module_name):
+            self.assertIsNone(codegen.get_compiled(models.Relation))
+            self.assertEqual(10, relation.to_pb().num)
+
+    def test_failure_disables_generated_functions(self):
+        def broken(*_):
+            raise ValueError('broken')
+
+        self.registry['tests.Relation'] = (self.registry['tests.Relation'][0], broken, broken)
+        relation = models.Relation.objects.create(num=10)
+        with override_settings(PB_MODEL_CODEGEN_MODULE=self.module_name):
+            with captured_logs('pb_model.models') as logs:
+                self.assertEqual(10, relation.to_pb().num)
+            self.assertIn('broken', '\n'.join(logs))
+            self.assertIsNone(codegen.get_compiled(models.Relation))
+            self.assertEqual(10, models.Relation().from_pb(relation.to_pb()).num)
+
+    def test_missing_module(self):
+        relation = models.Relation.objects.create(num=10)
+        with override_settings(PB_MODEL_CODEGEN_MODULE='pb_model.tests.no_such_module'):
+            with captured_logs('pb_model.codegen') as logs:
+                self.assertEqual(10, relation.to_pb().num)
+                self.assertEqual(10, models.Relation().from_pb(relation.to_pb()).num)
+                self.assertEqual(10, models.Relation().from_pb(relation.to_pb()).num)
+        # the failed import is remembered, not retried by every conversion
+        self.assertEqual(1, len(logs))
+
+    def test_command(self):
+        output = tempfile.NamedTemporaryFile(suffix='.py', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        call_command('pb_codegen', output.name, 'tests', stdout=six.StringIO())
+        with open(output.name) as f:
+            source = f.read()
+        self.assertIn('def tests_relation_to_pb(obj, pb_obj, expand_level):', source)
+        self.assertIn("'tests.Relation': ('{}',".format(codegen.fingerprint(models.Relation)), source)
+
+
+class JSONMappingTest(TestCase):
+
+    def _create_root(self):
+        timestamp = Timestamp()
+        timestamp.FromDatetime(datetime.datetime(2020, 1, 2, 3, 4, 5, 123000))
+        pb_object = models_pb2.Root(
+            uint32_field=1234, int32_field=-5, uint64_field=2 ** 60, int64_field=-123,
+            float_field=0.1, double_field=12.3, string_field='123', bytes_field=b'\x00\xff',
+            bool_field=True, uuid_field=str(uuid.uuid4()), enum_field=2, timestamp_field=timestamp,
+            repeated_uint32_field=[1, 2, 3], map_string_to_string_field={'qwe': 'asd'},
+            message_field=models_pb2.Root.Embedded(data=123),
+            repeated_message_field=[models_pb2.Root.Embedded(data=1), models_pb2.Root.Embedded()],
+            list_field_option=models_pb2.Root.ListWrapper(data=['qwe']),
+        )
+        dj_object = models.Root().from_pb(pb_object)
+        dj_object.message_field.save()
+        dj_object.message_field = dj_object.message_field
+        for m in dj_object.repeated_message_field:
+            m.save()
+        dj_object.list_field_option.save()
+        dj_object.list_field_option = dj_object.list_field_option
+        dj_object.save()
+        return models.Root.objects.get()
+
+    def test_conformance(self):
+        root = self._create_root()
+        self.assertEqual(json_format.MessageToDict(root.to_pb()), root.to_pb_dict())
+        self.assertEqual(json_format.MessageToJson(root.to_pb()), root.to_pb_json())
+
+        root.float_field, root.bool_field, root.uuid_field = float('inf'), False, None
+        self.assertEqual(json_format.MessageToDict(root.to_pb()), root.to_pb_dict())
+
+        relation = models.Relation.objects.create(num=10)
+        main = models.Main.objects.create(
+            string_field='Hello world', integer_field=0, float_field=3.5, fk_field=relation,
+            choices_field=models.Main.OPT2,
+        )
+        main.m2m_field.add(models.M2MRelation.objects.create(num=2), models.M2MRelation.objects.create())
+        for expand_level in (None, 0, 1):
+            self.assertEqual(json_format.MessageToDict(main.to_pb(expand_level)), main.to_pb_dict(expand_level))
+
+        comfy = models.ComfyWithGTypes.objects.create(
+            sub=models.Sub.objects.create(name="test_sub"), bool_val=False, float_val=0.1
+        )
+        comfy.str_val = None
+        self.assertEqual(json_format.MessageToDict(comfy.to_pb()), comfy.to_pb_dict())
+
+    def test_from_pb_dict(self):
+        pb_dict = self._create_root().to_pb_dict()
+        pb_dict.update(int32Field=0, double_field='NaN', enumField=1)
+
+        expected = models.Root().from_pb(json_format.ParseDict(pb_dict, models_pb2.Root()))
+        result = models.Root().from_pb_dict(pb_dict)
+        self.assertEqual(expected.to_pb_dict(), result.to_pb_dict())
+        self.assertEqual(models.Root._meta.get_field('int32_field').get_default(), result.int32_field)
+
+        with self.assertRaises(json_format.ParseError):
+            models.Root().from_pb_dict({'noSuchField': 1})
+
+    def test_float_without_shortest_repr(self):
+        float_field = models_pb2.Root.DESCRIPTOR.fields_by_name['float_field']
+        value = models_pb2.Root(float_field=0.1).float_field
+        self.assertEqual(0.1, json_mapping._scalar_to_json(float_field, value))
+
+        # protobuf releases without ToShortestFloat
+        self.addCleanup(setattr, json_mapping, '_to_shortest_float', json_mapping._to_shortest_float)
+        json_mapping._to_shortest_float = None
+        self.assertEqual(value, json_mapping._scalar_to_json(float_field, value))
+
+    def test_queryset(self):
+        models.Relation.objects.create(num=1)
+        models.Relation.objects.create(num=2)
+        self.assertEqual(
+            [{'id': 1, 'num': 1}, {'id': 2, 'num': 2}], models.Relation.objects.order_by('id').to_pb_dicts()
+        )
+
+
+class ProtoBufViewsTest(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.relations = [models.TrackedRelation.objects.create(num=num) for num in range(5)]
+
+    def _parse_stream(self, response):
+        data = b''.join(response.streaming_content)
+        return [models_pb2.Relation.FromString(item) for item in stream.iter_delimited(six.BytesIO(data))]
+
+    def test_detail(self):
+        view = views.ProtoBufDetailView.as_view(model=models.TrackedRelation)
+        relation = self.relations[1]
+        response = view(self.factory.get('/'), pk=relation.pk)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-protobuf', response['Content-Type'])
+        self.assertEqual(relation.to_pb(), models_pb2.Relation.FromString(response.content))
+
+        response = view(self.factory.get('/', HTTP_IF_NONE_MATCH=response['ETag']), pk=relation.pk)
+        self.assertEqual(304, response.status_code)
+        with self.assertRaises(Http404):
+            view(self.factory.get('/'), pk=1000)
+
+    def test_detail_etag_field(self):
+        view = views.ProtoBufDetailView.as_view(model=models.TrackedRelation, etag_field='updated_at')
+        relation = self.relations[1]
+        etag = view(self.factory.get('/'), pk=relation.pk)['ETag']
+
+        with self.assertNumQueries(1):
+            response = view(self.factory.get('/', HTTP_IF_NONE_MATCH=etag), pk=relation.pk)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response['ETag'])
+
+        relation.save()
+        response = view(self.factory.get('/', HTTP_IF_NONE_MATCH=etag), pk=relation.pk)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+
+    def test_list_pagination(self):
+        view = views.ProtoBufListView.as_view(model=models.TrackedRelation)
+        response = view(self.factory.get('/', {'limit': 2}))
+        self.assertEqual([0, 1], [r.num for r in self._parse_stream(response)])
+        cursor = response['X-Next-Cursor']
+
+        response = view(self.factory.get('/', {'limit': 2, 'after': cursor}))
+        self.assertEqual([2, 3], [r.num for r in self._parse_stream(response)])
+        response = view(self.factory.get('/', {'limit': 2, 'after': response['X-Next-Cursor']}))
+        self.assertEqual([4], [r.num for r in self._parse_stream(response)])
+        self.assertNotIn('X-Next-Cursor', response)
+
+        self.assertEqual(400, view(self.factory.get('/', {'limit': 'x'})).status_code)
+
+    def test_list_etag_field(self):
+        view = views.ProtoBufListView.as_view(model=models.TrackedRelation, etag_field='updated_at')
+        etag = view(self.factory.get('/'))['ETag']
+        self.assertEqual(304, view(self.factory.get('/', HTTP_IF_NONE_MATCH=etag)).status_code)
+
+        self.relations[3].save()
+        response = view(self.factory.get('/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(5, len(self._parse_stream(response)))
+
+    def test_urls(self):
+        patterns = urls.pb_model_urls(models.TrackedRelation, prefix='relations')
+        self.assertEqual(['tests-trackedrelation-list', 'tests-trackedrelation-detail'], [p.name for p in patterns])
+
+
+class IngestTest(TestCase):
+
+    def _stream(self, messages):
+        return b''.join(stream.delimited(message.SerializeToString()) for message in messages)
+
+    def test_batches(self):
+        body = self._stream(models_pb2.Relation(num=num) for num in range(7))
+        results = ingest.ingest(models.Relation, six.BytesIO(body), batch_size=3)
+        self.assertEqual([3, 3, 1], [result['count'] for result in results])
+        self.assertEqual(list(range(7)), sorted(models.Relation.objects.values_list('num', flat=True)))
+
+    def test_failed_batch_rolled_back(self):
+        models.Relation.objects.create(id=5, num=0)
+        body = self._stream(models_pb2.Relation(id=pk, num=1) for pk in (1, 2, 5, 6))
+        with captured_logs('pb_model.ingest') as logs:
+            results = ingest.ingest(models.Relation, six.BytesIO(body), batch_size=2)
+        self.assertIsNone(results[0]['error'])
+        self.assertEqual(ingest.BATCH_ERROR, results[1]['error'])
+        self.assertIn('IntegrityError', logs[0])
+        self.assertEqual([1, 2, 5], sorted(models.Relation.objects.values_list('id', flat=True)))
+
+    def test_nested_foreign_keys(self):
+        body = self._stream(models_pb2.Main(
+            string_field='main', integer_field=num, float_field=1, fk_field=models_pb2.Relation(num=num)
+        ) for num in range(1, 4))
+        results = ingest.ingest(models.Main, six.BytesIO(body))
+        self.assertEqual([{'batch': 0, 'count': 3, 'error': None}], results)
+        self.assertEqual([1, 2, 3], [main.fk_field.num for main in models.Main.objects.order_by('integer_field')])
+
+    def test_buffered_reads(self):
+        messages = [models_pb2.Relation(num=num).SerializeToString() for num in range(300)] + [b'x' * 1000, b'']
+        body = b''.join(stream.delimited(message) for message in messages)
+        for chunk_size in (1, 3, 1024):
+            self.assertEqual(messages, list(stream.iter_delimited(six.BytesIO(body), chunk_size=chunk_size)))
+
+        reads = []
+
+        class Upload(six.BytesIO):
+            def read(self, size=-1):
+                reads.append(size)
+                return six.BytesIO.read(self, size)
+
+        self.assertEqual(messages, list(stream.iter_delimited(Upload(body))))
+        self.assertEqual(2, len(reads))
+
+    def test_save_per_object(self):
+        body = self._stream([models_pb2.Root(), models_pb2.Root()])
+        self.assertFalse(ingest._can_bulk_create(models.OrderedRoot))
+        results = ingest.ingest(models.OrderedRoot, six.BytesIO(body))
+        self.assertEqual([{'batch': 0, 'count': 2, 'error': None}], results)
+        self.assertEqual(2, models.OrderedRoot.objects.count())
+
+    def test_view(self):
+        body = self._stream(models_pb2.Relation(num=num) for num in range(3))
+        view = views.ProtoBufIngestView.as_view(model=models.Relation, batch_size=2)
+        response = view(RequestFactory().post('/', body, content_type='application/x-protobuf'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, json.loads(response.content.decode('utf-8'))['count'])
+
+        response = view(RequestFactory().post('/', body[:-1], content_type='application/x-protobuf'))
+        self.assertEqual(207, response.status_code)
+        self.assertIn('Truncated', json.loads(response.content.decode('utf-8'))['batches'][-1]['error'])
+
+
+class OutboxTest(TransactionTestCase):
+
+    def _drain(self, batch_size=1000):
+        batches = []
+        outbox.drain(batches.append, batch_size=batch_size)
+        return [[(m.operation, m.object_pk, m.to_pb()) for m in batch] for batch in batches]
+
+    def test_serialized_in_transaction(self):
+        with transaction.atomic():
+            relation = models.OutboxRelation.objects.create(num=1)
+            relation.num = 2
+            relation.save()
+            relation.num = 3
+            self.assertEqual([1, 2], [m.to_pb().num for m in OutboxMessage.objects.order_by('id')])
+
+        models.Relation.objects.create(num=1)
+        self.assertEqual([[
+            ('save', str(relation.pk), models_pb2.Relation(id=relation.pk, num=1)),
+            ('save', str(relation.pk), models_pb2.Relation(id=relation.pk, num=2)),
+        ]], self._drain())
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_rolled_back(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                models.OutboxRelation.objects.create(num=1)
+                raise ValueError
+        self.assertFalse(OutboxMessage.objects.exists())
+
+        models.OutboxRelation.objects.create(num=3)
+        self.assertEqual(3, OutboxMessage.objects.get().to_pb().num)
+
+    def test_bulk_operations(self):
+        models.OutboxRelation.objects.bulk_create([models.OutboxRelation(num=num) for num in range(3)])
+        models.OutboxRelation.objects.filter(num__gte=1).update(num=5)
+        models.OutboxRelation.objects.filter(num=0).delete()
+        pks = sorted(models.OutboxRelation.objects.values_list('pk', flat=True))
+
+        messages = sum(self._drain(batch_size=2), [])
+        self.assertEqual(['save'] * 5 + ['delete'], [m[0] for m in messages])
+        self.assertEqual([0, 1, 2], [m[2].num for m in messages[:3]])
+        self.assertEqual([5, 5], [m[2].num for m in messages[3:5]])
+        self.assertEqual(pks, sorted(int(m[1]) for m in messages[3:5]))
+        self.assertIsNone(messages[5][2])
+
+    @unittest.skipUnless(hasattr(dj_models.QuerySet, 'bulk_update'), "bulk_update and ignore_conflicts need Django 2.2")
+    def test_bulk_update_and_ignore_conflicts(self):
+        relations = models.OutboxRelation.objects.bulk_create([models.OutboxRelation(num=num) for num in range(2)])
+        for relation in relations:
+            relation.num += 10
+        models.OutboxRelation.objects.bulk_update(relations, ['num'], batch_size=1)
+        models.OutboxRelation.objects.bulk_create(
+            [models.OutboxRelation(num=20), models.OutboxRelation(pk=relations[0].pk, num=30)], ignore_conflicts=True
+        )
+
+        messages = sum(self._drain(), [])
+        self.assertEqual([0, 1, 10, 11, 20], [m[2].num for m in messages])
+
+    def test_publish_failure_keeps_rows(self):
+        models.OutboxRelation.objects.create(num=1)
+
+        def publish(messages):
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            outbox.drain(publish)
+        self.assertEqual(1, OutboxMessage.objects.count())
+
+    @isolate_apps('pb_model.tests')
+    def test_checks(self):
+        class PlainManagerRelation(ProtoBufMixin, dj_models.Model):
+            pb_model = models_pb2.Relation
+            pb_outbox = True
+
+            objects = dj_models.Manager()
+            num = dj_models.IntegerField(default=0)
+
+        self.assertEqual([], [m.id for m in models.OutboxRelation.check() if m.id.startswith('pb_model.')])
+        self.assertEqual(['pb_model.E003'], [
+            m.id for m in PlainManagerRelation.check() if m.id.startswith('pb_model.')
+        ])
+        with self.settings(INSTALLED_APPS=['pb_model', 'pb_model.tests']):
+            self.assertEqual(['pb_model.E002'], [
+                m.id for m in models.OutboxRelation.check() if m.id.startswith('pb_model.')
+            ])
+
+
+class ExportChangesTest(TestCase):
+
+    def test_incremental(self):
+        relations = [models.TrackedRelation.objects.create(num=num) for num in range(5)]
+        batch = export.export_changes(models.TrackedRelation, batch_size=3)
+        self.assertEqual([0, 1, 2], [m.num for m in batch.messages])
+        self.assertTrue(batch.has_more)
+
+        batch = export.export_changes(models.TrackedRelation, batch.cursor, batch_size=3)
+        self.assertEqual([3, 4], [m.num for m in batch.messages])
+        self.assertFalse(batch.has_more)
+
+        empty = export.export_changes(models.TrackedRelation, batch.cursor, batch_size=3)
+        self.assertEqual(([], batch.cursor), (empty.messages, empty.cursor))
+
+        relations[1].num = 10
+        relations[1].save()
+        changed = export.export_changes(models.TrackedRelation, batch.cursor, batch_size=3)
+        self.assertEqual([10], [m.num for m in changed.messages])
+
+    def test_same_timestamp(self):
+        now = timezone.now()
+        for num in range(3):
+            models.TrackedRelation.objects.create(num=num)
+        models.TrackedRelation.objects.update(updated_at=now)
+
+        cursor, nums = None, []
+        for _ in range(3):
+            batch = export.export_changes(models.TrackedRelation, cursor, batch_size=1)
+            cursor, nums = batch.cursor, nums + [m.num for m in batch.messages]
+        self.assertEqual([0, 1, 2], nums)
+
+    def test_relations_prefetched(self):
+        relation = models.Relation.objects.create(num=10)
+        for _ in range(3):
+            main = models.Main.objects.create(string_field='', integer_field=1, float_field=1.0, fk_field=relation)
+            main.m2m_field.add(models.M2MRelation.objects.create(num=2))
+
+        with self.assertNumQueries(2):
+            batch = export.export_changes(models.Main, batch_size=10, updated_field='datetime_field')
+        self.assertEqual([10] * 3, [m.fk_field.num for m in batch.messages])
+        self.assertEqual([1] * 3, [len(m.m2m_field) for m in batch.messages])
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(export.InvalidCursor):
+            export.export_changes(models.TrackedRelation, 'garbage')
+
+
+class ReferenceCacheTest(TestCase):
+
+    def setUp(self):
+        self.reference_cache = cache.get_reference_cache(models.CachedRelation)
+        self.reference_cache.clear()
+        self.reference_cache.hits = self.reference_cache.misses = 0
+        self.relation = models.CachedRelation.objects.create(num=10)
+        for num in range(3):
+            models.CachedRelationReferrer.objects.create(integer_field=num, fk_field=self.relation)
+
+    def test_served_from_cache(self):
+        referrers = list(models.CachedRelationReferrer.objects.order_by('id'))
+        with self.assertNumQueries(1):
+            messages = [referrer.to_pb() for referrer in referrers]
+        self.assertEqual([10] * 3, [m.fk_field.num for m in messages])
+        self.assertEqual(self.relation.id, messages[2].fk_field.id)
+        self.assertEqual(2, self.reference_cache.hits)
+        with self.assertNumQueries(0):
+            self.assertEqual(10, referrers[2].fk_field.num)
+
+        self.assertFalse(models.CachedRelationReferrer(id=100).to_pb().HasField('fk_field'))
+        self.assertIsNone(cache.get_reference_cache(models.Relation))
+
+    def test_instances_not_shared(self):
+        referrers = list(models.CachedRelationReferrer.objects.order_by('id'))
+        for referrer in referrers:
+            referrer.to_pb()
+        related = [referrer.fk_field for referrer in referrers]
+        self.assertEqual(3, len(set(map(id, related))))
+        self.assertFalse(related[1]._state.adding)
+
+        related[1].num = 99
+        self.assertEqual([10, 99, 10], [relation.num for relation in related])
+        self.assertEqual(10, self.reference_cache.get(self.relation.pk)[0].num)
+
+    def test_invalidation(self):
+        referrer = models.CachedRelationReferrer.objects.first()
+        referrer.to_pb()
+        self.relation.num = 20
+        self.relation.save()
+        self.assertEqual(20, models.CachedRelationReferrer.objects.first().to_pb().fk_field.num)
+
+        models.CachedRelation.objects.update(num=30)
+        self.assertEqual(30, models.CachedRelationReferrer.objects.first().to_pb().fk_field.num)
+
+    def test_size_and_ttl(self):
+        now = [0]
+        reference_cache = cache.ReferenceCache(max_size=2, ttl=10, timer=lambda: now[0])
+        for pk in range(3):
+            reference_cache.set(pk, None, b'')
+        self.assertEqual(2, len(reference_cache))
+        self.assertIsNone(reference_cache.get(0))
+        self.assertIsNotNone(reference_cache.get(1))
+        now[0] = 11
+        self.assertIsNone(reference_cache.get(1))
+
+
+class SerializationContextTest(TestCase):
+
+    def setUp(self):
+        relation = models.Relation.objects.create(num=10)
+        m2m_relation = models.M2MRelation.objects.create(num=2)
+        for num in range(3):
+            main = models.Main.objects.create(
+                string_field='', integer_field=num, float_field=1.0, fk_field=relation
+            )
+            main.m2m_field.add(m2m_relation)
+
+    def test_shared_relations_converted_once(self):
+        queryset = models.Main.objects.select_related('fk_field').prefetch_related('m2m_field').order_by('id')
+        expected = [main.to_pb() for main in queryset]
+
+        with serialization_context() as pb_context:
+            self.assertEqual(expected, [main.to_pb() for main in queryset])
+        self.assertEqual(3 + 2, pb_context.conversions)
+        self.assertEqual(4, pb_context.saved)
+
+        self.assertEqual(expected, queryset.to_pb_list())
+        self.assertIsNone(current_context())
+
+    def test_results_are_copies(self):
+        main = models.Main.objects.first()
+        with serialization_context() as pb_context:
+            first, second = main.to_pb(), main.to_pb()
+        self.assertEqual(1, pb_context.saved)
+        self.assertIsNot(first, second)
+        first.fk_field.num = 0
+        self.assertEqual(10, second.fk_field.num)
+
+    def test_first_result_is_not_shared(self):
+        main = models.Main.objects.first()
+        with serialization_context():
+            first = main.to_pb()
+            first.fk_field.num = 0
+            first.integer_field = 100
+            second = main.to_pb()
+            into = main.fk_field.to_pb(into=first.fk_field)
+            into.num = 1
+            third = main.to_pb()
+        self.assertEqual((10, 0), (second.fk_field.num, second.integer_field))
+        self.assertEqual(second, third)
+
+    def test_list_results_are_copies(self):
+        first, second = models.Main.objects.order_by('id')[:2].to_pb_list()
+        first.fk_field.num = 0
+        self.assertEqual(10, second.fk_field.num)
+
+    def test_into(self):
+        main = models.Main.objects.first()
+        into = models_pb2.Main()
+        self.assertIs(into, main.to_pb(into=into))
+        self.assertEqual(main.to_pb(), into)
+
+        parent = models_pb2.Main()
+        self.assertIs(parent.fk_field, main.fk_field.to_pb(into=parent.fk_field))
+        self.assertTrue(parent.HasField('fk_field'))
+        self.assertEqual(main.fk_field.to_pb(), parent.fk_field)
+
+
+class ReadOnlyViewTest(TestCase):
+
+    def setUp(self):
+        self.pb_root = models_pb2.Root(
+            uint32_field=3, string_field='str', uuid_field='12345678-1234-5678-1234-567812345678',
+            repeated_uint32_field=[1, 2], map_string_to_string_field={'a': 'b'},
+            message_field=models_pb2.Root.Embedded(data=1),
+            repeated_message_field=[models_pb2.Root.Embedded(data=2), models_pb2.Root.Embedded(data=3)],
+            map_string_to_message_field={'x': models_pb2.Root.Embedded(data=4)},
+        )
+        self.pb_root.timestamp_field.FromDatetime(datetime.datetime(2020, 1, 2, 3, 4, 5))
+
+    def test_same_values_as_from_pb(self):
+        view = models.Root.pb_view(self.pb_root)
+        root = models.Root().from_pb(self.pb_root)
+        for name in ['uint32_field_renamed', 'string_field', 'uuid_field', 'timestamp_field', 'int32_field',
+                     'repeated_uint32_field', 'map_string_to_string_field']:
+            self.assertEqual(getattr(root, name), getattr(view, name), name)
+        self.assertIsInstance(view.uuid_field, uuid.UUID)
+
+        self.assertEqual(1, view.message_field.data)
+        self.assertEqual(root.message_field.data, view.message_field.data)
+        self.assertIsNone(view.message_field_id)
+        self.assertEqual([2, 3], [embedded.data for embedded in view.repeated_message_field])
+        self.assertEqual(4, view.map_string_to_message_field['x'].data)
+        self.assertIsNone(view.list_field_option)
+        self.assertIs(self.pb_root, view.to_pb())
+        self.assertEqual(self.pb_root, view.to_model().to_pb())
+
+    def test_read_only(self):
+        view = models.Root.pb_view(self.pb_root)
+        self.assertFalse(hasattr(view, '__dict__'))
+        with self.assertRaises(AttributeError):
+            view.string_field = 'other'
+        with self.assertRaises(AttributeError):
+            del view.string_field
+        with self.assertRaises(AttributeError):
+            view.unknown
+        self.assertEqual(models.Root.pb_view(self.pb_root), view)
+
+
+class LazyFromPBTest(TestCase):
+
+    def setUp(self):
+        self.pb_root = models_pb2.Root(
+            uint32_field=3, string_field='str', uuid_field='12345678-1234-5678-1234-567812345678',
+            repeated_uint32_field=[1, 2], map_string_to_string_field={'a': 'b'},
+        )
+        self.pb_root.timestamp_field.FromDatetime(datetime.datetime(2020, 1, 2, 3, 4, 5))
+
+    def test_converted_on_access(self):
+        root = models.Root().from_pb(self.pb_root, lazy=True)
+        self.assertNotIn('string_field', root.__dict__)
+        self.assertNotIn('repeated_uint32_field', root.__dict__)
+
+        with self.assertNumQueries(0):
+            self.assertEqual('str', root.string_field)
+            self.assertEqual(3, root.uint32_field_renamed)
+            self.assertEqual([1, 2], root.repeated_uint32_field)
+        self.assertIn('string_field', root.__dict__)
+        self.assertNotIn('map_string_to_string_field', root.__dict__)
+
+        eager = models.Root().from_pb(self.pb_root)
+        for name in ['uuid_field', 'timestamp_field', 'map_string_to_string_field']:
+            self.assertEqual(getattr(eager, name), getattr(root, name), name)
+
+    def test_save(self):
+        root = models.Root().from_pb(self.pb_root, lazy=True)
+        root.string_field = 'assigned'
+        root.save()
+        self.assertFalse(root.__dict__.get('_pb_pending'))
+
+        root = models.Root.objects.get(id=root.id)
+        self.assertEqual('assigned', root.string_field)
+        self.assertEqual(3, root.uint32_field_renamed)
+        self.assertEqual({'a': 'b'}, root.map_string_to_string_field)
+
+    def test_full_clean(self):
+        relation = models.Relation().from_pb(models_pb2.Relation(id=5, num=7), lazy=True)
+        self.assertEqual(5, relation.__dict__['id'])
+        self.assertNotIn('num', relation.__dict__)
+        relation.full_clean()
+        self.assertEqual(7, relation.__dict__['num'])
+
+
+class CompatTest(TestCase):
+
+    def _levels(self, model):
+        return {result.pb_field.name: result.level for result in compat.analyze(model)}
+
+    def test_analyze(self):
+        levels = self._levels(models.Main)
+        self.assertEqual(compat.IDENTITY, levels['integer_field'])
+        self.assertEqual(compat.IDENTITY, levels['string_field'])
+        self.assertEqual(compat.SAFE, levels['float_field'])
+        self.assertEqual(compat.UNCHECKED, levels['fk_field'])
+        self.assertEqual(compat.UNCHECKED, levels['datetime_field'])
+
+        levels = self._levels(models.Root)
+        self.assertEqual(compat.LOSSY, levels['uint32_field'])
+        self.assertEqual(compat.LOSSY, levels['uint64_field'])
+        self.assertEqual(compat.IDENTITY, levels['enum_field'])
+        self.assertEqual(compat.SAFE, self._levels(models.Comfy)['number'])
+        self.assertEqual(compat.LOSSY, self._levels(models.ComfyBadFields)['float_val'])
+
+    def test_ranges_in_both_directions(self):
+        int64 = models_pb2.Root.DESCRIPTOR.fields_by_name['int64_field']
+        int32 = models_pb2.Root.DESCRIPTOR.fields_by_name['int32_field']
+        level, reason = compat.classify(int64, dj_models.IntegerField())
+        self.assertEqual(compat.LOSSY, level)
+        self.assertIn('from_pb', reason)
+        level, reason = compat.classify(int32, dj_models.BigIntegerField())
+        self.assertEqual(compat.LOSSY, level)
+        self.assertIn('to_pb', reason)
+        self.assertEqual(compat.IDENTITY, compat.classify(int64, dj_models.BigIntegerField())[0])
+
+    def test_checks(self):
+        for model in [models.SubBadFields, models.ComfyBadFields, models.Main, models.Root, models.CompactRoot]:
+            self.assertEqual([], [message.id for message in model.check() if message.id.startswith('pb_model.')])
+
+        ignored = models.SubBadFields.pb_compat_ignore, models.Root.pb_compat_ignore
+        models.SubBadFields.pb_compat_ignore, models.Root.pb_compat_ignore = [], ['uint32_field']
+        try:
+            self.assertEqual(['pb_model.E001', 'pb_model.E001'], [
+                message.id for message in models.SubBadFields.check() if message.id.startswith('pb_model.')
+            ])
+            self.assertEqual(['pb_model.W001'], [
+                message.id for message in models.Root.check() if message.id.startswith('pb_model.')
+            ])
+        finally:
+            models.SubBadFields.pb_compat_ignore, models.Root.pb_compat_ignore = ignored
+
+    def test_cast_kept(self):
+        self.assertEqual(models_pb2.Relation(id=1, num=5), models.Relation(id=1, num='5').to_pb())
+        self.assertEqual(1, models.Relation(id='1').to_pb().id)
+        main = models.Main(id=1, string_field=5, integer_field='2', float_field=1, fk_field=models.Relation(id=1))
+        pb_main = main.to_pb(expand_level=0)
+        self.assertEqual(('5', 2, 1.0), (pb_main.string_field, pb_main.integer_field, pb_main.float_field))
+
+        main = models.Main().from_pb(models_pb2.Main(integer_field=3, string_field='str'))
+        self.assertEqual((3, 'str'), (main.integer_field, main.string_field))
+        self.assertIs(int, type(models.Comfy().from_pb(models_pb2.Comfy(number='4')).number))
+
+    def test_command(self):
+        output = six.StringIO()
+        call_command('pb_compat', 'tests', stdout=output)
+        self.assertIn('tests.SubBadFields.name', output.getvalue())
+        self.assertIn(compat.INCOMPATIBLE, output.getvalue())
+
+
+class StorageProfileTest(TestCase):
+
+    def test_compact_columns(self):
+        get_field = models.CompactRoot._meta.get_field
+        self.assertIsInstance(get_field('uint32_field'), dj_models.BigIntegerField)
+        self.assertIs(type(get_field('enum_field')), dj_models.IntegerField)
+        self.assertIs(type(get_field('bool_field')), dj_models.BooleanField)
+        self.assertFalse(get_field('string_field').null)
+        self.assertEqual('', get_field('string_field').get_default())
+        self.assertEqual(0, get_field('int32_field').get_default())
+        levels = {result.pb_field.name: result.level for result in compat.analyze(models.CompactRoot)}
+        self.assertEqual(compat.IDENTITY, levels['uint32_field'])
+        self.assertEqual(compat.LOSSY, levels['uint64_field'])
+
+    def test_round_trip(self):
+        pb_root = models_pb2.Root(uint32_field=2 ** 32 - 1, int64_field=-5, string_field='str', bool_field=True,
+                                  enum_field=models_pb2.Enum_TWO)
+        models.CompactRoot().from_pb(pb_root).save()
+        compact_root = models.CompactRoot.objects.get()
+        self.assertEqual(pb_root, compact_root.to_pb())
+
+        models.CompactRoot.objects.create()
+        self.assertEqual(models_pb2.Root(), models.CompactRoot.objects.order_by('-id')[0].to_pb())
+
+    def test_range_validation(self):
+        with self.assertRaises(ValidationError):
+            models.CompactRoot(uint32_field=-1).full_clean()
+
+    def test_unknown_profile(self):
+        with self.assertRaises(DjangoPBModelError):
+            type(str('UnknownProfile'), (ProtoBufMixin, dj_models.Model), {
+                '__module__': __name__, 'pb_model': models_pb2.Relation, 'pb_storage_profile': 'tiny',
+            })
+
+
+class BytesFieldTest(TestCase):
+
+    def test_as_bytes(self):
+        payload = b'x' * 1024
+        self.assertIs(payload, fields.as_bytes(payload))
+        self.assertIs(payload, fields.as_bytes(memoryview(payload)))
+        self.assertEqual(payload[1:], fields.as_bytes(memoryview(payload)[1:]))
+        self.assertEqual(payload, fields.as_bytes(bytearray(payload)))
+
+    def test_buffer_values(self):
+        # memoryview as returned by psycopg2, assigned without cast to the identity bytes field
+        payload = b'x' * 1024
+        compact_root = models.CompactRoot(bytes_field=memoryview(payload))
+        self.assertEqual(payload, compact_root.to_pb().bytes_field)
+
+        compact_root.save()
+        self.assertEqual(payload, models.CompactRoot.objects.get().to_pb().bytes_field)
+
+
+class CompressedFieldTest(TestCase):
+
+    def _stored(self, column):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT {} FROM {}'.format(column, models.CompressedRoot._meta.db_table))
+            value = cursor.fetchone()[0]
+            return value if isinstance(value, six.text_type) else bytes(value)
+
+    def test_round_trip(self):
+        pb_root = models_pb2.Root(
+            int32_field=1, string_field='text ' * 1000, bytes_field=b'\xfe' + b'bytes' * 1000,
+            repeated_string_field=['item'] * 1000, map_string_to_string_field={'key': 'value ' * 1000},
+        )
+        models.CompressedRoot().from_pb(pb_root).save()
+        self.assertEqual(pb_root, models.CompressedRoot.objects.get().to_pb())
+
+        self.assertEqual(fields.COMPRESSION_HEADER + b'z', self._stored('bytes_field')[:2])
+        self.assertLess(len(self._stored('bytes_field')), 500)
+        for column in ['string_field', 'repeated_string_field', 'map_string_to_string_field']:
+            stored = self._stored(column)
+            self.assertEqual(fields.COMPRESSION_TEXT_HEADER + u'z', stored[:2], column)
+            self.assertLess(len(stored), 500, column)
+
+    def test_text_columns_kept(self):
+        for field_type in [fields.CompressedTextField, fields.CompressedArrayField, fields.CompressedMapField]:
+            self.assertEqual(dj_models.TextField().db_type(connection), field_type().db_type(connection))
+        field = fields.CompressedTextField(compress_threshold=10)
+        for text in [u'short', u'\ufffeshort', u'text ' * 100]:
+            self.assertEqual(text, field.decompress_text(field.get_db_prep_value(text, connection)))
+
+    def test_small_values_stored_as_is(self):
+        models.CompressedRoot.objects.create(string_field='short', bytes_field=b'\xfeshort')
+        self.assertEqual(u'short', self._stored('string_field'))
+        self.assertEqual(fields.COMPRESSION_HEADER + b'\x00\xfeshort', self._stored('bytes_field'))
+        self.assertEqual(b'\xfeshort', models.CompressedRoot.objects.get().bytes_field)
+
+    def test_legacy_rows(self):
+        obj = models.CompressedRoot.objects.create()
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE {} SET string_field = %s, bytes_field = %s'.format(
+                models.CompressedRoot._meta.db_table), ['legacy text', b'legacy bytes'])
+        obj.refresh_from_db()
+        self.assertEqual(('legacy text', b'legacy bytes'), (obj.string_field, obj.bytes_field))
+
+    def test_untouched_json_written_verbatim(self):
+        models.CompressedRoot.objects.create(repeated_string_field=['item'] * 1000)
+        stored = self._stored('repeated_string_field')
+        obj = models.CompressedRoot.objects.get()
+        obj.save()
+        self.assertEqual(stored, self._stored('repeated_string_field'))
+        self.assertEqual(['item'] * 1000, models.CompressedRoot.objects.get().repeated_string_field)
+
+    def test_lzma(self):
+        field = fields.CompressedBinaryField(compression='lzma', compress_threshold=10)
+        compressed = field.compress(b'data' * 100)
+        self.assertEqual(fields.COMPRESSION_HEADER + b'x', compressed[:2])
+        self.assertEqual(b'data' * 100, field.decompress(compressed))
+        self.assertEqual({'compression': 'lzma', 'compress_threshold': 10}, {
+            key: value for key, value in field.deconstruct()[3].items() if key.startswith('compress')
+        })
+
+
+class LoadgenTest(TestCase):
+
+    def test_seeded(self):
+        messages = [loadgen.MessageGenerator(seed=1).message(models_pb2.Root) for _ in range(2)]
+        self.assertEqual(messages[0], messages[1])
+        self.assertNotEqual(messages[0], loadgen.MessageGenerator(seed=2).message(models_pb2.Root))
+
+    def test_all_fields(self):
+        generator = loadgen.MessageGenerator(seed=1, repeated_size=3, map_size=2, string_size=8, presence=1)
+        pb_root = generator.message(models_pb2.Root)
+        self.assertEqual(3, len(pb_root.repeated_message_field))
+        self.assertEqual(2, len(pb_root.map_string_to_message_field))
+        self.assertEqual(8, len(pb_root.string_field))
+        self.assertTrue(pb_root.HasField('timestamp_field'))
+        self.assertTrue(pb_root.HasField('message_field'))
+        self.assertIsNotNone(pb_root.WhichOneof('options'))
+        self.assertEqual(0, len(generator.message(models_pb2.Root, depth=3).repeated_message_field))
+
+    def test_for_model(self):
+        generator = loadgen.MessageGenerator.for_model(models.Root, seed=1)
+        for _ in range(20):
+            self.assertLessEqual(generator.message(models_pb2.Root).uint32_field, 2 ** 31 - 1)
+        pb_root = generator.message(models_pb2.Root)
+        models.Root().from_pb(pb_root).save()
+        self.assertEqual(uuid.UUID(pb_root.uuid_field), models.Root.objects.get().uuid_field)
+
+    def test_populate(self):
+        pb_root = loadgen.MessageGenerator.for_model(models.CompactRoot, seed=1).message(models_pb2.Root)
+        self.assertFalse(pb_root.HasField('message_field'))
+        self.assertEqual(25, loadgen.populate(models.CompactRoot, 25, batch_size=10, seed=1)[0])
+        self.assertEqual(25, models.CompactRoot.objects.count())
+
+
+class SaveGraphTest(TestCase):
+
+    def _pb_root(self):
+        timestamp = Timestamp()
+        timestamp.FromDatetime(datetime.datetime(2020, 1, 1))
+        return models_pb2.Root(
+            int32_field=1, timestamp_field=timestamp,
+            message_field=models_pb2.Root.Embedded(data=1),
+            repeated_message_field=[models_pb2.Root.Embedded(data=2), models_pb2.Root.Embedded(data=3)],
+            map_string_to_message_field={'a': models_pb2.Root.Embedded(data=4)},
+            list_field_option=models_pb2.Root.ListWrapper(data=['qwe']),
+        )
+
+    def test_save_graph(self):
+        pb_root = self._pb_root()
+        root = models.Root().from_pb(pb_root)
+        levels = root.save_graph()
+        self.assertEqual([5, 1], [len(level) for level in levels])
+        self.assertEqual(4, models.Embedded.objects.count())
+
+        root_from_db = models.Root.objects.get()
+        self.assertEqual(root.pk, root_from_db.pk)
+        self.assertEqual([2, 3], [m.data for m in root_from_db.repeated_message_field])
+        self.assertEqual(2, models.Root._meta.get_field('repeated_message_field').remote_field.through.objects.count())
+        self.assertEqual(pb_root, root_from_db.to_pb())
+
+    def test_ordered_and_batch(self):
+        pb_root = models_pb2.Root(
+            repeated_message_field=[models_pb2.Root.Embedded(data=2), models_pb2.Root.Embedded(data=3)],
+            map_string_to_message_field={'a': models_pb2.Root.Embedded(data=4)},
+        )
+        roots = [models.OrderedRoot().from_pb(pb_root) for _ in range(3)]
+        graph.save_graph(roots)
+        self.assertEqual(3, models.OrderedRoot.objects.count())
+        for root in models.OrderedRoot.objects.all():
+            self.assertEqual([2, 3], [m.data for m in root.repeated_message_field])
+            self.assertEqual({'a': 4}, {k: m.data for k, m in root.map_string_to_message_field.items()})
+
+    def test_existing_objects_updated(self):
+        relation = models.Relation.objects.create(num=1)
+        main = models.Main().from_pb(models_pb2.Main(
+            string_field='main', integer_field=1, float_field=1, fk_field=models_pb2.Relation(id=relation.pk, num=5)
+        ))
+        main.save_graph()
+        self.assertEqual(1, models.Relation.objects.count())
+        self.assertEqual(5, models.Main.objects.get().fk_field.num)
+
+    def test_rollback(self):
+        root = models.Root().from_pb(self._pb_root())
+        root.repeated_message_field[0].data = 'not a number'
+        with self.assertRaises(Exception):
+            root.save_graph()
+        self.assertEqual(0, models.Embedded.objects.count())
+
+
+class InstanceOverheadTest(TestCase):
+    count = 2000
+
+    def _from_db(self, model):
+        return lambda: model.from_db('default', ['id', 'num'], [1, 2])
+
+    @unittest.skipIf(tracemalloc is None, "tracemalloc is not available")
+    def test_memory(self):
+        def allocated(factory):
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                objs = [factory() for _ in range(self.count)]
+                return (tracemalloc.get_traced_memory()[0] - before) / float(len(objs))
+            finally:
+                tracemalloc.stop()
+
+        allocated(self._from_db(models.Relation))  # warm up class level caches
+        plain = allocated(self._from_db(models.PlainRelation))
+        self.assertLessEqual(allocated(self._from_db(models.Relation)), plain * 1.05)
+        self.assertLessEqual(allocated(models.Relation), allocated(models.PlainRelation) * 1.05)
+
+    def test_instance_dict(self):
+        self.assertEqual(set(vars(self._from_db(models.PlainRelation)())), set(vars(self._from_db(models.Relation)())))
+        self.assertEqual(set(vars(models.PlainRelation())), set(vars(models.Relation())))
+
+    @isolate_apps('pb_model.tests')
+    def test_type_cast_per_class(self):
+        """
+        pb_type_cast is bound when the class is created, a proxy model overrides it
+        """
+        class UncastRelation(models.Relation):
+            pb_type_cast = False
+
+            class Meta:
+                proxy = True
+
+        self.assertEqual(5, models.Relation(id=1, num='5').to_pb().num)
+        with six.assertRaisesRegex(self, Exception, "field 'num'"):
+            UncastRelation(id=1, num='5').to_pb()
+
+
+class ReconcileTest(TestCase):
+
+    def test_reverse_foreign_key(self):
+        comfy = models.ReconciledComfy.objects.create()
+        kept, changed, deleted = [models.ReconciledItem.objects.create(comfy=comfy, nr=nr) for nr in (1, 2, 3)]
+        pb_items = [
+            models_pb2.Item(id=str(kept.pk), nr=1), models_pb2.Item(id=str(changed.pk), nr=20), models_pb2.Item(nr=4),
+        ]
+        with self.assertNumQueries(4):  # select, delete, insert, update
+            result = reconcile.reconcile(comfy, 'items', pb_items)
+        self.assertEqual((1, 1, 1), result)
+        self.assertEqual([(kept.pk, 1), (changed.pk, 20)], list(
+            comfy.items.filter(pk__in=[kept.pk, changed.pk, deleted.pk]).order_by('pk').values_list('pk', 'nr')
+        ))
+        self.assertEqual([1, 4, 20], sorted(comfy.items.values_list('nr', flat=True)))
+
+    def test_applied_on_save(self):
+        comfy = models.ReconciledComfy.objects.create()
+        models.ReconciledItem.objects.create(comfy=comfy, nr=1)
+        pb_comfy = models_pb2.Comfy(id=str(comfy.pk), number='5', items=[models_pb2.Item(nr=2), models_pb2.Item(nr=3)])
+
+        dj_comfy = models.ReconciledComfy().from_pb(pb_comfy)
+        self.assertEqual([1], list(comfy.items.values_list('nr', flat=True)))
+        dj_comfy.save()
+        self.assertEqual([2, 3], sorted(comfy.items.values_list('nr', flat=True)))
+
+        models.ReconciledComfy().from_pb(models_pb2.Comfy(items=[models_pb2.Item(nr=7)])).save_graph()
+        self.assertEqual([7], list(models.ReconciledComfy.objects.latest('pk').items.values_list('nr', flat=True)))
+
+    def test_many_to_many_natural_key(self):
+        main = models.ReconciledMain.objects.create()
+        unlinked, kept = models.M2MRelation.objects.create(num=1), models.M2MRelation.objects.create(num=2)
+        main.m2m_field.add(unlinked, kept)
+
+        pb_relations = [models_pb2.M2MRelation(num=2), models_pb2.M2MRelation(num=3)]
+        result = reconcile.reconcile(main, 'm2m_field', pb_relations)
+        self.assertEqual((1, 0, 1), result)
+        self.assertEqual([2, 3], sorted(main.m2m_field.values_list('num', flat=True)))
+        self.assertEqual(kept.pk, main.m2m_field.get(num=2).pk)
+        self.assertTrue(models.M2MRelation.objects.filter(pk=unlinked.pk).exists())
+
+
+class ReferenceFieldTest(TestCase):
+
+    def test_id_assigned(self):
+        with self.assertNumQueries(0):
+            main = models.ReferencingMain().from_pb(models_pb2.Main(fk_field=models_pb2.Relation(id=5, num=1)))
+        self.assertEqual(5, main.fk_field_id)
+
+        main = models.ReferencingMain().from_pb(models_pb2.Main(fk_field=models_pb2.Relation(num=3)))
+        self.assertIsNone(main.fk_field.pk)
+        self.assertEqual(3, main.fk_field.num)
+
+    def test_from_pb_batch(self):
+        relations = [models.Relation.objects.create(num=num) for num in range(3)]
+        pb_mains = [
+            models_pb2.Main(string_field=str(i), fk_field=models_pb2.Relation(id=relations[i % 3].pk))
+            for i in range(10)
+        ]
+        with self.assertNumQueries(1):
+            mains = models.ReferencingMain.from_pb_batch(pb_mains)
+        with self.assertNumQueries(0):
+            self.assertEqual([i % 3 for i in range(10)], [main.fk_field.num for main in mains])
+
+        pb_mains.append(models_pb2.Main(fk_field=models_pb2.Relation(id=relations[-1].pk + 100)))
+        with self.assertRaisesRegexp(models.Relation.DoesNotExist, str(relations[-1].pk + 100)):
+            models.ReferencingMain.from_pb_batch(pb_mains)
+
+    def test_not_a_foreign_key(self):
+        with self.assertRaises(DjangoPBModelError):
+            class BadReference(ProtoBufMixin, dj_models.Model):
+                pb_model = models_pb2.Main
+                pb_2_dj_reference_fields = ['string_field']
+
+                string_field = dj_models.CharField(max_length=32)
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.addCleanup(metrics.disable)
+
+    def test_disabled(self):
+        models.Relation.objects.create(num=1).to_pb()
+        self.assertEqual({}, metrics.snapshot())
+
+    def test_conversions(self):
+        relation = models.Relation.objects.create(num=5)
+        metrics.enable()
+        pb_relation = relation.to_pb()
+        relation.to_pb()
+        models.Relation().from_pb(pb_relation)
+
+        stats = metrics.snapshot()['tests.Relation']
+        self.assertEqual((2, 2 * pb_relation.ByteSize(), 0), tuple(stats['to_pb'][k] for k in ('calls', 'bytes', 'errors')))
+        self.assertEqual((1, pb_relation.ByteSize()), (stats['from_pb']['calls'], stats['from_pb']['bytes']))
+        self.assertGreater(stats['to_pb']['seconds'], 0)
+        self.assertEqual({}, stats['to_pb']['fields'])
+        self.assertIn(
+            'pb_model_conversions_total{model="tests.Relation",operation="to_pb",field=""} 2\n', metrics.prometheus()
+        )
+
+    def test_queries_and_errors(self):
+        main = models.Main.objects.create(
+            string_field='main', integer_field=1, float_field=1, fk_field=models.Relation.objects.create()
+        )
+        main = models.Main.objects.get(pk=main.pk)
+        metrics.enable()
+        with CaptureQueriesContext(connection) as queries:
+            main.to_pb()
+        self.assertEqual(len(queries), metrics.snapshot()['tests.Main']['to_pb']['queries'])
+        self.assertGreater(len(queries), 0)
+
+        metrics.reset()
+        models.Main.objects.get(pk=main.pk).to_pb()  # without debug cursors
+        self.assertEqual(len(queries), metrics.snapshot()['tests.Main']['to_pb']['queries'])
+
+        with self.assertRaises(Exception):
+            models.SubBadFields.objects.create().to_pb()
+        self.assertEqual(1, metrics.snapshot()['tests.SubBadFields']['to_pb']['errors'])
+
+    def test_per_field(self):
+        relation = models.Relation.objects.create(num=5)
+        metrics.enable(per_field=True)
+        relation.to_pb()
+        fields_stats = metrics.snapshot()['tests.Relation']['to_pb']['fields']
+        self.assertEqual({'id', 'num'}, set(fields_stats))
+        self.assertEqual(models_pb2.Relation(num=5).ByteSize(), fields_stats['num']['bytes'])
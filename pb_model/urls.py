@@ -2,10 +2,28 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import absolute_import
-from django.conf.urls import patterns, url  # pragma: no cover
+from django.conf.urls import url
 
+from . import views
 
-urlpatterns = patterns(  # pragma: no cover
-    "",
-    url("^$", 'viewfunc', name='root-of-app'),
-)
+
+def pb_model_urls(model, prefix=None, **view_kwargs):
+    """List and detail url patterns of a ProtoBufMixin model
+
+    ``<prefix>/`` streams the list view, ``<prefix>/<pk>/`` serves one object.
+
+    :param model: ProtoBufMixin model class
+    :param prefix: url prefix, defaults to the model name
+    :param view_kwargs: passed to ``as_view()`` of both views, e.g. ``etag_field``
+    """
+    prefix = prefix if prefix is not None else model._meta.model_name
+    name = '{}-{}'.format(model._meta.app_label, model._meta.model_name)
+    return [
+        url(r'^{}/$'.format(prefix), views.ProtoBufListView.as_view(model=model, **view_kwargs),
+            name='{}-list'.format(name)),
+        url(r'^{}/(?P<pk>[^/]+)/$'.format(prefix), views.ProtoBufDetailView.as_view(model=model, **view_kwargs),
+            name='{}-detail'.format(name)),
+    ]
+
+
+urlpatterns = []
@@ -1,4 +1,173 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-# Create your views here.
+"""
+Generic views serving ``ProtoBufMixin`` models as ``application/x-protobuf``.
+
+``ProtoBufDetailView`` returns one serialized message, ``ProtoBufListView``
+streams a length-delimited sequence of messages (see ``pb_model.stream``)
+one keyset page at a time: ``?after=<pk>&limit=<n>``, the cursor of the next
+page is returned in the ``X-Next-Cursor`` header.
+
+With ``etag_field`` (e.g. an ``auto_now`` ``updated_at`` column) the ETag is
+computed from the database before anything is serialized, so a matching
+``If-None-Match`` is answered with 304 right away. Without it the detail view
+hashes the serialized message and the list view sends no ETag.
+
+``ProtoBufIngestView`` writes a POSTed length-delimited stream in batches.
+"""
+
+from __future__ import absolute_import
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Max
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import force_bytes
+from django.utils.http import quote_etag
+from django.views.generic import View
+from django.views.generic.detail import SingleObjectMixin
+from django.views.generic.list import MultipleObjectMixin
+
+from . import ingest, stream
+
+
+PROTOBUF_CONTENT_TYPE = 'application/x-protobuf'
+DELIMITED_CONTENT_TYPE = 'application/x-protobuf; delimited=true'
+
+
+def _hash(*parts):
+    return hashlib.sha1(b'\0'.join(force_bytes(part) for part in parts)).hexdigest()
+
+
+class ProtoBufResponseMixin(object):
+    """Common options of the protobuf views
+
+    :attr expand_level: passed to ``to_pb()``
+    :attr etag_field: model field whose value changes with every update of a row
+    """
+    expand_level = None
+    etag_field = None
+
+    def conditional_response(self, etag):
+        etag = quote_etag(etag)
+        response = get_conditional_response(self.request, etag=etag)
+        if response is not None:
+            response['ETag'] = etag
+        return response, etag
+
+    def serialize(self, obj):
+        return obj.to_pb(expand_level=self.expand_level).SerializeToString()
+
+
+class ProtoBufDetailView(ProtoBufResponseMixin, SingleObjectMixin, View):
+    """Serialized message of a single object, looked up like ``DetailView``"""
+
+    def get_etag_value(self):
+        """``etag_field`` of the object without loading the whole row"""
+        queryset = self.get_queryset()
+        pk, slug = self.kwargs.get(self.pk_url_kwarg), self.kwargs.get(self.slug_url_kwarg)
+        if pk is not None:
+            queryset = queryset.filter(pk=pk)
+        if slug is not None and (pk is None or self.query_pk_and_slug):
+            queryset = queryset.filter(**{self.get_slug_field(): slug})
+        values = list(queryset.values_list('pk', self.etag_field)[:2])
+        if len(values) != 1:
+            raise Http404("No {} found matching the query".format(queryset.model._meta.verbose_name))
+        return values[0]
+
+    def get(self, request, *args, **kwargs):
+        if self.etag_field:
+            response, etag = self.conditional_response(_hash(*self.get_etag_value()))
+            if response is not None:
+                return response
+            data = self.serialize(self.get_object())
+        else:
+            data = self.serialize(self.get_object())
+            response, etag = self.conditional_response(_hash(data))
+            if response is not None:
+                return response
+
+        response = HttpResponse(data, content_type=PROTOBUF_CONTENT_TYPE)
+        response['ETag'] = etag
+        return response
+
+
+class ProtoBufListView(ProtoBufResponseMixin, MultipleObjectMixin, View):
+    """Length-delimited stream of one keyset page of objects ordered by pk
+
+    :attr paginate_by: page size when ``limit`` is not given
+    :attr max_paginate_by: upper bound of ``limit``
+    """
+    paginate_by = 100
+    max_paginate_by = 1000
+
+    def get_page_params(self):
+        try:
+            after = self.request.GET.get('after')
+            if after is not None:
+                after = self.get_queryset().model._meta.pk.to_python(after)
+            limit = int(self.request.GET.get('limit', self.paginate_by))
+        except (TypeError, ValueError, ValidationError):
+            raise ValueError("Invalid 'after' or 'limit' parameter")
+        if limit <= 0:
+            raise ValueError("'limit' must be positive")
+        return after, min(limit, self.max_paginate_by)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            after, limit = self.get_page_params()
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+
+        queryset = self.get_queryset().order_by('pk')
+        if after is not None:
+            queryset = queryset.filter(pk__gt=after)
+        pks = list(queryset.values_list('pk', flat=True)[:limit + 1])
+        next_cursor = pks[limit - 1] if len(pks) > limit else None
+        page = queryset.filter(pk__lte=pks[min(limit, len(pks)) - 1]) if pks else queryset.none()
+
+        etag = None
+        if self.etag_field:
+            last_change = page.aggregate(last_change=Max(self.etag_field))['last_change']
+            response, etag = self.conditional_response(_hash(after, limit, pks[:limit], last_change))
+            if response is not None:
+                return response
+
+        response = StreamingHttpResponse(
+            (stream.delimited(self.serialize(obj)) for obj in page.iterator()),
+            content_type=DELIMITED_CONTENT_TYPE,
+        )
+        if etag is not None:
+            response['ETag'] = etag
+        if next_cursor is not None:
+            response['X-Next-Cursor'] = str(next_cursor)
+        return response
+
+
+class ProtoBufIngestView(View):
+    """Write a POSTed length-delimited stream of messages, see ``pb_model.ingest``
+
+    Responds with the per batch results as JSON, status 207 when a batch failed.
+    Wrap ``as_view()`` in ``csrf_exempt`` for machine clients.
+
+    :attr batch_size: number of messages per transaction
+    :attr max_message_size: reject larger messages
+    """
+    model = None
+    batch_size = 500
+    max_message_size = None
+    use_bulk_create = None
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        results = ingest.ingest(
+            self.model, request, batch_size=self.batch_size, use_bulk_create=self.use_bulk_create,
+            max_message_size=self.max_message_size,
+        )
+        failed = any(result['error'] for result in results)
+        return JsonResponse(
+            {'count': sum(result['count'] for result in results), 'batches': results},
+            status=207 if failed else 200,
+        )
@@ -28,6 +28,7 @@ settings.configure(
     },
     INSTALLED_APPS=[
         'pb_model',
+        'pb_model.outbox',
         'pb_model.tests',
     ],
     USE_TZ = True,